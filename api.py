@@ -12,10 +12,6 @@ from math import log
 
 import endpoints
 from protorpc import remote, message_types
-from google.appengine.ext import ndb
-from google.appengine.api import memcache
-
-from models.ndbModels import User, Game, Piece, Miss
 
 from models.responses import (
     StringMessage,
@@ -23,9 +19,12 @@ from models.responses import (
     GameStatusMessage,
     UserGames,
     PieceDetails,
+    FleetDetails,
     Rankings,
     GameHistory,
-    MoveDetails
+    MoveDetails,
+    AverageMoves,
+    StrikeSuggestion
 )
 
 from models.requests import (
@@ -34,61 +33,117 @@ from models.requests import (
     USER_GAMES_REQUEST,
     JOIN_GAME_REQUEST,
     PLACE_PIECE_REQUEST,
+    PLACE_FLEET_REQUEST,
     STRIKE_REQUEST,
-    GAME_REQUEST
+    SUGGEST_STRIKE_REQUEST,
+    GAME_REQUEST,
+    GAME_STATUS_REQUEST,
+    GAME_HISTORY_REQUEST
 )
 
+from storage import get_repository
+from storage.base import NameTakenError
+from storage.records import UserRecord, GameRecord, BoardRecord
+
 from utils.getters import (
-    get_by_urlsafe,
-    get_user,
-    get_registered_player,
     get_all_coords,
-    get_users_active_games,
+    encode_games_cursor,
+    decode_games_cursor,
     get_board_state,
-    get_players_pieces,
-    get_move_log,
-    get_strike_status
+    get_game_codec,
+    get_move_log
 )
 
 from utils.validators import (
     check_email,
     check_username_len,
-    check_user_exists,
-    check_email_exists,
+    check_username_not_reserved,
+    check_user_found,
+    check_email_unused,
+    check_game_exists,
+    check_player_registered,
     check_players_unique,
+    check_computer_opponent,
     check_game_open,
+    check_board_size,
     check_coords_validity,
     check_board_boundaries,
     check_game_not_started,
     check_placement_validity,
+    check_fleet_complete,
     check_game_not_over,
     check_game_started,
     check_not_self_strike,
     check_coord_validity,
-    check_not_double_hit,
-    check_not_double_miss
+    check_strike_validity,
+    check_history_page,
+    check_games_page_limit
+)
+
+from utils.transactions import run_game_update
+
+from utils.history import (
+    append_move,
+    encode_cursor,
+    decode_cursor
 )
 
 from utils.populate_form import (
     copy_user_to_form,
     copy_game_to_form,
     copy_piece_details_to_form,
+    copy_fleet_details_to_form,
     copy_move_log_to_form,
     copy_ranking_to_form,
-    copy_board_state_to_form
+    copy_board_state_to_form,
+    copy_cells_to_form
 )
 
-from board import (
-    PIECES,
-    COLUMNS,
-    ROWS
-)
+from utils.placement import random_fleet
+
+from utils.targeting import suggest_strike
+
+from utils.computer import is_computer, get_computer_player, COMPUTER_NAME
+
+from utils.engine import is_fleet_placed, strike, GameRecordState
+
+from utils.bitboard import MISS, HIT
+
+from utils.instrumentation import phase, InstrumentationMiddleware
+
+from board import PIECES
+
+DEFAULT_GAMES_PAGE = 20
+MAX_GAMES_PAGE = 100
 
 
 @endpoints.api(name='battle_ship', version='v1')
 class BattleshipAPI(remote.Service):
     """Battle Ship API"""
 
+    # Shared by every request. The backend is named by the
+    # BATTLESHIP_STORAGE environment variable, see storage/__init__.py
+    repository = get_repository()
+
+    def _get_game_id(self, game_key):
+        """Returns the id of the game a client's game key names"""
+        try:
+            return self.repository.get_game_id(game_key)
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid Key')
+
+    def _get_game(self, game_id):
+        game = self.repository.get_game(game_id)
+        check_game_exists(game)
+        return game
+
+    def _get_user(self, username):
+        """Takes in the name of a player/user, and returns their
+        UserRecord"""
+        user = self.repository.get_user(username)
+        check_user_found(user, username)
+        return user
+
 # - - - - User Methods  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(request_message=UserRequest,
@@ -108,6 +163,8 @@ class BattleshipAPI(remote.Service):
             endpoints.ConflictException: If the email is invalid.
             endpoints.ConflictException: If the username length
               is less than 3 characters.
+            endpoints.ConflictException: If the username is the
+              computer's.
             endpoints.ConflictException: If the username is already
               in use.
             endpoints.ConflictException: If the e-mail is already
@@ -115,30 +172,32 @@ class BattleshipAPI(remote.Service):
         """
         check_email(request.email)
         check_username_len(request.user_name)
-        check_user_exists(request.user_name)
-        check_email_exists(request.email)
-
-        user = User(name=request.user_name, email=request.email)
-        user.put()
+        # The computer's user is only added with it's first game
+        check_username_not_reserved(request.user_name, [COMPUTER_NAME])
+        check_email_unused(self.repository.get_user_by_email(request.email))
+
+        user = UserRecord(request.user_name, request.email)
+        try:
+            self.repository.add_user(user)
+        except NameTakenError:
+            raise endpoints.ConflictException(
+                'A User with that name already exists')
         return copy_user_to_form(user)
 
 # - - - - Game Methods  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _get_board_state_forms(self, game, player_one, player_two):
-        player_one_board_state = get_board_state(
-            game,
-            player_one)
+    def _get_board_state_forms(self, game, boards, board_format):
         # serialize the board states into protorpc forms
+        codec = get_game_codec(game)
         board_state_forms = {
             'player_one': copy_board_state_to_form(
-                player_one_board_state)
+                get_board_state(boards[game.player_one], codec),
+                board_format)
         }
-        if player_two is not None:
-            player_two_board_state = get_board_state(
-                game,
-                player_two)
+        if game.player_two is not None:
             board_state_forms['player_two'] = copy_board_state_to_form(
-                player_two_board_state)
+                get_board_state(boards[game.player_two], codec),
+                board_format)
         else:
             board_state_forms['player_two'] = None
         return board_state_forms
@@ -159,23 +218,51 @@ class BattleshipAPI(remote.Service):
             state, and the board states.
         Raises:
             endpoints.ConflictException: If player one and two are the same.
+            endpoints.ConflictException: If player one is the computer.
+            endpoints.BadRequestException: If the board size is invalid.
+            endpoints.BadRequestException: If a game against the computer
+              has a player two.
         """
         check_players_unique(request.player_one_name, request.player_two_name)
-        player_one = get_user(request.player_one_name)
-
-        if request.player_two_name:
-            player_two = get_user(request.player_two_name)
-            game = Game(player_one=player_one.key,
-                        player_turn=player_one.key,
-                        player_two=player_two.key)
+        if request.board_size is not None:
+            check_board_size(request.board_size)
+        if request.computer_opponent:
+            check_computer_opponent(request.player_two_name)
+            player_two_name = COMPUTER_NAME
         else:
-            player_two = None
-            game = Game(player_one=player_one.key, player_turn=player_one.key)
-        game.put()
+            player_two_name = request.player_two_name
+        # Both players are read at once
+        users = self.repository.get_users(
+            [name for name in (request.player_one_name, player_two_name)
+             if name])
+        check_user_found(users.get(request.player_one_name),
+                         request.player_one_name)
+        if is_computer(request.player_one_name):
+            raise endpoints.ConflictException(
+                'The computer can only play as player two')
+        if request.computer_opponent:
+            if COMPUTER_NAME not in users:
+                get_computer_player(self.repository)
+        elif player_two_name:
+            check_user_found(users.get(player_two_name), player_two_name)
+
+        game = GameRecord(request.player_one_name, player_two_name)
+        if request.board_size is not None:
+            game.board_size = request.board_size
+        boards = dict((name, BoardRecord(name)) for name in game.players)
+        auto_placed = [name for name in game.players
+                       if request.auto_place or is_computer(name)]
+        for name in auto_placed:
+            self._auto_place(game, boards[name])
+        # Boards of a new game are empty, so they are only stored once a
+        # piece is placed on them
+        self.repository.put_game(game, [boards[name] for name in auto_placed])
         board_state_forms = self._get_board_state_forms(game,
-                                                        player_one,
-                                                        player_two)
-        return copy_game_to_form(game, board_state_forms)
+                                                        boards,
+                                                        request.board_format)
+        return copy_game_to_form(self.repository.get_game_key(game),
+                                 game,
+                                 board_state_forms)
 
     @endpoints.method(request_message=JOIN_GAME_REQUEST,
                       response_message=GameStatusMessage,
@@ -193,34 +280,49 @@ class BattleshipAPI(remote.Service):
             state, and the board states.
         Raises:
             endpoints.BadRequestException: If the url safe game key is invalid.
+            endpoints.NotFoundException: If the game does not exist.
             endpoints.ConflictException: If game already has 2 players
               registered.
             endpoints.ConflictException: If the joining player is the same
               as the currently registered player.
+            GameContentionException: If the game kept being updated by
+              concurrent requests. The request may be retried.
         """
-        game = get_by_urlsafe(request.url_safe_game_key, Game)
-
-        check_game_open(game)
-
-        player_two = get_user(request.player_two_name)
-        player_one = game.player_one.get()
-
-        check_players_unique(player_one.name, player_two.name)
+        game_id = self._get_game_id(request.url_safe_game_key)
+        player_two = self._get_user(request.player_two_name)
+
+        def join(game):
+            check_game_open(game)
+            check_players_unique(game.player_one, player_two.name)
+
+            boards = self.repository.get_boards(game)
+            game.player_two = player_two.name
+            board = boards[player_two.name] = BoardRecord(player_two.name)
+            if request.auto_place or is_computer(player_two.name):
+                self._auto_place(game, board)
+                self.repository.put_game(game, [board])
+            else:
+                self.repository.put_game(game)
+            return game, boards
 
-        game.player_two = player_two.key
-        game.put()
+        game, boards = run_game_update(self.repository,
+                                       'join_game',
+                                       game_id,
+                                       join)
         board_state_forms = self._get_board_state_forms(game,
-                                                        player_one,
-                                                        player_two)
-        return copy_game_to_form(game, board_state_forms)
+                                                        boards,
+                                                        request.board_format)
+        return copy_game_to_form(self.repository.get_game_key(game),
+                                 game,
+                                 board_state_forms)
 
 # - - - - Place piece methods - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _update_game_started_status(self, game, player, player_pieces):
-        """Checks if all of the pieces for a given player are loaded,
-        and if that is true for both of a Game's players, start the game"""
-        if len(player_pieces) == len(PIECES):
-            if player.key == game.player_one:
+    def _update_game_started_status(self, game, board):
+        """Checks if all of the pieces of a board's player are loaded,
+        and if that is true for both of a game's players, start the game"""
+        if is_fleet_placed(board):
+            if board.player == game.player_one:
                 game.player_one_pieces_loaded = True
             else:
                 game.player_two_pieces_loaded = True
@@ -228,7 +330,46 @@ class BattleshipAPI(remote.Service):
             if (game.player_one_pieces_loaded is True and
                     game.player_two_pieces_loaded is True):
                 game.game_started = True
-            game.put()
+
+    def _auto_place(self, game, board):
+        """Places a random fleet on a player's empty board"""
+        board.fleet = random_fleet(get_game_codec(game))
+        self._update_game_started_status(game, board)
+
+    def _get_piece_coords(self, placement, codec):
+        """Validates a piece placement against the bounds of the board,
+        described by the game's BoardCodec.
+        Returns:
+            The piece type, and all of the coordinates of the piece"""
+        piece_type = placement.piece_type.name
+        first_row_coordinate = placement.first_row_coordinate
+        first_column_coordinate = placement.first_column_coordinate.upper()
+        piece_alignment = placement.piece_alignment.name
+
+        # Raise errors if the row or column coordinates are not valid
+        check_coords_validity(first_row_coordinate,
+                              first_column_coordinate,
+                              codec)
+
+        num_spaces = PIECES[piece_type]['spaces']
+        row_index = codec.row_index[first_row_coordinate]
+        col_index = codec.column_index[first_column_coordinate]
+
+        # Raise errors if the peice is being placed outside
+        # of the bounds of the board
+        check_board_boundaries(piece_alignment,
+                               num_spaces,
+                               row_index,
+                               col_index,
+                               codec)
+
+        # Get all coordinates of the piece based on it's
+        # starting coordinates and piece size
+        return piece_type, get_all_coords(piece_alignment,
+                                          num_spaces,
+                                          row_index,
+                                          col_index,
+                                          codec)
 
     @endpoints.method(request_message=PLACE_PIECE_REQUEST,
                       response_message=PieceDetails,
@@ -246,6 +387,7 @@ class BattleshipAPI(remote.Service):
             and the player's board states.
         Raises:
             endpoints.BadRequestException: If the url safe game key is invalid.
+            endpoints.NotFoundException: If the game does not exist.
             endpoints.ConflictException: If row or column coordinates
               are invalid.
             endpoints.ConflictException: If any of the spaces the piece
@@ -257,136 +399,236 @@ class BattleshipAPI(remote.Service):
               placed for given player.
             endpoints.ConflictException: If the piece intersects with
               another piece that has already been placed.
+            GameContentionException: If the game kept being updated by
+              concurrent requests. The request may be retried.
         """
-        piece_type = request.piece_type.name
-        first_row_coordinate = request.first_row_coordinate
-        first_column_coordinate = request.first_column_coordinate.upper()
-        piece_alignment = request.piece_alignment.name
-        player_name = request.player_name
-        url_safe_game_key = request.url_safe_game_key
-
-        # Raise errors if the row or column coordinates are not valid
-        check_coords_validity(first_row_coordinate, first_column_coordinate)
-
-        num_spaces = PIECES[piece_type]['spaces']
-        row_index = ROWS.index(first_row_coordinate)
-        col_index = COLUMNS.index(first_column_coordinate)
-
-        # Raise errors if the peice is being placed outside
-        # of the bounds of the board
-        check_board_boundaries(piece_alignment,
-                               num_spaces,
-                               row_index,
-                               col_index)
-
-        # Get all coordinates of the piece based on it's
-        # starting coordinates and piece size
-        coordinates = get_all_coords(piece_alignment,
-                                     num_spaces,
-                                     row_index,
-                                     col_index)
-
-        game = get_by_urlsafe(url_safe_game_key, Game)
-
-        # Raise error if all of the pieces for this player
-        # and this game have been placed already
-        check_game_not_started(game)
-
-        player = get_registered_player(game, player_name)
-        player_pieces = get_players_pieces(game, player)
-
-        # Errors based on player's previously placed pieces for this game
-        check_placement_validity(game,
-                                 player_pieces,
-                                 piece_type,
-                                 coordinates)
-
-        piece = Piece(game=game.key,
-                      player=player.key,
-                      ship=piece_type,
-                      coordinates=coordinates)
-        piece.put()
-        # I don't know why, but piece.put() needs to be called twice
-        # otherwie the response has an un-updated baord state
-        piece.put()
-        player_pieces.append(piece)
-
-        # Check if all pieces for this player & game have been placed
-        self._update_game_started_status(game, player, player_pieces)
-
-        player_one = game.player_one.get()
-        player_two = game.player_two.get()
-        board_state_forms = self._get_board_state_forms(game,
-                                                        player_one,
-                                                        player_two)
+        game_id = self._get_game_id(request.url_safe_game_key)
+        with phase('load'):
+            player = self._get_user(request.player_name)
+
+        def place(game):
+            codec = get_game_codec(game)
+            with phase('validation'):
+                piece_type, coordinates = self._get_piece_coords(request,
+                                                                 codec)
+                # Raise error if all of the pieces for this player
+                # and this game have been placed already
+                check_game_not_started(game)
+
+                check_player_registered(game, player.name)
+            with phase('load'):
+                boards = self.repository.get_boards(game)
+            board = boards[player.name]
+            piece_mask = codec.coords_mask(coordinates)
+
+            with phase('validation'):
+                # Errors based on player's previously placed pieces
+                # for this game
+                check_placement_validity(board,
+                                         piece_type,
+                                         piece_mask,
+                                         codec)
+
+            board.fleet[piece_type] = piece_mask
+
+            # Check if all pieces for this player & game have been placed
+            self._update_game_started_status(game, board)
+
+            self.repository.put_game(game, [board])
+            return game, boards, piece_type, coordinates
+
+        with phase('mutate'):
+            game, boards, piece_type, coordinates = run_game_update(
+                self.repository, 'place_piece', game_id, place)
+
+        with phase('serialize'):
+            board_state_forms = self._get_board_state_forms(
+                game, boards, request.board_format)
+
+            return copy_piece_details_to_form(
+                self.repository.get_game_key(game),
+                player.name,
+                piece_type,
+                coordinates,
+                board_state_forms)
+
+    @endpoints.method(request_message=PLACE_FLEET_REQUEST,
+                      response_message=FleetDetails,
+                      path='game/place_fleet/{url_safe_game_key}',
+                      name='game.place_fleet',
+                      http_method='POST')
+    def place_fleet(self, request):
+        """Places all of a player's pieces at once
 
-        return copy_piece_details_to_form(game,
-                                          player,
-                                          piece,
-                                          board_state_forms)
+        Args:
+            request: The PLACE_FLEET_REQUEST object.
+        Returns:
+            FleetDetails: A form sent to the client, containing the placed
+            pieces' coordinates, whether the game has started, and the
+            player's board state.
+        Raises:
+            endpoints.BadRequestException: If the url safe game key is invalid.
+            endpoints.NotFoundException: If the game does not exist.
+            endpoints.ConflictException: If there is not exactly one of each
+              piece.
+            endpoints.ConflictException: If any row or column coordinates
+              are invalid.
+            endpoints.ConflictException: If any piece is placed outside of
+              the board.
+            endpoints.ConflictException: If the game has already started.
+            endpoints.ConflictException: If the player is not registered
+              to the game.
+            endpoints.ConflictException: If any piece has already been
+              placed for the player.
+            endpoints.ConflictException: If any pieces intersect.
+            GameContentionException: If the game kept being updated by
+              concurrent requests. The request may be retried.
+        """
+        with phase('validation'):
+            check_fleet_complete([placement.piece_type.name
+                                  for placement in request.pieces])
+        game_id = self._get_game_id(request.url_safe_game_key)
+        with phase('load'):
+            player = self._get_user(request.player_name)
+
+        def place(game):
+            codec = get_game_codec(game)
+            with phase('validation'):
+                pieces = [self._get_piece_coords(placement, codec)
+                          for placement in request.pieces]
+                check_game_not_started(game)
+                check_player_registered(game, player.name)
+            with phase('load'):
+                board = self.repository.get_boards(game)[player.name]
+
+            # Each piece is checked against the previously placed pieces
+            # and the pieces before it
+            for piece_type, coordinates in pieces:
+                piece_mask = codec.coords_mask(coordinates)
+                with phase('validation'):
+                    check_placement_validity(board,
+                                             piece_type,
+                                             piece_mask,
+                                             codec)
+                board.fleet[piece_type] = piece_mask
+
+            self._update_game_started_status(game, board)
+            self.repository.put_game(game, [board])
+            return game, board, pieces
+
+        with phase('mutate'):
+            game, board, pieces = run_game_update(self.repository,
+                                                  'place_fleet',
+                                                  game_id,
+                                                  place)
+        with phase('serialize'):
+            return copy_fleet_details_to_form(
+                self.repository.get_game_key(game),
+                game,
+                player.name,
+                pieces,
+                copy_board_state_to_form(
+                    get_board_state(board, get_game_codec(game)),
+                    request.board_format))
 
 # - - - - Strike Coord Methods  - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _change_player_turn(self, game):
-        """Changes game's current player to the other registered player"""
-        if game.player_turn == game.player_one:
-            game.player_turn = game.player_two
-        else:
-            game.player_turn = game.player_one
-        game.put()
-
-    def _update_piece_sunk_status(self, piece):
-        if sorted(piece.coordinates) == sorted(piece.hit_marks):
-            piece.sunk = True
-            piece.put()
-        return piece.sunk
-
-    def _update_game_over_status(self, game, attacking_player, target_player):
-        target_player_pieces = get_players_pieces(game, target_player)
-        for piece in target_player_pieces:
-            if piece.sunk is False:
-                return game.game_over
-        game.game_over = True
-        game.winner = attacking_player.key
-        game.put()
-        return game.game_over
-
-    def _strike_board_state_forms(self, game, attacking_player, target_player):
-        attacking_player_board_state = get_board_state(
-            game,
-            attacking_player)
-        target_player_board_state = get_board_state(
-            game,
-            target_player)
+    def _strike_board_state_forms(self,
+                                  attacking_player_board,
+                                  target_player_board,
+                                  board_format,
+                                  codec):
         # serialize the board states into protorpc forms
         board_state_forms = {
             'attacking_player': copy_board_state_to_form(
-                attacking_player_board_state),
+                get_board_state(attacking_player_board, codec),
+                board_format),
             'target_player': copy_board_state_to_form(
-                target_player_board_state)
+                get_board_state(target_player_board, codec),
+                board_format)
         }
         return board_state_forms
 
-    def _log_history(self, game, attacking_player, target_player, move_log):
-        game.history.append(move_log)
-        game.put()
-        board_state_forms = self._strike_board_state_forms(game,
-                                                           attacking_player,
-                                                           target_player)
-
-        return copy_move_log_to_form(len(game.history) - 1,
-                                     move_log,
-                                     board_state_forms['target_player'],
-                                     board_state_forms['attacking_player'])
-
-    def _log_hit(self, game, piece, target_coord):
-        piece.hit_marks.append(target_coord)
-        piece.put()
-
-    def _log_miss(self, game, attacking_player, target_player, target_coord):
-        Miss(game=game.key,
-             target_player=target_player.key,
-             coordinate=target_coord).put()
+    def _set_changed_cells(self, move_form, move_log, target_board, codec):
+        """Sets the cells of the target's board changed by a move on it's
+        form, for delta requests"""
+        if move_log['status'] == 'Miss':
+            move_form.changed_cells = copy_cells_to_form(
+                [move_log['target_coordinate']], MISS, codec)
+        else:
+            move_form.changed_cells = copy_cells_to_form(
+                [move_log['target_coordinate']], HIT, codec)
+        if 'Sunk' in move_log['status']:
+            move_form.sunk_ship_cells = copy_cells_to_form(
+                codec.mask_coords(target_board.fleet[move_log['ship_type']]),
+                HIT,
+                codec)
+
+    def _copy_move_to_form(self,
+                           game,
+                           move_number,
+                           attacking_player_board,
+                           target_player_board,
+                           move_log,
+                           board_format,
+                           delta):
+        """Serializes the move that was appended to the game's history.
+        For delta requests only the cells changed by the move are sent,
+        rather than both of the boards"""
+        codec = get_game_codec(game)
+        if delta:
+            move_form = copy_move_log_to_form(move_number - 1, move_log)
+            self._set_changed_cells(move_form,
+                                    move_log,
+                                    target_player_board,
+                                    codec)
+        else:
+            board_state_forms = self._strike_board_state_forms(
+                attacking_player_board,
+                target_player_board,
+                board_format,
+                codec)
+            move_form = copy_move_log_to_form(
+                move_number - 1,
+                move_log,
+                board_state_forms['target_player'],
+                board_state_forms['attacking_player'])
+
+        move_form.board_version = game.version
+        return move_form
+
+    def _apply_strike(self,
+                      game,
+                      boards,
+                      attacking_name,
+                      target_name,
+                      target_coord,
+                      codec):
+        """Makes the attacking player's strike on the target player's board
+        with the rules of utils/engine.py, which count the move, and end
+        the game or hand the turn over, then appends the move to the
+        board's history. It must be the attacking player's turn. The target
+        player's board is not put.
+        Returns:
+            The move's number and it's move log"""
+        target_board = boards[target_name]
+        target_bit = codec.coord_bit(target_coord)
+
+        check_strike_validity(target_board, target_bit)
+        strike_status, ship = strike(GameRecordState(game, boards),
+                                     target_bit)
+        move_log = get_move_log(target_name,
+                                attacking_name,
+                                target_coord,
+                                strike_status,
+                                piece_name=ship)
+        append_move(target_board,
+                    codec,
+                    game.move_count,
+                    target_coord,
+                    move_log['status'],
+                    ship)
+        return game.move_count, move_log
 
     @endpoints.method(request_message=STRIKE_REQUEST,
                       response_message=MoveDetails,
@@ -405,6 +647,7 @@ class BattleshipAPI(remote.Service):
             the game, and the game's board states.
         Raises:
             endpoints.BadRequestException: If the url safe game key is invalid.
+            endpoints.NotFoundException: If the game does not exist.
             endpoints.ConflictException: If the game is already over.
             endpoints.ConflictException: If the game has not yet started
               (all of the pieces for both players have not been placed).
@@ -416,76 +659,136 @@ class BattleshipAPI(remote.Service):
               been struck and hit.
             endpoints.ConflictException: If the coordinate has already
               been struck and missed.
+            GameContentionException: If the game kept being updated by
+              concurrent requests. The request may be retried.
         """
-        game = get_by_urlsafe(request.url_safe_game_key, Game)
-
-        check_game_not_over(game)
-
-        check_game_started(game)
-
-        attacking_player = game.player_turn.get()
-        target_player = get_registered_player(game,
-                                              request.target_player)
-
-        # Ensure attacking_player and target_player are NOT the same
-        check_not_self_strike(game, target_player)
+        game_id = self._get_game_id(request.url_safe_game_key)
+        with phase('load'):
+            target_player = self._get_user(request.target_player)
 
         target_coord = request.coordinate.upper()
 
-        check_coord_validity(target_coord)
-
-        target_player_pieces = get_players_pieces(game, target_player)
-
-        # Ensure a coordinate that has been
-        # previously hit is not being hit again
-        check_not_double_hit(target_player_pieces, target_coord)
-
-        # Coordinates that have been previously attempted and
-        # missed against target player
-        check_not_double_miss(game, target_player, target_coord)
-
-        self._change_player_turn(game)
-
-        # If a ship is hit
-        for piece in target_player_pieces:
-            if target_coord in piece.coordinates:
-                self._log_hit(game, piece, target_coord)
-                # check if piece sunk and update datastore if so
-                piece_sunk = self._update_piece_sunk_status(piece)
-                # check if game_over and update datastore if so
-                game_over = self._update_game_over_status(game,
-                                                          attacking_player,
-                                                          target_player)
-                strike_status = get_strike_status(game_over, piece_sunk)
-
-                move_log = get_move_log(target_player,
-                                        attacking_player,
-                                        target_coord,
-                                        strike_status,
-                                        piece_name=piece.ship)
-                return self._log_history(game,
-                                         attacking_player,
-                                         target_player,
-                                         move_log)
-
-        # If no ship is hit
-        self._log_miss(game,
-                       attacking_player,
-                       target_player,
-                       target_coord)
-
-        move_log = get_move_log(target_player,
-                                attacking_player,
-                                target_coord,
-                                'Miss')
-        return self._log_history(game,
-                                 attacking_player,
-                                 target_player,
-                                 move_log)
+        def play(game):
+            codec = get_game_codec(game)
+            with phase('validation'):
+                check_coord_validity(target_coord, codec)
+
+                check_game_not_over(game)
+
+                check_game_started(game)
+
+                check_player_registered(game, target_player.name)
+
+                # Ensure attacking_player and target_player are NOT the same
+                check_not_self_strike(game, target_player.name)
+
+            with phase('load'):
+                boards = self.repository.get_boards(game)
+            attacking_name = game.player_turn
+            move_number, move_log = self._apply_strike(game,
+                                                       boards,
+                                                       attacking_name,
+                                                       target_player.name,
+                                                       target_coord,
+                                                       codec)
+            changed = [boards[target_player.name]]
+            computer_move = None
+
+            # The computer opponent strikes back right away
+            if not game.game_over and is_computer(game.player_turn):
+                computer_coord = suggest_strike(
+                    boards[attacking_name], codec)[0]
+                computer_move = self._apply_strike(game,
+                                                   boards,
+                                                   target_player.name,
+                                                   attacking_name,
+                                                   computer_coord,
+                                                   codec)
+                changed.append(boards[attacking_name])
+
+            # The result of a game that ends is counted by the repository,
+            # in the same write
+            self.repository.put_game(game, changed)
+            return (game,
+                    move_number,
+                    boards[attacking_name],
+                    boards[target_player.name],
+                    move_log,
+                    computer_move)
+
+        with phase('mutate'):
+            (game,
+             move_number,
+             attacking_board,
+             target_board,
+             move_log,
+             computer_move) = run_game_update(self.repository,
+                                              'strike_coord',
+                                              game_id,
+                                              play)
+        codec = get_game_codec(game)
+        with phase('serialize'):
+            move_form = self._copy_move_to_form(game,
+                                                move_number,
+                                                attacking_board,
+                                                target_board,
+                                                move_log,
+                                                request.board_format,
+                                                request.delta)
+            if computer_move:
+                computer_number, computer_log = computer_move
+                move_form.computer_move = copy_move_log_to_form(
+                    computer_number - 1, computer_log)
+                # The computer struck the attacking player's board
+                if request.delta:
+                    self._set_changed_cells(move_form.computer_move,
+                                            computer_log,
+                                            attacking_board,
+                                            codec)
+        return move_form
+
+    @endpoints.method(request_message=SUGGEST_STRIKE_REQUEST,
+                      response_message=StrikeSuggestion,
+                      path='game/suggest_strike/{url_safe_game_key}',
+                      name='game.suggest_strike',
+                      http_method='GET')
+    def get_strike_suggestion(self, request):
+        """Suggests the coordinate a player should strike next
+
+        Args:
+            request: The SUGGEST_STRIKE_REQUEST object.
+        Returns:
+            StrikeSuggestion: A form sent to the client, containing the
+            coordinate of the opponent's board most likely to hit a ship,
+            given the hits and misses so far.
+        Raises:
+            endpoints.BadRequestException: If the url safe game key is invalid.
+            endpoints.NotFoundException: If the game does not exist.
+            endpoints.ConflictException: If the game is already over.
+            endpoints.ConflictException: If the game has not yet started.
+            endpoints.ConflictException: If the player is not registered
+              to the game.
+        """
+        game_id = self._get_game_id(request.url_safe_game_key)
+        player = self._get_user(request.player_name)
+        game = self._get_game(game_id)
+        check_game_not_over(game)
+        check_game_started(game)
+        check_player_registered(game, player.name)
+        boards = self.repository.get_boards(game)
+        if player.name == game.player_one:
+            target_board = boards[game.player_two]
+        else:
+            target_board = boards[game.player_one]
+        coordinate, mode, probability = suggest_strike(target_board,
+                                                       get_game_codec(game))
+        return StrikeSuggestion(coordinate=coordinate,
+                                mode=mode,
+                                probability=probability)
 
 # - - - - Info Methods  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    @endpoints.method(request_message=GAME_REQUEST,
+    @endpoints.method(request_message=GAME_STATUS_REQUEST,
                       response_message=GameStatusMessage,
                       path='game/status/{url_safe_game_key}',
                       name='game.get_game_status',
@@ -494,47 +797,49 @@ class BattleshipAPI(remote.Service):
         """Get a game's current status
 
         Args:
-            request: The GAME_REQUEST object.
+            request: The GAME_STATUS_REQUEST object.
         Returns:
             GameStatusMessage: A form sent to the client, containing the
             game's details including information on the game's player, the game
-            state, and the board states.
+            state, and the board states. If the game's version is still
+            if_version, only the game key, version and not_modified.
         Raises:
             endpoints.BadRequestException: If the url safe game key is invalid.
+            endpoints.NotFoundException: If the game does not exist.
         """
-        game = get_by_urlsafe(request.url_safe_game_key, Game)
-        player_one = game.player_one.get()
-        player_two = game.player_two.get()
+        game_key = request.url_safe_game_key
+        game_id = self._get_game_id(game_key)
+        game = None
+        version = self.repository.get_cached_version(game_key)
+        if version is None:
+            game = self._get_game(game_id)
+            version = game.version
+            self.repository.add_cached_version(game_key, version)
+
+        if request.if_version == version:
+            return GameStatusMessage(game_key=game_key,
+                                     version=version,
+                                     not_modified=True)
+
+        cached_forms = self.repository.get_cached_views({game_key: version},
+                                                        request.board_format)
+        if game_key in cached_forms:
+            return cached_forms[game_key]
+
+        if game is None:
+            game = self._get_game(game_id)
+        boards = self.repository.get_boards(game)
         board_state_forms = self._get_board_state_forms(game,
-                                                        player_one,
-                                                        player_two)
-        return copy_game_to_form(game, board_state_forms)
+                                                        boards,
+                                                        request.board_format)
+        game_form = copy_game_to_form(self.repository.get_game_key(game),
+                                      game,
+                                      board_state_forms)
+        self.repository.cache_views([game_form], request.board_format)
+        return game_form
 
 # - - - - Extended Methods  - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _win_loss_list(self, games):
-        """Returns a dict of wins and losses for each user by querying a
-        list of all games with status game_over == True"""
-        win_loss = {}
-        for game in games:
-            game_winner = game.winner
-            if game_winner == game.player_one:
-                game_loser = game.player_two
-            else:
-                game_loser = game.player_one
-            game_winner = game_winner.get().name
-            game_loser = game_loser.get().name
-
-            if game_winner in win_loss:
-                win_loss[game_winner]['won'] += 1
-            else:
-                win_loss[game_winner] = {'won': 1, 'lost': 0}
-            if game_loser in win_loss:
-                win_loss[game_loser]['lost'] += 1
-            else:
-                win_loss[game_loser] = {'won': 0, 'lost': 1}
-        return win_loss
-
     def _assign_rankings(self, win_loss, total_games):
         """Takes in a dict of wins & losses by user, returns list of rankings
         based on the reatio of their wins compared to losses, and the total
@@ -574,32 +879,80 @@ class BattleshipAPI(remote.Service):
                       name='game.get_user_games',
                       http_method='GET')
     def get_user_games(self, request):
-        """Returns all of a User's active games
+        """Returns one page of a User's games
 
         Args:
             request: The USER_GAMES_REQUEST object.
         Returns:
             UserGames: A form sent to the client, containing each of a user's
-            active game's details which include information on the
-            games state, and the board states.
+            game's details which include information on the games state, and
+            the board states unless include_boards is false. next_cursor is
+            set if there are more games.
         Raises:
             endpoints.ConflictException: If the user does not exist.
+            endpoints.BadRequestException: If the cursor or limit is invalid.
         """
-        user = get_user(request.user_name)
-        active_games = get_users_active_games(user)
-        active_games_forms = []
-        for game in active_games:
-            player_one = game.player_one.get()
-            if game.player_two:
-                player_two = game.player_two.get()
-            else:
-                player_two = None
-            board_state_forms = self._get_board_state_forms(game,
-                                                            player_one,
-                                                            player_two)
-            active_games_forms.append(copy_game_to_form(game,
-                                                        board_state_forms))
-        return UserGames(games=active_games_forms)
+        limit = request.limit or DEFAULT_GAMES_PAGE
+        check_games_page_limit(limit, MAX_GAMES_PAGE)
+        status = request.status.name if request.status else None
+        order = request.order.name
+        cursor = None
+        if request.cursor:
+            # Cursors hold the status and order of their listing, so one
+            # from a different listing is rejected here
+            try:
+                cursor = decode_games_cursor(request.cursor, status, order)
+            except ValueError:
+                raise endpoints.BadRequestException('Invalid cursor')
+        user = self._get_user(request.user_name)
+        try:
+            games, next_cursor = self.repository.get_user_games(user.name,
+                                                                status,
+                                                                order,
+                                                                limit,
+                                                                cursor)
+        except ValueError:
+            # A cursor the backend can not resume the listing from
+            raise endpoints.BadRequestException('Invalid cursor')
+        user_games = UserGames()
+        if next_cursor:
+            user_games.next_cursor = encode_games_cursor(next_cursor,
+                                                         status,
+                                                         order)
+
+        game_keys = dict((game.id, self.repository.get_game_key(game))
+                         for game in games)
+        if not request.include_boards:
+            no_boards = {'player_one': None, 'player_two': None}
+            user_games.games = [copy_game_to_form(game_keys[game.id],
+                                                  game,
+                                                  no_boards)
+                                for game in games]
+            return user_games
+
+        cached_forms = self.repository.get_cached_views(
+            dict((game_keys[game.id], game.version) for game in games),
+            request.board_format)
+        uncached_games = [game for game in games
+                          if game_keys[game.id] not in cached_forms]
+
+        # Boards of every uncached game are fetched in one batch
+        games_boards = self.repository.get_games_boards(uncached_games)
+        new_forms = []
+        for game in uncached_games:
+            board_state_forms = self._get_board_state_forms(
+                game,
+                games_boards[game.id],
+                request.board_format)
+            new_forms.append(copy_game_to_form(game_keys[game.id],
+                                               game,
+                                               board_state_forms))
+        self.repository.cache_views(new_forms, request.board_format)
+
+        forms = dict((form.game_key, form) for form in new_forms)
+        forms.update(cached_forms)
+        user_games.games = [forms[game_keys[game.id]] for game in games]
+        return user_games
 
     @endpoints.method(request_message=GAME_REQUEST,
                       response_message=StringMessage,
@@ -617,14 +970,17 @@ class BattleshipAPI(remote.Service):
         Raises:
             endpoints.ConflictException: If the game is already over.
             endpoints.BadRequestException: if url safe game key is invalid.
+            endpoints.NotFoundException: If the game does not exist.
+            GameContentionException: If the game kept being updated by
+              concurrent requests. The request may be retried.
         """
-        game = get_by_urlsafe(request.url_safe_game_key, Game)
-        check_game_not_over(game)
-        game_pieces = Piece.query(Piece.game == game.key).fetch(keys_only=True)
-        game_misses = Miss.query(Miss.game == game.key).fetch(keys_only=True)
-        ndb.delete_multi(game_pieces)
-        ndb.delete_multi(game_misses)
-        game.key.delete()
+        game_id = self._get_game_id(request.url_safe_game_key)
+
+        def cancel(game):
+            check_game_not_over(game)
+            self.repository.delete_game(game)
+
+        run_game_update(self.repository, 'cancel_game', game_id, cancel)
         return StringMessage(message="Game deleted")
 
     @endpoints.method(request_message=message_types.VoidMessage,
@@ -644,17 +1000,34 @@ class BattleshipAPI(remote.Service):
         Raises: none
         """
 
-        completed_games = Game.query().filter(Game.game_over == True).fetch()
-        total_games = len(completed_games)
+        win_loss = self.repository.get_win_loss()
+        # Every completed game has exactly one winner
+        total_games = sum(user['won'] for user in win_loss.itervalues())
         if total_games == 0:
             raise endpoints.ConflictException('No games have been played')
-        win_loss = self._win_loss_list(completed_games)
         rankings = self._assign_rankings(win_loss, total_games)
         sorted_rankings = self._sort_rankings(rankings)
         return Rankings(rankings=[copy_ranking_to_form(index, score)
                         for index, score in enumerate(sorted_rankings)])
 
-    @endpoints.method(request_message=GAME_REQUEST,
+    @endpoints.method(request_message=message_types.VoidMessage,
+                      response_message=AverageMoves,
+                      path='games/average_moves',
+                      name='get_average_moves',
+                      http_method='GET')
+    def get_average_moves(self, request):
+        """Gets the average number of moves of the finished games
+
+        Args:
+            request: The VoidMessage object.
+        Returns:
+            AverageMoves: A form sent to the client, containing the number
+            of finished games and their average number of moves.
+        """
+        finished, average = self.repository.get_average_moves()
+        return AverageMoves(finished_games=finished, average_moves=average)
+
+    @endpoints.method(request_message=GAME_HISTORY_REQUEST,
                       response_message=GameHistory,
                       path='game/history/{url_safe_game_key}',
                       name='game.get_game_history',
@@ -663,31 +1036,46 @@ class BattleshipAPI(remote.Service):
         """Gets history of all moves played for a given game
 
         Args:
-            request: The GAME_REQUEST object.
+            request: The GAME_HISTORY_REQUEST object.
         Returns:
             GameHistory: A form sent to the client, contain each move that has
             occured for the life of the game, and the details of each move.
+            If the game's version is still if_version, only the version
+            and not_modified. Only moves after since_move, or from the cursor
+            on, are sent, up to limit moves. next_cursor is set if there
+            are more moves after them.
         Raises:
-            endpoints.BadRequestException: If the url safe game key is invalid.
+            endpoints.BadRequestException: If the url safe game key, the
+            cursor, since_move or limit is invalid.
+            endpoints.NotFoundException: If the game does not exist.
         """
 
-        game_history = get_by_urlsafe(request.url_safe_game_key, Game).history
-        return GameHistory(moves=[copy_move_log_to_form(index, move)
-                           for index, move in enumerate(game_history)])
-
-    @staticmethod
-    def _cache_average_moves():
-        """Populates memcache with the average number of moves per Game"""
-        games = Game.query(Game.game_over == True).fetch()
-        num_games = len(games)
-        sum_history = 0
-        for game in games:
-            if game.game_history:
-                sum_history += len(game.game_history)
-        average = float(sum_history) / num_games
-        memcache.set(key='MOVES_PER_GAME',
-                     value='The average moves per game is {:.2f}'
-                     .format(average))
-
-
-api = endpoints.api_server([BattleshipAPI])
+        check_history_page(request.since_move, request.limit)
+        start = request.since_move or 0
+        if request.cursor:
+            try:
+                start = max(start, decode_cursor(request.cursor))
+            except ValueError:
+                raise endpoints.BadRequestException('Invalid cursor')
+        game_id = self._get_game_id(request.url_safe_game_key)
+        version = self.repository.get_cached_version(
+            request.url_safe_game_key)
+        if version is not None and request.if_version == version:
+            return GameHistory(version=version, not_modified=True)
+        game = self._get_game(game_id)
+        if request.if_version == game.version:
+            return GameHistory(version=game.version, not_modified=True)
+        # One extra move tells whether there is a next page
+        moves = self.repository.get_history(
+            game, start, request.limit and request.limit + 1)
+        history = GameHistory(version=game.version)
+        if request.limit and len(moves) > request.limit:
+            moves = moves[:request.limit]
+            history.next_cursor = encode_cursor(start + request.limit)
+        history.moves = [copy_move_log_to_form(index, move)
+                         for index, move in moves]
+        return history
+
+
+# Every request is instrumented, see utils/instrumentation.py
+api = InstrumentationMiddleware(endpoints.api_server([BattleshipAPI]))
@@ -0,0 +1,3 @@
+"""Benchmarks of every BattleshipAPI endpoint against the App Engine
+testbed stubs, with the datastore calls of each checked against the
+budgets in benchmarks/budgets.json. See benchmarks/run.py."""
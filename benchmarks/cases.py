@@ -0,0 +1,209 @@
+"""The benchmarked calls of every BattleshipAPI endpoint.
+
+Each case builds a fresh request with prepare, on state it creates through
+the API when it needs to, so calls that change a game can be repeated.
+Only the call itself is timed and has it's RPCs counted."""
+
+import endpoints
+from protorpc import message_types
+
+from benchmarks.fixtures import request
+from board import PIECES
+from models.requests import (
+    NewGameRequest,
+    UserRequest,
+    PieceType,
+    Alignment,
+    PiecePlacement,
+    GameStatus,
+    BoardFormat,
+    GAME_REQUEST,
+    JOIN_GAME_REQUEST,
+    PLACE_PIECE_REQUEST,
+    PLACE_FLEET_REQUEST,
+    STRIKE_REQUEST,
+    SUGGEST_STRIKE_REQUEST,
+    GAME_STATUS_REQUEST,
+    GAME_HISTORY_REQUEST,
+    USER_GAMES_REQUEST
+)
+from utils.bitboard import fleet_mask, get_codec
+from utils.computer import COMPUTER_NAME
+
+
+class Case(object):
+
+    def __init__(self, name, method, prepare, errors=(), scaling=False):
+        """
+        Args:
+            name: The name of the case in the report and the budgets
+            method: The name of the BattleshipAPI method called
+            prepare: A function of the Fixture, returning the request
+            errors: Exceptions the call may raise without failing the case
+            scaling: True if the case is also run at every scaling step"""
+        self.name = name
+        self.method = method
+        self.prepare = prepare
+        self.errors = errors
+        self.scaling = scaling
+
+
+def _new_user(fx):
+    name = fx.next_name()
+    return UserRequest(user_name=name, email=name + '@example.com')
+
+
+def _new_game(fx, **fields):
+    return NewGameRequest(player_one_name=fx.new_user(),
+                          player_two_name=fx.new_user(),
+                          **fields)
+
+
+def _computer_game(fx):
+    return NewGameRequest(player_one_name=fx.new_user(),
+                          computer_opponent=True,
+                          auto_place=True)
+
+
+def _join_game(fx):
+    form, _, _ = fx.new_game(player_two=False)
+    return request(JOIN_GAME_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   player_two_name=fx.new_user())
+
+
+def _place_piece(fx):
+    form, player_one, _ = fx.new_game()
+    return request(PLACE_PIECE_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   player_name=player_one,
+                   piece_type=PieceType.aircraft_carrier,
+                   piece_alignment=Alignment.vertical,
+                   first_row_coordinate='1',
+                   first_column_coordinate='A')
+
+
+def _place_fleet(fx):
+    form, player_one, _ = fx.new_game()
+    codec = get_codec()
+    # One piece per column, from the top of the board
+    pieces = [PiecePlacement(piece_type=PieceType(piece_type),
+                             piece_alignment=Alignment.vertical,
+                             first_row_coordinate=codec.rows[0],
+                             first_column_coordinate=codec.columns[index])
+              for index, piece_type in enumerate(sorted(PIECES))]
+    return request(PLACE_FLEET_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   player_name=player_one,
+                   pieces=pieces)
+
+
+def _strike(fx, **fields):
+    form, _, player_two = fx.new_game(auto_place=True)
+    return request(STRIKE_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   target_player=player_two,
+                   coordinate='A1',
+                   **fields)
+
+
+def _computer_strike(fx):
+    form, _, _ = fx.new_game(player_two=False,
+                             computer_opponent=True,
+                             auto_place=True)
+    return request(STRIKE_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   target_player=COMPUTER_NAME,
+                   coordinate='A1')
+
+
+def _winning_strike(fx):
+    """Plays a game up to the strike that sinks player two's last ship.
+    Player two strikes all but one of the cells of player one's fleet
+    meanwhile, so that player one wins"""
+    form, player_one, player_two = fx.new_game(auto_place=True)
+    boards = fx.get_boards(form.game_key)
+    codec = get_codec()
+    targets = codec.mask_coords(fleet_mask(boards[player_two].fleet))
+    replies = codec.mask_coords(fleet_mask(boards[player_one].fleet))
+    for target, reply in zip(targets[:-1], replies):
+        fx.strike(form.game_key, player_two, target)
+        fx.strike(form.game_key, player_one, reply)
+    return request(STRIKE_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   target_player=player_two,
+                   coordinate=targets[-1])
+
+
+def _suggest_strike(fx):
+    form, player_one, _ = fx.new_game(auto_place=True)
+    return request(SUGGEST_STRIKE_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   player_name=player_one)
+
+
+def _game_status(fx, **fields):
+    form, _, _ = fx.new_game(auto_place=True)
+    if fields.pop('if_version', False):
+        fields['if_version'] = form.version
+    return request(GAME_STATUS_REQUEST,
+                   url_safe_game_key=form.game_key,
+                   **fields)
+
+
+def _user_games(fx, **fields):
+    return request(USER_GAMES_REQUEST,
+                   user_name=fx.get_busiest_user(),
+                   status=GameStatus.finished,
+                   **fields)
+
+
+def _cancel_game(fx):
+    form, _, _ = fx.new_game(auto_place=True)
+    return request(GAME_REQUEST, url_safe_game_key=form.game_key)
+
+
+def _history(fx, **fields):
+    return request(GAME_HISTORY_REQUEST,
+                   url_safe_game_key=fx.long_game_key,
+                   **fields)
+
+
+CASES = [
+    Case('create_user', 'create_user', _new_user),
+    Case('create_game', 'create_game', _new_game),
+    Case('create_game_auto_place', 'create_game',
+         lambda fx: _new_game(fx, auto_place=True)),
+    Case('create_game_computer', 'create_game', _computer_game),
+    Case('join_game', 'join_game', _join_game),
+    Case('place_piece', 'place_piece', _place_piece),
+    Case('place_fleet', 'place_fleet', _place_fleet),
+    Case('strike_coord', 'strike_coord', _strike),
+    Case('strike_coord_delta', 'strike_coord',
+         lambda fx: _strike(fx,
+                            delta=True,
+                            board_format=BoardFormat.compact)),
+    Case('strike_coord_computer', 'strike_coord', _computer_strike),
+    Case('strike_coord_game_over', 'strike_coord', _winning_strike),
+    Case('get_strike_suggestion', 'get_strike_suggestion', _suggest_strike),
+    Case('get_game_status', 'get_game_status', _game_status),
+    Case('get_game_status_compact', 'get_game_status',
+         lambda fx: _game_status(fx, board_format=BoardFormat.compact)),
+    Case('get_game_status_not_modified', 'get_game_status',
+         lambda fx: _game_status(fx, if_version=True)),
+    Case('get_user_games', 'get_user_games', _user_games, scaling=True),
+    Case('get_user_games_no_boards', 'get_user_games',
+         lambda fx: _user_games(fx, include_boards=False)),
+    Case('cancel_game', 'cancel_game', _cancel_game),
+    Case('get_user_ranks', 'get_user_ranks',
+         lambda fx: message_types.VoidMessage(),
+         # Until a game has finished
+         errors=(endpoints.ConflictException,),
+         scaling=True),
+    Case('get_average_moves', 'get_average_moves',
+         lambda fx: message_types.VoidMessage(),
+         scaling=True),
+    Case('get_game_history_long', 'get_game_history', _history),
+    Case('get_game_history_page', 'get_game_history',
+         lambda fx: _history(fx, since_move=1000, limit=100))
+]
@@ -0,0 +1,168 @@
+"""The testbed and the data the benchmarks run against.
+
+Finished games are played by the random bots of utils/simulation.py and
+written with the ndb storage backend, which counts their results in the
+first UserStats shard of each player and the first GameStats shard, as
+the API counts the results of games as they end."""
+
+import os
+import random
+import tempfile
+
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb, testbed
+
+from api import BattleshipAPI
+from models.ndbModels import User, UserName
+from models.requests import UserRequest, NewGameRequest, STRIKE_REQUEST
+from utils.bitboard import get_codec
+from utils.simulation import RandomBot, play_game, get_game_records
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_BATCH_SIZE = 500
+# Board size of the long game, whose history is benchmarked
+LONG_GAME_SIZE = 50
+
+
+def request(container, **fields):
+    """Returns the request message of an endpoints ResourceContainer"""
+    return container.combined_message_class(**fields)
+
+
+class Fixture(object):
+    """An activated testbed, the API, and the seeded data"""
+
+    def __init__(self, require_indexes=False, seed=0):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self._datastore_file = tempfile.mkstemp(suffix='.sqlite')[1]
+        self.testbed.init_datastore_v3_stub(
+            # The sqlite stub serves queries from indexes, as the
+            # datastore does, rather than by scanning every entity
+            use_sqlite=True,
+            datastore_file=self._datastore_file,
+            root_path=ROOT,
+            require_indexes=require_indexes,
+            consistency_policy=datastore_stub_util
+            .PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.api = BattleshipAPI()
+        self.repository = self.api.repository
+        self.rng = random.Random(seed)
+        self.user_names = []
+        self.finished_games = 0
+        self.wins = {}
+        self.long_game_key = None
+        self._new_names = 0
+
+    def close(self):
+        self.testbed.deactivate()
+        os.remove(self._datastore_file)
+
+    def reset_caches(self):
+        """Empties memcache and the ndb in-context cache, as at the start
+        of a request on a cold instance"""
+        memcache.flush_all()
+        ndb.get_context().clear_cache()
+
+    # - - - - Seeding - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def seed_users(self, count):
+        """Adds count users, with their UserName index entities"""
+        for start in xrange(0, count, SEED_BATCH_SIZE):
+            size = min(SEED_BATCH_SIZE, count - start)
+            first_id, _ = User.allocate_ids(size)
+            entities = []
+            for offset in xrange(size):
+                name = 'user-{}'.format(start + offset)
+                user_key = ndb.Key(User, first_id + offset)
+                entities.append(User(key=user_key,
+                                     name=name,
+                                     email=name + '@example.com'))
+                entities.append(UserName(id=name, user=user_key))
+                self.user_names.append(name)
+            ndb.put_multi(entities)
+            # Seeded entities are dropped from the in-context cache, which
+            # would otherwise hold every one of them for the whole run
+            ndb.get_context().clear_cache()
+
+    def seed_finished_games(self, count, size=None):
+        """Plays count games between random pairs of the seeded users and
+        stores them, along with their results.
+        Returns:
+            The GameRecord of the last game"""
+        codec = get_codec(size)
+        bot_types = [RandomBot, RandomBot]
+        record = None
+        for start in xrange(0, count, SEED_BATCH_SIZE):
+            games = []
+            for _ in xrange(min(SEED_BATCH_SIZE, count - start)):
+                player_names = self.rng.sample(self.user_names, 2)
+                moves = []
+                game = play_game(codec, bot_types, self.rng, moves)
+                record, boards = get_game_records(game, moves, player_names)
+                games.append((record, boards))
+                winner = player_names[game.winner]
+                loser = player_names[1 - game.winner]
+                self.wins.setdefault(winner, [0, 0])[0] += 1
+                self.wins.setdefault(loser, [0, 0])[1] += 1
+            self.repository.put_games(games)
+            ndb.get_context().clear_cache()
+            self.finished_games += len(games)
+        return record
+
+    def seed_long_game(self):
+        """Stores a finished game on the largest board, for the history
+        benchmarks"""
+        record = self.seed_finished_games(1, LONG_GAME_SIZE)
+        self.long_game_key = ndb.Key('Game', record.id).urlsafe()
+
+    def get_busiest_user(self):
+        """Returns the name of the user with the most finished games, or
+        the first user if no game has finished"""
+        if not self.wins:
+            return self.user_names[0]
+        return max(self.wins, key=lambda name: sum(self.wins[name]))
+
+    # - - - - Requests - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def next_name(self):
+        """Returns a user name that has not been used yet"""
+        self._new_names += 1
+        return 'player-{}'.format(self._new_names)
+
+    def new_user(self):
+        """Creates a user through the API, and returns it's name"""
+        name = self.next_name()
+        self.api.create_user(UserRequest(user_name=name,
+                                         email=name + '@example.com'))
+        return name
+
+    def new_game(self, player_two=True, **fields):
+        """Creates a game between two new users through the API.
+        Returns:
+            The game's GameStatusMessage, and the names of it's players"""
+        player_one = self.new_user()
+        player_two = self.new_user() if player_two else None
+        form = self.api.create_game(NewGameRequest(
+            player_one_name=player_one,
+            player_two_name=player_two,
+            **fields))
+        return form, player_one, player_two
+
+    def get_boards(self, game_key):
+        """Returns a dict of player name to BoardRecord of a game"""
+        game = self.repository.get_game(ndb.Key(urlsafe=game_key).id())
+        return self.repository.get_boards(game)
+
+    def strike(self, game_key, target_player, coordinate):
+        return self.api.strike_coord(request(STRIKE_REQUEST,
+                                             url_safe_game_key=game_key,
+                                             target_player=target_player,
+                                             coordinate=coordinate))
+
@@ -0,0 +1,36 @@
+"""Counts the API calls made while benchmarking an endpoint, by hooking
+the apiproxy every datastore, memcache and task queue call goes through.
+Calls are counted by the same kinds as in utils/instrumentation.py."""
+
+from collections import defaultdict
+
+from google.appengine.api import apiproxy_stub_map
+
+from utils.instrumentation import get_rpc_kind
+
+
+class RpcCounter(object):
+    """Counts calls by kind while recording. Installed on the apiproxy of
+    the active testbed, so it must be created after the testbed is
+    activated"""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.recording = False
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'benchmark_rpc_counter', self._count)
+
+    def _count(self, service, call, request, response):
+        if self.recording:
+            self.counts[get_rpc_kind(service, call)] += 1
+
+    def start(self):
+        self.counts.clear()
+        self.recording = True
+
+    def stop(self):
+        """Stops recording.
+        Returns:
+            A dict of kind to the number of calls made since start"""
+        self.recording = False
+        return dict(self.counts)
@@ -0,0 +1,198 @@
+"""Runs every benchmark case against the App Engine testbed stubs, and
+checks the datastore calls of each against benchmarks/budgets.json.
+
+Users and finished games are seeded first. The scaling cases are run after
+each step of --scaling, as more finished games are added, then every case
+is run at the full size. Each call is made --repeat times on a fresh
+request, with memcache and the ndb in-context cache emptied before it
+(unless --warm), and the largest number of calls of each kind is kept.
+Times are of the stubs, so only compare them between runs of this suite.
+
+    python -m benchmarks.run --sdk ~/google_appengine
+    python -m benchmarks.run --users 200 --games 2000 --scaling 0,1000
+    python -m benchmarks.run --write-budgets
+
+Run it from the root of the repository. The path of the App Engine SDK is
+taken from --sdk or the APPENGINE_SDK environment variable. The run fails
+if any call makes more calls of a kind than it's budget."""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'budgets.json')
+# Kinds of calls checked against the budgets. Query results past the
+# first batch are fetched with next, so it is what grows with the number of
+# results, and every transaction ends in a commit
+BUDGET_KINDS = ['get', 'query', 'next', 'put', 'delete', 'commit']
+REPORT_KINDS = ['get', 'query', 'next', 'put', 'delete', 'commit',
+                'memcache']
+
+
+def setup_sdk(sdk_path):
+    """Puts the App Engine SDK and it's bundled libraries on the path"""
+    sdk_path = sdk_path or os.environ.get('APPENGINE_SDK')
+    if sdk_path:
+        sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+def run_case(fx, counter, case, repeat, warm=False):
+    """Calls the case's method repeat times.
+    Returns:
+        The time of each call in milliseconds, the largest number of calls
+        of each kind, and the name of the expected error raised, if any"""
+    method = getattr(fx.api, case.method)
+    times = []
+    counts = {}
+    error = None
+    for _ in xrange(repeat):
+        message = case.prepare(fx)
+        if not warm:
+            fx.reset_caches()
+        counter.start()
+        start = time.time()
+        try:
+            method(message)
+        except case.errors as e:
+            error = e.__class__.__name__
+        finally:
+            times.append((time.time() - start) * 1000)
+            call_counts = counter.stop()
+        for kind, count in call_counts.iteritems():
+            counts[kind] = max(counts.get(kind, 0), count)
+    return times, counts, error
+
+
+def get_overages(counts, budget):
+    """Returns the kinds of calls made more often than the budget allows.
+    Kinds missing from the budget are not allowed at all"""
+    return [kind for kind in BUDGET_KINDS
+            if counts.get(kind, 0) > budget.get(kind, 0)]
+
+
+def format_result(name, times, counts, error, budget):
+    """Returns the report line of a case, and True if it is over budget"""
+    times = sorted(times)
+    overages = get_overages(counts, budget) if budget else []
+    if budget is None:
+        status = 'NO BUDGET'
+    elif overages:
+        status = 'OVER: ' + ', '.join(
+            '{} {} > {}'.format(kind, counts.get(kind, 0),
+                                budget.get(kind, 0))
+            for kind in overages)
+    else:
+        status = 'ok'
+    if error:
+        status += ' ({})'.format(error)
+    line = '{:<36} {:>9.1f} {:>9.1f} '.format(name,
+                                               times[len(times) // 2],
+                                               times[-1])
+    line += ' '.join('{:>8}'.format(counts.get(kind, 0))
+                     for kind in REPORT_KINDS)
+    return '{} {}'.format(line, status), bool(overages)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks every endpoint against the testbed stubs')
+    parser.add_argument('--sdk', help='Path of the App Engine SDK')
+    parser.add_argument('--users', type=int, default=10000)
+    # The datastore stub keeps about 100KB of bookkeeping for every entity
+    # group it has written, so much larger runs do not fit in memory
+    parser.add_argument('--games', type=int, default=20000,
+                        help='Finished games seeded before the full run')
+    parser.add_argument('--scaling', default='0,1000',
+                        help='Numbers of finished games to run the scaling '
+                             'cases at, before --games')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+',
+                        help='Names of the cases to run')
+    parser.add_argument('--warm', action='store_true',
+                        help='Keep memcache between calls')
+    parser.add_argument('--require-indexes', action='store_true',
+                        help='Fail queries not covered by index.yaml')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--budgets', default=BUDGETS_PATH)
+    parser.add_argument('--write-budgets', action='store_true',
+                        help='Write the calls made as the new budgets')
+    args = parser.parse_args()
+    if args.users < 2:
+        parser.error('--users must be at least 2')
+
+    setup_sdk(args.sdk)
+    from benchmarks.cases import CASES
+    from benchmarks.fixtures import Fixture
+    from benchmarks.rpc import RpcCounter
+    from utils.computer import get_computer_player
+
+    cases = [case for case in CASES
+             if not args.only or case.name in args.only]
+    levels = sorted(set([int(level) for level in args.scaling.split(',')
+                         if level and int(level) < args.games] +
+                        [args.games]))
+    with open(args.budgets) as budgets_file:
+        budgets = json.load(budgets_file)
+
+    fx = Fixture(args.require_indexes, args.seed)
+    counter = RpcCounter()
+    start = time.time()
+    fx.seed_users(args.users)
+    # Created up front, so that the first game against the computer does
+    # not count the creation
+    get_computer_player(fx.repository)
+    print 'Seeded {} users in {:.1f}s'.format(args.users, time.time() - start)
+    print '{:<36} {:>9} {:>9} '.format('case', 'p50 ms', 'max ms') + ' '.join(
+        '{:>8}'.format(kind) for kind in REPORT_KINDS)
+
+    results = {}
+    over_budget = False
+
+    def run(name, case):
+        times, counts, error = run_case(fx, counter, case, args.repeat,
+                                        args.warm)
+        results[name] = counts
+        line, over = format_result(name, times, counts, error,
+                                   budgets.get(name))
+        print line
+        return over
+
+    try:
+        for level in levels:
+            start = time.time()
+            fx.seed_finished_games(level - fx.finished_games)
+            print 'Seeded {} finished games in {:.1f}s'.format(
+                fx.finished_games, time.time() - start)
+            for case in cases:
+                if case.scaling:
+                    name = '{}@{}'.format(case.name, level)
+                    over_budget = run(name, case) or over_budget
+        fx.seed_long_game()
+        for case in cases:
+            over_budget = run(case.name, case) or over_budget
+    finally:
+        fx.close()
+
+    if args.write_budgets:
+        budgets.update(
+            (name, dict((kind, counts.get(kind, 0)) for kind in BUDGET_KINDS))
+            for name, counts in results.iteritems())
+        with open(args.budgets, 'w') as budgets_file:
+            json.dump(budgets,
+                      budgets_file,
+                      indent=2,
+                      separators=(',', ': '),
+                      sort_keys=True)
+            budgets_file.write('\n')
+        print 'Wrote the budgets of {} cases'.format(len(results))
+    elif over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,238 @@
 #!/usr/bin/env python
 
 """main.py - This file contains handlers that are called by taskqueue and/or
-cronjobs."""
+cronjobs, and the admin request stats."""
+
+import datetime
+import hashlib
+import json
+import logging
 
 import webapp2
-from google.appengine.api import mail, app_identity
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 from api import BattleshipAPI
-from models.ndbModels import User
-from utils.getters import get_all_unfinished_games
+from utils.instrumentation import (
+    InstrumentationMiddleware,
+    get_request_stats
+)
+from utils.migration import (
+    GAMES_MIGRATION,
+    migrate_games_batch,
+    index_games_batch,
+    index_user_names_batch,
+    is_migration_complete
+)
+from utils.stats import (
+    backfill_stats_batch,
+    has_game_totals_drift,
+    get_game_totals,
+    recount_moves_batch,
+    correct_game_totals
+)
+from utils.reminders import (
+    get_run_id,
+    count_turns_batch,
+    queue_reminder_batch,
+    queue_reminder_mail,
+    send_reminders
+)
+
+# Format of the start time of a recount of the finished game totals
+SNAPSHOT_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
         """Send Users with unfinished games reminders, once a day,
-        if it's their turn to play"""
-        app_id = app_identity.get_application_id()
-        unfinished_games = get_all_unfinished_games()
-        users = {}
-        for game in unfinished_games:
-            user_id = game.player_turn.id()
-            user = User.get_by_id(user_id)
-            if user_id in users:
-                users[user_id]['num_games_in_progress'] += 1
-            else:
-                users[user_id] = {'num_games_in_progress': 1,
-                                  'email': user.email,
-                                  'name': user.name}
-        for u_id in users:
-            subject = 'This is a reminder!'
-            body = '''Hello {}, you currently have {} Battle Ship
-                games in progress!'''.format(
-                users[u_id]['name'], users[u_id]['num_games_in_progress'])
-            # The arguments to send_mail are:
-            # from, to, subject, body
-            mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                           users[u_id]['email'],
-                           subject,
-                           body)
+        if it's their turn to play. The games are counted and the emails
+        sent by task queue batches, see utils/reminders.py"""
+        queue_reminder_batch(get_run_id())
+
+
+class SendReminders(webapp2.RequestHandler):
+    def post(self):
+        """Counts one page of active games by the user whose turn it is,
+        queues their reminders, then queues the next page"""
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        carry = None
+        if self.request.get('carry_user'):
+            carry = (ndb.Key(urlsafe=self.request.get('carry_user')),
+                     int(self.request.get('carry_count')))
+        run_id = self.request.get('run_id')
+        counts, next_cursor, carry = count_turns_batch(cursor, carry)
+        queue_reminder_mail(run_id, counts)
+        if next_cursor:
+            queue_reminder_batch(run_id, next_cursor, carry)
+        self.response.set_status(204)
+
+
+class SendReminderMail(webapp2.RequestHandler):
+    def post(self):
+        """Mails one batch of reminders"""
+        send_reminders(self.request.get('reminders'))
+        self.response.set_status(204)
 
 
 class UpdateAvgMovesPerGame(webapp2.RequestHandler):
+    def get(self):
+        """Queues the reconciliation below, once a day"""
+        taskqueue.add(url=self.request.path)
+
+    def post(self):
+        """The finished game totals are updated as games end. This corrects
+        any drift, by recounting the moves of every finished game a page at
+        a time, but only when the number of finished games does not match
+        the totals. Only games that had finished when the recount started
+        are counted, and the correction is relative to the totals at that
+        time, so games that end meanwhile are not counted twice. Nothing
+        is recounted until /tasks/migrate_games has gone through every
+        game, as the recount's query leaves out games it has not
+        migrated"""
+        cursor = self.request.get('cursor')
+        if cursor:
+            params = dict((name, int(self.request.get(name)))
+                          for name in ('start_finished',
+                                       'start_total_moves',
+                                       'finished',
+                                       'total_moves'))
+            params['snapshot'] = self.request.get('snapshot')
+            cursor = Cursor(urlsafe=cursor)
+        elif not is_migration_complete(GAMES_MIGRATION):
+            logging.warning('The finished game totals are not reconciled '
+                            'until /tasks/migrate_games has run')
+            self.response.set_status(204)
+            return
+        elif has_game_totals_drift():
+            snapshot = datetime.datetime.utcnow()
+            start_finished, start_total_moves = get_game_totals()
+            params = {'snapshot': snapshot.strftime(SNAPSHOT_FORMAT),
+                      'start_finished': start_finished,
+                      'start_total_moves': start_total_moves,
+                      'finished': 0,
+                      'total_moves': 0}
+            cursor = None
+        else:
+            self.response.set_status(204)
+            return
+
+        snapshot = datetime.datetime.strptime(params['snapshot'],
+                                              SNAPSHOT_FORMAT)
+        finished, total_moves, next_cursor = recount_moves_batch(snapshot,
+                                                                 cursor)
+        params['finished'] += finished
+        params['total_moves'] += total_moves
+        if next_cursor:
+            params['cursor'] = next_cursor.urlsafe()
+            # Named after the recount and the page, so that a retried
+            # page does not queue the next one twice
+            name = 'recount-{}-{}'.format(
+                snapshot.strftime('%Y%m%d%H%M%S%f'),
+                hashlib.md5(params['cursor']).hexdigest())
+            try:
+                taskqueue.add(name=name,
+                              url=self.request.path,
+                              params=params)
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                pass
+        else:
+            correct_game_totals(
+                snapshot,
+                params['finished'],
+                params['finished'] - params['start_finished'],
+                params['total_moves'] - params['start_total_moves'])
+            logging.info('Recounted %d finished games',
+                         params['finished'])
+        self.response.set_status(204)
+
+
+class BatchTaskHandler(webapp2.RequestHandler):
+    """Runs one page of a batch job, then queues itself with the cursor
+    of the next page until there are no pages left"""
+    def run_batch(self, cursor):
+        """Processes one page, returns the cursor of the next page,
+        or None if it was the last page"""
+        raise NotImplementedError
+
     def post(self):
-        """Memcache thing"""
-        BattleshipAPI._cache_average_moves()
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        next_cursor = self.run_batch(cursor)
+        if next_cursor:
+            taskqueue.add(url=self.request.path,
+                          params={'cursor': next_cursor.urlsafe()})
         self.response.set_status(204)
 
 
-app = webapp2.WSGIApplication([
+class MigrateGames(BatchTaskHandler):
+    def run_batch(self, cursor):
+        """Moves one page of games from the legacy Piece and Miss kinds
+        and JSON history to Boards"""
+        migrated, next_cursor = migrate_games_batch(cursor)
+        logging.info('Migrated %d games', migrated)
+        return next_cursor
+
+
+class BackfillUserStats(BatchTaskHandler):
+    def run_batch(self, cursor):
+        """Recounts the win and loss stats of one page of users from their
+        finished games"""
+        return backfill_stats_batch(cursor)
+
+
+class IndexGames(BatchTaskHandler):
+    def run_batch(self, cursor):
+        """Indexes one page of games for the user games listing"""
+        return index_games_batch(cursor)
+
+
+class IndexUserNames(BatchTaskHandler):
+    def run_batch(self, cursor):
+        """Adds one page of users to the name index"""
+        return index_user_names_batch(cursor)
+
+
+# Endpoints whose game transactions are retried, see utils/transactions.py
+TRANSACTION_NAMES = ['join_game',
+                     'place_piece',
+                     'place_fleet',
+                     'strike_coord',
+                     'cancel_game']
+
+
+class RequestStats(webapp2.RequestHandler):
+    def get(self):
+        """Returns the request stats of every API method and handler,
+        the contention of the game transactions, and the view cache hit
+        rate, as JSON. See utils/instrumentation.py"""
+        repository = BattleshipAPI.repository
+        names = ['BattleshipAPI.' + name
+                 for name in sorted(BattleshipAPI.all_remote_methods())]
+        names += [path for path, _ in ROUTES]
+        stats = {
+            'endpoints': dict((name, get_request_stats(name))
+                              for name in names),
+            'contention': dict((name, repository.get_contention_stats(name))
+                               for name in TRANSACTION_NAMES),
+            'view_cache': repository.get_view_cache_stats()
+        }
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(stats, sort_keys=True))
+
+
+ROUTES = [
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/send_reminders', SendReminders),
+    ('/tasks/send_reminder_mail', SendReminderMail),
     ('/tasks/cache_average_moves', UpdateAvgMovesPerGame),
-], debug=True)
+    ('/tasks/migrate_games', MigrateGames),
+    ('/tasks/backfill_user_stats', BackfillUserStats),
+    ('/tasks/index_games', IndexGames),
+    ('/tasks/index_user_names', IndexUserNames),
+    ('/admin/request_stats', RequestStats),
+]
+
+app = InstrumentationMiddleware(webapp2.WSGIApplication(ROUTES, debug=True))
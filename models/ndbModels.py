@@ -3,6 +3,9 @@ entities used by the Game."""
 
 from google.appengine.ext import ndb
 
+from board import COLUMNS
+from utils.engine import get_game_status
+
 
 class User(ndb.Model):
     """User profile"""
@@ -10,6 +13,24 @@ class User(ndb.Model):
     email = ndb.StringProperty(required=True)
 
 
+class UserName(ndb.Model):
+    """Index from a user's name to their User key, keyed by the name, so
+    that names are resolved with a get rather than a query"""
+    user = ndb.KeyProperty(required=True, kind='User')
+
+
+def _get_game_players(game):
+    return [key for key in (game.player_one, game.player_two) if key]
+
+
+def _get_player_name(game, player_key):
+    if player_key is None:
+        return None
+    if player_key == game.player_one:
+        return game.player_one_name
+    return game.player_two_name
+
+
 class Game(ndb.Model):
     """Game object for game details and status"""
     player_one = ndb.KeyProperty(required=True, kind='User')
@@ -22,11 +43,78 @@ class Game(ndb.Model):
     player_turn = ndb.KeyProperty(required=True, kind='User')
     game_over = ndb.BooleanProperty(required=True, default=False)
     winner = ndb.KeyProperty(kind='User')
+    # Legacy move history, replaced by Board.strikes (see utils/history.py)
     history = ndb.JsonProperty(repeated=True)
+    # Incremented on every write, see utils/transactions.py
+    version = ndb.IntegerProperty(required=True, default=0)
+    # True once the game's pieces and misses are stored in Board entities
+    # rather than in the legacy Piece and Miss kinds
+    uses_boards = ndb.BooleanProperty(default=False)
+    # Indexed for listing a user's games, see utils/getters.py
+    players = ndb.ComputedProperty(_get_game_players, repeated=True)
+    # One of open, placing, active or finished
+    status = ndb.ComputedProperty(get_game_status)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+    # Copied from the players' Users so that games can be shown without
+    # getting the Users. Missing on games written before they existed,
+    # until the game is next updated or the /tasks/migrate_games task has
+    # run
+    player_one_name = ndb.StringProperty()
+    player_two_name = ndb.StringProperty()
+    player_turn_name = ndb.ComputedProperty(
+        lambda game: _get_player_name(game, game.player_turn))
+    winner_name = ndb.ComputedProperty(
+        lambda game: _get_player_name(game, game.winner))
+    move_count = ndb.IntegerProperty(default=0)
+    # Number of columns and rows of both players' boards, see
+    # utils/bitboard.py
+    board_size = ndb.IntegerProperty(default=len(COLUMNS))
+
+
+class Board(ndb.Model):
+    """A player's fleet, hit marks and misses for a given game, stored as
+    bitboard masks (see utils/bitboard.py). The Game is the parent and the
+    id is the id of the player that owns the board"""
+    player = ndb.KeyProperty(required=True, kind='User')
+    # Mapping of ship type to the mask of the cells it occupies
+    fleet = ndb.JsonProperty()
+    hit_mask = ndb.JsonProperty()
+    miss_mask = ndb.JsonProperty()
+    # Packed records of every strike made against this board, in move
+    # order, see utils/history.py
+    strikes = ndb.BlobProperty(default='')
+
+
+class UserStats(ndb.Model):
+    """One shard of a user's finished game counts. A user's totals are the
+    sum of all of their shards, see utils/stats.py"""
+    user = ndb.KeyProperty(required=True, kind='User')
+    name = ndb.StringProperty(required=True)
+    won = ndb.IntegerProperty(required=True, default=0)
+    lost = ndb.IntegerProperty(required=True, default=0)
+
+
+class GameStats(ndb.Model):
+    """One shard of the totals of every finished game, see utils/stats.py"""
+    finished = ndb.IntegerProperty(required=True, default=0)
+    total_moves = ndb.IntegerProperty(required=True, default=0)
+    # Only set on the first shard, by the last reconciliation of the
+    # totals: the time it's recount started at and the number of games
+    # that had finished by then
+    reconciled = ndb.DateTimeProperty()
+    reconciled_finished = ndb.IntegerProperty()
+
+
+class Migration(ndb.Model):
+    """Recorded once a batch migration has gone through every entity of
+    it's kind, keyed by the migration's name, see utils/migration.py"""
+    completed = ndb.DateTimeProperty(auto_now_add=True)
 
 
 class Piece(ndb.Model):
-    """Location and status of player's game pieces"""
+    """Location and status of player's game pieces.
+    Legacy kind, replaced by Board"""
     game = ndb.KeyProperty(required=True, kind='Game')
     player = ndb.KeyProperty(required=True, kind='User')
     ship = ndb.StringProperty(required=True)
@@ -36,7 +124,7 @@ class Piece(ndb.Model):
 
 
 class Miss(ndb.Model):
-    """Store of all misses"""
+    """Store of all misses. Legacy kind, replaced by Board"""
     game = ndb.KeyProperty(required=True, kind='Game')
     target_player = ndb.KeyProperty(required=True, kind='User')
     coordinate = ndb.StringProperty(required=True)
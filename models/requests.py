@@ -7,13 +7,47 @@ class UserRequest(messages.Message):
     email = messages.StringField(2, required=True)
 
 
+class BoardFormat(messages.Enum):
+    """Format of the board states in a response. verbose sends a CoordInfo
+    message per cell, compact sends one string per board with one status
+    character per cell: E (empty), O (occupied), M (miss) or X (hit)"""
+    verbose = 1
+    compact = 2
+
+
+class GameStatus(messages.Enum):
+    """Stage of a game. open games are waiting for a second player,
+    placing games for both players to place their pieces"""
+    open = 1
+    placing = 2
+    active = 3
+    finished = 4
+
+
+class GameOrder(messages.Enum):
+    """Order of a listing of games"""
+    newest = 1
+    oldest = 2
+    recently_updated = 3
+
+
 class NewGameRequest(messages.Message):
     player_one_name = messages.StringField(1, required=True)
     player_two_name = messages.StringField(2)
+    board_format = messages.EnumField(BoardFormat, 3, default='verbose')
+    # Places a random fleet for each of the game's players
+    auto_place = messages.BooleanField(4, default=False)
+    # Number of columns and rows of the boards, 10 by default
+    board_size = messages.IntegerField(5)
+    # Plays against the computer, in place of player_two_name
+    computer_opponent = messages.BooleanField(6, default=False)
 
 
 class JoinGameForm(messages.Message):
     player_two_name = messages.StringField(1)
+    board_format = messages.EnumField(BoardFormat, 3, default='verbose')
+    # Places a random fleet for the joining player
+    auto_place = messages.BooleanField(4, default=False)
 
 
 class PieceType(messages.Enum):
@@ -35,16 +69,51 @@ class PlacePieceForm(messages.Message):
     piece_alignment = messages.EnumField(Alignment, 3, required=True)
     first_row_coordinate = messages.StringField(4, required=True)
     first_column_coordinate = messages.StringField(5, required=True)
+    board_format = messages.EnumField(BoardFormat, 7, default='verbose')
+
+
+class PiecePlacement(messages.Message):
+    piece_type = messages.EnumField(PieceType, 1, required=True)
+    piece_alignment = messages.EnumField(Alignment, 2, required=True)
+    first_row_coordinate = messages.StringField(3, required=True)
+    first_column_coordinate = messages.StringField(4, required=True)
+
+
+class PlaceFleetForm(messages.Message):
+    """Placements of every piece of a player's fleet"""
+    player_name = messages.StringField(1, required=True)
+    pieces = messages.MessageField(PiecePlacement, 2, repeated=True)
+    board_format = messages.EnumField(BoardFormat, 3, default='verbose')
 
 
 class StrikeForm(messages.Message):
     target_player = messages.StringField(1)
     coordinate = messages.StringField(2)
+    board_format = messages.EnumField(BoardFormat, 4, default='verbose')
+    # Respond with only the cells changed by the strike, see MoveDetails
+    delta = messages.BooleanField(5, default=False)
 
 
 GAME_REQUEST = endpoints.ResourceContainer(
     url_safe_game_key=messages.StringField(1, required=True))
 
+# if_version is the version of the game from a previous response. If the
+# game has not changed since, a not_modified response is sent instead
+GAME_STATUS_REQUEST = endpoints.ResourceContainer(
+    url_safe_game_key=messages.StringField(1, required=True),
+    board_format=messages.EnumField(BoardFormat, 2, default='verbose'),
+    if_version=messages.IntegerField(3))
+
+# since_move skips every move up to and including that move number, and
+# limit caps the number of moves sent. If more moves remain, the response's
+# next_cursor may be sent back as cursor to fetch the next page
+GAME_HISTORY_REQUEST = endpoints.ResourceContainer(
+    url_safe_game_key=messages.StringField(1, required=True),
+    if_version=messages.IntegerField(2),
+    since_move=messages.IntegerField(3),
+    limit=messages.IntegerField(4),
+    cursor=messages.StringField(5))
+
 JOIN_GAME_REQUEST = endpoints.ResourceContainer(
     JoinGameForm,
     url_safe_game_key=messages.StringField(2, required=True))
@@ -53,10 +122,25 @@ PLACE_PIECE_REQUEST = endpoints.ResourceContainer(
     PlacePieceForm,
     url_safe_game_key=messages.StringField(6, required=True))
 
+SUGGEST_STRIKE_REQUEST = endpoints.ResourceContainer(
+    url_safe_game_key=messages.StringField(1, required=True),
+    player_name=messages.StringField(2, required=True))
+
+PLACE_FLEET_REQUEST = endpoints.ResourceContainer(
+    PlaceFleetForm,
+    url_safe_game_key=messages.StringField(4, required=True))
+
 STRIKE_REQUEST = endpoints.ResourceContainer(
     StrikeForm,
     url_safe_game_key=messages.StringField(3, required=True))
 
+# Without a status, all of the user's games that are not finished are listed
 USER_GAMES_REQUEST = endpoints.ResourceContainer(
-    user_name=messages.StringField(1, required=True)
+    user_name=messages.StringField(1, required=True),
+    board_format=messages.EnumField(BoardFormat, 2, default='verbose'),
+    status=messages.EnumField(GameStatus, 3),
+    order=messages.EnumField(GameOrder, 4, default='newest'),
+    limit=messages.IntegerField(5),
+    cursor=messages.StringField(6),
+    include_boards=messages.BooleanField(7, default=True)
 )
@@ -33,27 +33,34 @@ class CoordInfo(messages.Message):
 
 class GameStatusMessage(messages.Message):
     """GameStatus-- outbound message describing
-    a given game's current status"""
-    player_one = messages.StringField(1, required=True)
-    player_two = messages.StringField(2, required=True)
-    player_one_pieces_loaded = messages.StringField(3, required=True)
-    player_two_pieces_loaded = messages.StringField(4, required=True)
-    game_started = messages.StringField(5, required=True)
-    player_turn = messages.StringField(6, required=True)
-    game_over = messages.StringField(7, required=True)
+    a given game's current status. When not_modified is True, only
+    game_key and version are set"""
+    player_one = messages.StringField(1)
+    player_two = messages.StringField(2)
+    player_one_pieces_loaded = messages.StringField(3)
+    player_two_pieces_loaded = messages.StringField(4)
+    game_started = messages.StringField(5)
+    player_turn = messages.StringField(6)
+    game_over = messages.StringField(7)
     game_key = messages.StringField(8, required=True)
-    winner = messages.StringField(9, required=True)
+    winner = messages.StringField(9)
     player_one_board_state = messages.MessageField(CoordInfo,
                                                    10,
                                                    repeated=True)
     player_two_board_state = messages.MessageField(CoordInfo,
                                                    11,
                                                    repeated=True)
+    player_one_board = messages.StringField(12)
+    player_two_board = messages.StringField(13)
+    version = messages.IntegerField(14)
+    not_modified = messages.BooleanField(15)
+    board_size = messages.IntegerField(16)
 
 
 class UserGames(messages.Message):
     """GamesStatusMessages on each of a user's games"""
     games = messages.MessageField(GameStatusMessage, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class Coordinate(messages.Message):
@@ -72,6 +79,25 @@ class PieceDetails(messages.Message):
     player_two_board_state = messages.MessageField(CoordInfo,
                                                    11,
                                                    repeated=True)
+    player_one_board = messages.StringField(12)
+    player_two_board = messages.StringField(13)
+
+
+class PlacedPiece(messages.Message):
+    """Coordinates of a placed piece"""
+    ship_type = messages.StringField(1, required=True)
+    coordinates = messages.MessageField(Coordinate, 2, repeated=True)
+
+
+class FleetDetails(messages.Message):
+    """Details for a placed fleet, and the board state of it's owner"""
+    game_key = messages.StringField(1, required=True)
+    owner = messages.StringField(2, required=True)
+    pieces = messages.MessageField(PlacedPiece, 3, repeated=True)
+    game_started = messages.BooleanField(4)
+    player_board_state = messages.MessageField(CoordInfo, 5, repeated=True)
+    player_board = messages.StringField(6)
+    version = messages.IntegerField(7)
 
 
 class Ranking(messages.Message):
@@ -88,6 +114,21 @@ class Rankings(messages.Message):
     rankings = messages.MessageField(Ranking, 1, repeated=True)
 
 
+class AverageMoves(messages.Message):
+    """Average number of moves of the finished games"""
+    finished_games = messages.IntegerField(1, required=True)
+    average_moves = messages.FloatField(2, required=True)
+
+
+class StrikeSuggestion(messages.Message):
+    """The strike most likely to hit one of the opponent's ships. mode is
+    hunt while no ship afloat has been hit, target after. probability is
+    the share of the remaining ship placements covering the coordinate"""
+    coordinate = messages.StringField(1, required=True)
+    mode = messages.StringField(2, required=True)
+    probability = messages.FloatField(3)
+
+
 class MoveDetails(messages.Message):
     """Details of a given move"""
     target_player_name = messages.StringField(1, required=True)
@@ -102,8 +143,23 @@ class MoveDetails(messages.Message):
     attacking_player_board_state = messages.MessageField(CoordInfo,
                                                          8,
                                                          repeated=True)
+    target_player_board = messages.StringField(9)
+    attacking_player_board = messages.StringField(10)
+    # Sent in place of the board states for delta strike requests: the
+    # struck cell, and every cell of the ship if the strike sunk it
+    changed_cells = messages.MessageField(CoordInfo, 11, repeated=True)
+    sunk_ship_cells = messages.MessageField(CoordInfo, 12, repeated=True)
+    # Incremented on every change to the game. A client applying deltas
+    # should fetch the full game status if it skips a version
+    board_version = messages.IntegerField(13)
+    # The computer opponent's reply to the move, if it is playing
+    computer_move = messages.MessageField('MoveDetails', 14)
 
 
 class GameHistory(messages.Message):
-    """History of all moves played for a given game"""
+    """History of all moves played for a given game. When not_modified
+    is True, moves is left empty"""
     moves = messages.MessageField(MoveDetails, 1, repeated=True)
+    version = messages.IntegerField(2)
+    not_modified = messages.BooleanField(3)
+    next_cursor = messages.StringField(4)
@@ -0,0 +1,39 @@
+"""Storage backends for users, games and the players' boards.
+
+Every backend implements storage.base.Repository over the records of
+storage/records.py:
+
+    ndb       The datastore, over models/ndbModels.py (App Engine only)
+    memory    In-memory dicts, lost when the process exits
+    sqlite    A SQLite database, as sqlite:<path>, or sqlite: for an
+              in-memory database
+
+get_repository picks the backend from the BATTLESHIP_STORAGE environment
+variable, ndb by default. The API, the simulations and the benchmark
+seeding store games through it. The cron and task queue handlers of
+main.py still use the ndb models directly."""
+
+import os
+
+DEFAULT_STORAGE = 'ndb'
+
+
+def get_repository(url=None):
+    """Returns a Repository for a storage url, such as memory or
+    sqlite:battleship.db.
+    Raises:
+        ValueError: If the url names no backend"""
+    url = url or os.environ.get('BATTLESHIP_STORAGE', DEFAULT_STORAGE)
+    backend, _, path = url.partition(':')
+    # Backends are imported when used, so memory and sqlite work without
+    # the App Engine SDK
+    if backend == 'ndb':
+        from storage.ndb_storage import NdbRepository
+        return NdbRepository()
+    if backend == 'memory':
+        from storage.memory import MemoryRepository
+        return MemoryRepository()
+    if backend == 'sqlite':
+        from storage.sqlite import SqliteRepository
+        return SqliteRepository(path or ':memory:')
+    raise ValueError('Unknown storage: {}'.format(url))
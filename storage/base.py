@@ -0,0 +1,204 @@
+"""The interface of the storage backends."""
+
+import threading
+from itertools import islice
+
+from utils.history import iter_moves
+
+
+class StorageError(Exception):
+    pass
+
+
+class NameTakenError(StorageError):
+    """Raised when adding a user whose name is already in use"""
+
+
+class VersionConflictError(StorageError):
+    """Raised when a game was changed by someone else since it was read.
+    Nothing is written, and the update may be retried from a fresh read,
+    see utils/transactions.py"""
+
+
+class Repository(object):
+    """Stores users, games and the players' boards, and the win and loss
+    counts and finished game totals kept as games end. Records are copied
+    in and out, so changing a record has no effect until it is put.
+
+    The caches of the game views default to caching nothing, for backends
+    that are quick enough to read from, and the contention counts are kept
+    in the process"""
+
+    def __init__(self):
+        self._contention_lock = threading.Lock()
+        self._contention = {}
+
+    # - - - - Users - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def add_user(self, user):
+        """Stores a new UserRecord.
+        Raises:
+            NameTakenError: If the name is already in use"""
+        raise NotImplementedError
+
+    def get_user(self, name):
+        """Returns the UserRecord of a name, or None"""
+        raise NotImplementedError
+
+    def get_users(self, names):
+        """Returns a dict of name to UserRecord of every name that has a
+        user"""
+        raise NotImplementedError
+
+    def get_user_by_email(self, email):
+        """Returns the UserRecord of an email address, or None"""
+        raise NotImplementedError
+
+    # - - - - Games - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def get_game_key(self, game):
+        """Returns the key clients name a stored game by"""
+        return str(game.id)
+
+    def get_game_id(self, game_key):
+        """Returns the id of the game a key names.
+        Raises:
+            ValueError: If the key is not a game key of this backend"""
+        if not game_key.isdigit():
+            raise ValueError('Invalid game key')
+        return int(game_key)
+
+    def get_game(self, game_id):
+        """Returns the GameRecord of an id, or None"""
+        raise NotImplementedError
+
+    def get_boards(self, game):
+        """Returns a dict of player name to BoardRecord for the players of
+        a game. Players without a stored board get an empty one"""
+        raise NotImplementedError
+
+    def get_games_boards(self, games):
+        """Returns a dict of game id to the boards of the game, as returned
+        by get_boards, in as few reads as the backend allows"""
+        return dict((game.id, self.get_boards(game)) for game in games)
+
+    def put_game(self, game, boards=()):
+        """Stores a game along with any of it's boards that were changed,
+        in one write, and bumps it's version. A new game is given it's id.
+        If the game has just ended, it's result is counted in the same
+        write.
+        Raises:
+            VersionConflictError: If the stored game's version is not the
+              version of the game"""
+        raise NotImplementedError
+
+    def put_games(self, games):
+        """Stores many new games in as few writes as the backend allows,
+        counting the results of those that are over.
+        Args:
+            games: A list of tuples of a new GameRecord and it's
+              BoardRecords"""
+        for game, boards in games:
+            self.put_game(game, boards)
+
+    def delete_game(self, game):
+        """Deletes a game and it's boards.
+        Raises:
+            VersionConflictError: If the stored game's version is not the
+              version of the game"""
+        raise NotImplementedError
+
+    def get_user_games(self,
+                       name,
+                       status=None,
+                       order='newest',
+                       limit=None,
+                       cursor=None):
+        """Returns one page of the games a user has joined.
+        Args:
+            name: The user's name
+            status: One of open, placing, active or finished, or None for
+              every game that is not finished
+            order: One of newest, oldest or recently_updated
+            limit: The maximum number of games, or None for all of them
+            cursor: The cursor returned with the previous page, or None
+              for the first page
+        Returns:
+            The games, and the cursor of the next page, a string, or None
+            if there are no more games
+        Raises:
+            ValueError: If the cursor is not one of this listing"""
+        raise NotImplementedError
+
+    # - - - - History - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def get_history(self, game, start=0, limit=None):
+        """Returns the moves of a game after the first start moves, up to
+        limit of them, as a list of tuples of the move's index and it's
+        move log dict"""
+        return list(islice(iter_moves(game, None, self.get_boards(game),
+                                      start),
+                           limit))
+
+    # - - - - Stats - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def get_win_loss(self):
+        """Returns a dict of user name to a dict of the number of games
+        they have won and lost, for every user that has finished a
+        game"""
+        raise NotImplementedError
+
+    def get_game_totals(self):
+        """Returns the number of finished games and their total moves"""
+        raise NotImplementedError
+
+    def get_average_moves(self):
+        """Returns the number of finished games and their average number
+        of moves"""
+        finished, total_moves = self.get_game_totals()
+        return finished, float(total_moves) / finished if finished else 0.0
+
+    # - - - - Caches - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def get_cached_version(self, game_key):
+        """Returns the current version of a game, or None if not cached"""
+        return None
+
+    def add_cached_version(self, game_key, version):
+        """Records the version of a game as it was read"""
+
+    def get_cached_views(self, versions, board_format):
+        """Returns a dict of game key to the cached GameStatusMessage of
+        the game's version, given a dict of game key to version"""
+        return {}
+
+    def cache_views(self, game_forms, board_format):
+        """Caches GameStatusMessage views, each under it's version"""
+
+    def get_view_cache_stats(self):
+        """Returns the number of view cache hits and misses, and the hit
+        rate"""
+        return {'hits': 0, 'misses': 0, 'hit_rate': 0.0}
+
+    def record_contention(self, name, attempts, conflicts, failed):
+        """Adds to the counts of attempts, conflicts and failures of an
+        update, see utils/transactions.py"""
+        with self._contention_lock:
+            counts = self._contention.setdefault(name, [0, 0, 0])
+            counts[0] += attempts
+            counts[1] += conflicts
+            counts[2] += int(failed)
+
+    def get_contention_stats(self, name):
+        """Returns the attempt, conflict and failure counts of an update,
+        and the share of attempts that conflicted"""
+        attempts, conflicts, failures = self._contention.get(name,
+                                                             (0, 0, 0))
+        return {'attempts': attempts,
+                'conflicts': conflicts,
+                'failures': failures,
+                'contention_rate': (float(conflicts) / attempts
+                                    if attempts else 0.0)}
+
+    def close(self):
+        pass
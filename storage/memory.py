@@ -0,0 +1,144 @@
+"""In-memory storage, for local runs and tests. Nothing outlives the
+process."""
+
+import threading
+
+from storage.base import Repository, NameTakenError, VersionConflictError
+from storage.records import (
+    BoardRecord,
+    LISTING_ORDERS,
+    now,
+    get_loser,
+    encode_listing_cursor,
+    decode_listing_cursor
+)
+
+
+class MemoryRepository(Repository):
+
+    def __init__(self):
+        Repository.__init__(self)
+        self._lock = threading.Lock()
+        self._users = {}
+        self._emails = {}
+        self._games = {}
+        # Game id to a dict of player name to BoardRecord
+        self._boards = {}
+        # User name to the set of ids of the games they have joined
+        self._user_games = {}
+        self._next_id = 1
+        # User name to [won, lost], and [finished, total moves]
+        self._win_loss = {}
+        self._totals = [0, 0]
+
+    def add_user(self, user):
+        with self._lock:
+            if user.name in self._users:
+                raise NameTakenError(user.name)
+            self._users[user.name] = user.copy()
+            self._emails[user.email] = user.name
+
+    def get_user(self, name):
+        user = self._users.get(name)
+        return user.copy() if user else None
+
+    def get_users(self, names):
+        return dict((name, self._users[name].copy())
+                    for name in names if name in self._users)
+
+    def get_user_by_email(self, email):
+        return self.get_user(self._emails.get(email))
+
+    def get_game(self, game_id):
+        game = self._games.get(game_id)
+        return game.copy() if game else None
+
+    def get_boards(self, game):
+        boards = self._boards.get(game.id, {})
+        return dict((name, boards[name].copy() if name in boards
+                     else BoardRecord(name))
+                    for name in game.players)
+
+    def _count_result(self, game):
+        self._win_loss.setdefault(game.winner, [0, 0])[0] += 1
+        self._win_loss.setdefault(get_loser(game), [0, 0])[1] += 1
+        self._totals[0] += 1
+        self._totals[1] += game.move_count
+
+    def _store(self, game, boards):
+        stored = self._games.get(game.id)
+        if game.id is None:
+            game.id = self._next_id
+            self._next_id += 1
+            game.created = now()
+        if game.game_over and not (stored and stored.game_over):
+            self._count_result(game)
+        game.version += 1
+        game.updated = now()
+        self._games[game.id] = game.copy()
+        stored_boards = self._boards.setdefault(game.id, {})
+        for board in boards:
+            stored_boards[board.player] = board.copy()
+        for name in game.players:
+            self._user_games.setdefault(name, set()).add(game.id)
+
+    def _check_version(self, game):
+        stored = self._games.get(game.id)
+        if stored is None or stored.version != game.version:
+            raise VersionConflictError(game.id)
+
+    def put_game(self, game, boards=()):
+        with self._lock:
+            if game.id is not None:
+                self._check_version(game)
+            self._store(game, boards)
+
+    def put_games(self, games):
+        with self._lock:
+            for game, boards in games:
+                self._store(game, boards)
+
+    def delete_game(self, game):
+        with self._lock:
+            self._check_version(game)
+            del self._games[game.id]
+            self._boards.pop(game.id, None)
+            for name in game.players:
+                self._user_games[name].discard(game.id)
+
+    def get_user_games(self,
+                       name,
+                       status=None,
+                       order='newest',
+                       limit=None,
+                       cursor=None):
+        field, latest_first = LISTING_ORDERS[order]
+        with self._lock:
+            games = [self._games[game_id]
+                     for game_id in self._user_games.get(name, ())]
+        if status:
+            games = [game for game in games if game.status == status]
+        else:
+            games = [game for game in games if not game.game_over]
+
+        def get_sort_key(game):
+            return getattr(game, field), game.id
+
+        games.sort(key=get_sort_key, reverse=latest_first)
+        if cursor:
+            last = decode_listing_cursor(cursor)
+            games = [game for game in games
+                     if (get_sort_key(game) < last) == latest_first and
+                     get_sort_key(game) != last]
+        page = games[:limit]
+        next_cursor = None
+        if limit is not None and len(games) > limit:
+            next_cursor = encode_listing_cursor(page[-1], order)
+        return [game.copy() for game in page], next_cursor
+
+    def get_win_loss(self):
+        return dict((name, {'won': won, 'lost': lost})
+                    for name, (won, lost) in self._win_loss.iteritems())
+
+    def get_game_totals(self):
+        return tuple(self._totals)
@@ -0,0 +1,401 @@
+"""Datastore storage, over the ndb models of models/ndbModels.py.
+
+Players are stored as User keys, and are resolved from their names with
+the UserName index, cached in memcache. Games still on the legacy Piece
+and Miss kinds are migrated when they are read with get_game (see
+utils/migration.py), so every game read that way has Boards and stored
+player names; listings only fill in the names of such games, and build
+their boards from the legacy kinds. A GameRecord read from the datastore
+holds it's Game entity as stored, so the keys of it's players and boards
+are known without resolving the names again.
+
+Writes to a stored game check it's version in a transaction, which also
+counts the result of a game that ends in the sharded stats of
+utils/stats.py. The game views and versions are cached as in
+utils/view_cache.py, and the contention counts kept as in
+utils/transactions.py, all in memcache."""
+
+from google.appengine.api import datastore_errors, memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models.ndbModels import User, UserName, Game, Board
+from storage.base import (
+    Repository,
+    StorageError,
+    NameTakenError,
+    VersionConflictError
+)
+from storage.records import UserRecord, GameRecord, BoardRecord, get_loser
+from utils.getters import (
+    get_board_key,
+    get_game_players,
+    get_games_entities,
+    get_games_players,
+    get_user_games_page
+)
+from utils.migration import migrate_game
+from utils import stats, transactions, view_cache
+
+USER_KEY_PREFIX = 'USER_KEY:'
+
+
+def _user_record(user):
+    return UserRecord(user.name, user.email)
+
+
+def _game_record(game, players=None):
+    """Returns the GameRecord of a Game.
+    Args:
+        players: A dict of player key to User, only needed if the game does
+          not have the player names yet"""
+    names = {None: None}
+    for player_key, name in ((game.player_one, game.player_one_name),
+                             (game.player_two, game.player_two_name)):
+        if player_key:
+            names[player_key] = name or players[player_key].name
+    record = GameRecord(names[game.player_one], id=game.key.id())
+    record.player_two = names[game.player_two]
+    record.player_turn = names[game.player_turn]
+    record.player_one_pieces_loaded = game.player_one_pieces_loaded
+    record.player_two_pieces_loaded = game.player_two_pieces_loaded
+    record.game_started = game.game_started
+    record.game_over = game.game_over
+    record.winner = names[game.winner]
+    record.board_size = game.board_size
+    record.move_count = game.move_count
+    record.version = game.version
+    record.created = game.created
+    record.updated = game.updated
+    record.stored = game
+    return record
+
+
+def _board_record(name, board):
+    return BoardRecord(name,
+                       board.fleet or {},
+                       board.hit_mask or 0,
+                       board.miss_mask or 0,
+                       board.strikes or '')
+
+
+def _copy_stored_fields(game, entity):
+    """Copies the fields set when the Game entity was put onto the game"""
+    game.id = entity.key.id()
+    game.version = entity.version
+    game.created = entity.created
+    game.updated = entity.updated
+    game.stored = entity
+
+
+class NdbRepository(Repository):
+
+    # - - - - Users - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def add_user(self, user):
+        # Users created before the UserName index existed
+        if User.query(User.name == user.name).get(keys_only=True):
+            raise NameTakenError(user.name)
+        user_key = ndb.Key(User, User.allocate_ids(1)[0])
+
+        def create():
+            # Claiming the name in the UserName index within the same
+            # transaction keeps concurrent requests from sharing a name
+            if UserName.get_by_id(user.name):
+                raise NameTakenError(user.name)
+            ndb.put_multi([User(key=user_key,
+                                name=user.name,
+                                email=user.email),
+                           UserName(id=user.name, user=user_key)])
+
+        ndb.transaction(create, xg=True)
+
+    def _get_user_keys(self, names):
+        """Resolves names to User keys, reading through memcache and then
+        the UserName index. Users created before the index existed are
+        looked up by query once, and added to the index.
+        Returns:
+            A dict of name to User key of every name in use"""
+        names = list(set(names))
+        user_keys = dict(
+            (name, ndb.Key(urlsafe=urlsafe))
+            for name, urlsafe in memcache.get_multi(
+                names, key_prefix=USER_KEY_PREFIX).iteritems())
+        missing = [name for name in names if name not in user_keys]
+        if not missing:
+            return user_keys
+        found = {}
+        user_names = ndb.get_multi([ndb.Key(UserName, name)
+                                    for name in missing])
+        for name, user_name in zip(missing, user_names):
+            if user_name:
+                found[name] = user_name.user
+                continue
+            user_key = User.query(User.name == name).get(keys_only=True)
+            if user_key:
+                UserName(id=name, user=user_key).put()
+                found[name] = user_key
+        memcache.set_multi(dict((name, user_key.urlsafe())
+                                for name, user_key in found.iteritems()),
+                           key_prefix=USER_KEY_PREFIX)
+        user_keys.update(found)
+        return user_keys
+
+    def _resolve_players(self, names):
+        """Returns a dict of name to User key of every name.
+        Raises:
+            StorageError: If a name has no user"""
+        user_keys = self._get_user_keys(names)
+        missing = set(names) - set(user_keys)
+        if missing:
+            raise StorageError('No user named {}'.format(
+                ', '.join(sorted(missing))))
+        return user_keys
+
+    def get_user(self, name):
+        return self.get_users([name]).get(name)
+
+    def get_users(self, names):
+        user_keys = self._get_user_keys(names)
+        users = ndb.get_multi(user_keys.values())
+        return dict((name, _user_record(user))
+                    for name, user in zip(user_keys, users) if user)
+
+    def get_user_by_email(self, email):
+        user = User.query(User.email == email).get()
+        return _user_record(user) if user else None
+
+    # - - - - Games - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def get_game_key(self, game):
+        return ndb.Key(Game, game.id).urlsafe()
+
+    def get_game_id(self, game_key):
+        try:
+            key = ndb.Key(urlsafe=game_key)
+        except TypeError:
+            raise ValueError('Invalid game key')
+        except Exception, e:
+            if e.__class__.__name__ == 'ProtocolBufferDecodeError':
+                raise ValueError('Invalid game key')
+            raise
+        if key.kind() != Game._get_kind() or key.parent() or not key.id():
+            raise ValueError('Invalid game key')
+        return key.id()
+
+    def get_game(self, game_id):
+        game = Game.get_by_id(game_id)
+        if game and migrate_game(game):
+            game = game.key.get()
+        return _game_record(game) if game else None
+
+    def _get_stored(self, games):
+        """Returns the Game entity of each game, as read with it"""
+        missing = [game.id for game in games if game.stored is None]
+        entities = dict(zip(missing,
+                            ndb.get_multi([ndb.Key(Game, game_id)
+                                           for game_id in missing])))
+        return [game.stored or entities[game.id] for game in games]
+
+    def get_boards(self, game):
+        return self.get_games_boards([game])[game.id]
+
+    def get_games_boards(self, games):
+        entities = self._get_stored(games)
+        _, boards = get_games_entities(entities)
+        games_boards = {}
+        for game, entity in zip(games, entities):
+            names = {entity.player_one: game.player_one,
+                     entity.player_two: game.player_two}
+            games_boards[game.id] = dict(
+                (names[player_key], _board_record(names[player_key], board))
+                for player_key, board in boards[entity.key].iteritems())
+        return games_boards
+
+    def _get_player_keys(self, game):
+        """Returns a dict of name to User key of the players of a game,
+        taken from it's stored Game entity where it has them"""
+        user_keys = {}
+        entity = game.stored
+        if entity is not None:
+            for player_key, name in ((entity.player_one,
+                                      entity.player_one_name),
+                                     (entity.player_two,
+                                      entity.player_two_name)):
+                if player_key and name:
+                    user_keys[name] = player_key
+        missing = [name for name in game.players if name not in user_keys]
+        if missing:
+            user_keys.update(self._resolve_players(missing))
+        return user_keys
+
+    def _set_fields(self, entity, game, boards, user_keys):
+        """Copies a game's fields onto it's Game entity.
+        Returns:
+            Board entities for the game's boards"""
+        entity.player_one = user_keys[game.player_one]
+        entity.player_two = user_keys.get(game.player_two)
+        entity.player_one_name = game.player_one
+        entity.player_two_name = game.player_two
+        entity.player_turn = user_keys[game.player_turn]
+        entity.player_one_pieces_loaded = game.player_one_pieces_loaded
+        entity.player_two_pieces_loaded = game.player_two_pieces_loaded
+        entity.game_started = game.game_started
+        entity.game_over = game.game_over
+        entity.winner = user_keys.get(game.winner)
+        entity.board_size = game.board_size
+        entity.move_count = game.move_count
+        board_entities = []
+        for board in boards:
+            player_key = user_keys[board.player]
+            board_entities.append(Board(
+                key=get_board_key(entity.key, player_key),
+                player=player_key,
+                fleet=board.fleet,
+                hit_mask=board.hit_mask,
+                miss_mask=board.miss_mask,
+                strikes=board.strikes))
+        return board_entities
+
+    def _get_result(self, game, user_keys):
+        """Returns the result of a finished game, as counted by
+        utils.stats.get_results_stats"""
+        loser = get_loser(game)
+        return ((user_keys[game.winner], game.winner),
+                (user_keys[loser], loser),
+                game.move_count)
+
+    def put_game(self, game, boards=()):
+        if game.id is None:
+            self.put_games([(game, boards)])
+        else:
+            self._update_game(game, boards)
+        view_cache.set_cached_version(self.get_game_key(game), game.version)
+
+    def _update_game(self, game, boards):
+        user_keys = self._get_player_keys(game)
+
+        def update():
+            entity = Game.get_by_id(game.id)
+            if entity is None or entity.version != game.version:
+                raise VersionConflictError(game.id)
+            ended = game.game_over and not entity.game_over
+            entities = self._set_fields(entity, game, boards, user_keys)
+            if ended:
+                entities += stats.get_results_stats(
+                    [self._get_result(game, user_keys)])
+            transactions.put_game(entity, *entities)
+            return entity, ended
+
+        try:
+            entity, ended = ndb.transaction(update, xg=True, retries=0)
+        except datastore_errors.TransactionFailedError:
+            # Committed by another request after the game was read here
+            raise VersionConflictError(game.id)
+        _copy_stored_fields(game, entity)
+        if ended:
+            stats.clear_average_moves()
+
+    def put_games(self, games):
+        """Stores new games with one batched put, without a transaction.
+        The results of finished games are counted in the first shards of
+        the stats, see utils/stats.py"""
+        games = list(games)
+        if not games:
+            return
+        user_keys = self._resolve_players(
+            set(name for game, _ in games for name in game.players))
+        first_id = Game.allocate_ids(len(games))[0]
+        game_entities = []
+        entities = []
+        for offset, (game, boards) in enumerate(games):
+            entity = Game(id=first_id + offset, uses_boards=True)
+            board_entities = self._set_fields(entity, game, boards,
+                                              user_keys)
+            entity.version += 1
+            game_entities.append(entity)
+            entities.append(entity)
+            entities.extend(board_entities)
+        results = [self._get_result(game, user_keys)
+                   for game, _ in games if game.game_over]
+        if results:
+            entities += stats.get_results_stats(results, shard=0)
+        ndb.put_multi(entities)
+        for (game, _), entity in zip(games, game_entities):
+            _copy_stored_fields(game, entity)
+        if results:
+            stats.clear_average_moves()
+
+    def delete_game(self, game):
+        def delete():
+            entity = Game.get_by_id(game.id)
+            if entity is None or entity.version != game.version:
+                raise VersionConflictError(game.id)
+            ndb.delete_multi([get_board_key(entity.key, player_key)
+                              for player_key in get_game_players(entity)] +
+                             [entity.key])
+
+        try:
+            ndb.transaction(delete, xg=True, retries=0)
+        except datastore_errors.TransactionFailedError:
+            raise VersionConflictError(game.id)
+        view_cache.delete_cached_version(self.get_game_key(game))
+
+    def get_user_games(self,
+                       name,
+                       status=None,
+                       order='newest',
+                       limit=None,
+                       cursor=None):
+        user_key = self._get_user_keys([name]).get(name)
+        if user_key is None:
+            return [], None
+        try:
+            cursor = Cursor(urlsafe=cursor) if cursor else None
+            games, next_cursor = get_user_games_page(user_key,
+                                                     status,
+                                                     order,
+                                                     limit,
+                                                     cursor)
+        except (TypeError, datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            # Malformed, or a cursor the datastore can not resume the
+            # query from
+            raise ValueError('Invalid cursor')
+        players = get_games_players(games)
+        return ([_game_record(game, players) for game in games],
+                next_cursor.urlsafe() if next_cursor else None)
+
+    # - - - - Stats - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def get_win_loss(self):
+        return stats.get_win_loss()
+
+    def get_game_totals(self):
+        return stats.get_game_totals()
+
+    def get_average_moves(self):
+        return stats.get_average_moves()
+
+    # - - - - Caches - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def get_cached_version(self, game_key):
+        return view_cache.get_cached_version(game_key)
+
+    def add_cached_version(self, game_key, version):
+        view_cache.add_cached_version(game_key, version)
+
+    def get_cached_views(self, versions, board_format):
+        return view_cache.get_cached_views(versions, board_format)
+
+    def cache_views(self, game_forms, board_format):
+        view_cache.cache_views(game_forms, board_format)
+
+    def get_view_cache_stats(self):
+        return view_cache.get_view_cache_stats()
+
+    def record_contention(self, name, attempts, conflicts, failed):
+        transactions.record_contention(name, attempts, conflicts, failed)
+
+    def get_contention_stats(self, name):
+        return transactions.get_contention_stats(name)
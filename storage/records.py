@@ -0,0 +1,151 @@
+"""Plain records of the stored users, games and boards, shared by every
+storage backend.
+
+Players are identified by their user names, which are unique, rather than
+by datastore keys. A GameRecord has the fields of Game that are read by
+utils/engine.py and utils/history.py, and a BoardRecord those of Board, so
+both can be used with the rules and the move history as they are."""
+
+from datetime import datetime
+
+from utils.bitboard import DEFAULT_BOARD_SIZE
+from utils.engine import get_game_status
+
+
+class UserRecord(object):
+    __slots__ = ('name', 'email')
+
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+    def copy(self):
+        return UserRecord(self.name, self.email)
+
+
+class GameRecord(object):
+    """A game between two players, named by player_one and player_two.
+    id is None until the game is first stored. stored is left to the
+    backend the game was read from, which may keep what it read there,
+    such as the Game entity"""
+    __slots__ = ('id', 'player_one', 'player_two', 'player_turn',
+                 'player_one_pieces_loaded', 'player_two_pieces_loaded',
+                 'game_started', 'game_over', 'winner', 'board_size',
+                 'move_count', 'version', 'created', 'updated', 'stored')
+
+    def __init__(self,
+                 player_one,
+                 player_two=None,
+                 board_size=DEFAULT_BOARD_SIZE,
+                 id=None):
+        self.id = id
+        self.player_one = player_one
+        self.player_two = player_two
+        self.player_turn = player_one
+        self.player_one_pieces_loaded = False
+        self.player_two_pieces_loaded = False
+        self.game_started = False
+        self.game_over = False
+        self.winner = None
+        self.board_size = board_size
+        self.move_count = 0
+        self.version = 0
+        self.created = None
+        self.updated = None
+        self.stored = None
+
+    # Players are named by their names, so these are the same fields as
+    # player_one and player_two, for utils/history.py
+    @property
+    def player_one_name(self):
+        return self.player_one
+
+    @property
+    def player_two_name(self):
+        return self.player_two
+
+    @property
+    def players(self):
+        return [name for name in (self.player_one, self.player_two) if name]
+
+    @property
+    def status(self):
+        return get_game_status(self)
+
+    def copy(self):
+        game = GameRecord(self.player_one)
+        for field in self.__slots__:
+            setattr(game, field, getattr(self, field))
+        return game
+
+
+class BoardRecord(object):
+    """A player's fleet, hit marks, misses and the strikes against them,
+    as in Board"""
+    __slots__ = ('player', 'fleet', 'hit_mask', 'miss_mask', 'strikes')
+
+    def __init__(self,
+                 player,
+                 fleet=None,
+                 hit_mask=0,
+                 miss_mask=0,
+                 strikes=''):
+        self.player = player
+        self.fleet = fleet if fleet is not None else {}
+        self.hit_mask = hit_mask
+        self.miss_mask = miss_mask
+        self.strikes = strikes
+
+    def copy(self):
+        return BoardRecord(self.player,
+                           dict(self.fleet),
+                           self.hit_mask,
+                           self.miss_mask,
+                           self.strikes)
+
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# Orders of a user's games, as the field they are sorted by, and True if
+# the latest come first
+LISTING_ORDERS = {'newest': ('created', True),
+                  'oldest': ('created', False),
+                  'recently_updated': ('updated', True)}
+
+
+def now():
+    """Returns the time stored as a game's created and updated times"""
+    return datetime.utcnow()
+
+
+def format_time(value):
+    return value.strftime(TIME_FORMAT)
+
+
+def parse_time(value):
+    return datetime.strptime(value, TIME_FORMAT)
+
+
+def get_loser(game):
+    """Returns the name of the player of a finished game that lost"""
+    if game.winner == game.player_one:
+        return game.player_two
+    return game.player_one
+
+
+def encode_listing_cursor(game, order):
+    """Returns the cursor of the listing page after a game, for backends
+    that list games by their sort field and id"""
+    field, _ = LISTING_ORDERS[order]
+    return '{}/{}'.format(format_time(getattr(game, field)), game.id)
+
+
+def decode_listing_cursor(cursor):
+    """Returns the sort field's value and the id of the game a listing
+    cursor follows.
+    Raises:
+        ValueError: If the cursor is malformed"""
+    try:
+        time, game_id = cursor.split('/')
+        return parse_time(time), int(game_id)
+    except ValueError:
+        raise ValueError('Invalid cursor')
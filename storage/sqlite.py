@@ -0,0 +1,371 @@
+"""SQLite storage, for local deployments.
+
+The database is opened in WAL mode, so reads are not blocked by a write in
+progress. Each put is one transaction, and put_games writes a whole batch
+of games in one transaction with executemany. Bitboard masks can be wider
+than SQLite's 64 bit integers, so they are stored as hex text. A game's
+players are also written to game_players, which is indexed like the
+players property of Game, to list a user's games without a scan. The
+result of a game is counted in user_stats and game_totals by the put that
+ends it.
+
+One connection is shared by every thread, and used by one at a time."""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from storage.base import Repository, NameTakenError, VersionConflictError
+from storage.records import (
+    UserRecord,
+    GameRecord,
+    BoardRecord,
+    LISTING_ORDERS,
+    now,
+    format_time,
+    parse_time,
+    get_loser,
+    encode_listing_cursor,
+    decode_listing_cursor
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    email TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    player_one TEXT NOT NULL,
+    player_two TEXT,
+    player_turn TEXT NOT NULL,
+    player_one_pieces_loaded INTEGER NOT NULL,
+    player_two_pieces_loaded INTEGER NOT NULL,
+    game_started INTEGER NOT NULL,
+    game_over INTEGER NOT NULL,
+    winner TEXT,
+    board_size INTEGER NOT NULL,
+    move_count INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS game_players (
+    player TEXT NOT NULL,
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    status TEXT NOT NULL,
+    created TEXT NOT NULL,
+    PRIMARY KEY (player, game_id)
+);
+CREATE INDEX IF NOT EXISTS game_players_status
+    ON game_players (player, status, created);
+
+CREATE TABLE IF NOT EXISTS boards (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    player TEXT NOT NULL,
+    fleet TEXT NOT NULL,
+    hit_mask TEXT NOT NULL,
+    miss_mask TEXT NOT NULL,
+    strikes BLOB NOT NULL,
+    PRIMARY KEY (game_id, player)
+);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    name TEXT PRIMARY KEY,
+    won INTEGER NOT NULL,
+    lost INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS game_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    finished INTEGER NOT NULL,
+    total_moves INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO game_totals VALUES (0, 0, 0);
+'''
+
+GAME_FIELDS = ('player_one', 'player_two', 'player_turn',
+               'player_one_pieces_loaded', 'player_two_pieces_loaded',
+               'game_started', 'game_over', 'winner', 'board_size',
+               'move_count', 'version', 'created', 'updated')
+BOOLEAN_FIELDS = ('player_one_pieces_loaded', 'player_two_pieces_loaded',
+                  'game_started', 'game_over')
+
+
+def _game_row(game):
+    return (game.player_one,
+            game.player_two,
+            game.player_turn,
+            int(game.player_one_pieces_loaded),
+            int(game.player_two_pieces_loaded),
+            int(game.game_started),
+            int(game.game_over),
+            game.winner,
+            game.board_size,
+            game.move_count,
+            game.version,
+            format_time(game.created),
+            format_time(game.updated))
+
+
+def _row_game(row):
+    game = GameRecord(row['player_one'], id=row['id'])
+    for field in GAME_FIELDS:
+        setattr(game, field, row[field])
+    for field in BOOLEAN_FIELDS:
+        setattr(game, field, bool(row[field]))
+    game.created = parse_time(game.created)
+    game.updated = parse_time(game.updated)
+    return game
+
+
+def _board_row(game_id, board):
+    return (game_id,
+            board.player,
+            json.dumps(board.fleet),
+            '%x' % board.hit_mask,
+            '%x' % board.miss_mask,
+            sqlite3.Binary(board.strikes or ''))
+
+
+def _row_board(row):
+    # JSON keys come back as unicode, as with Board.fleet
+    return BoardRecord(row['player'],
+                       json.loads(row['fleet']),
+                       int(row['hit_mask'], 16),
+                       int(row['miss_mask'], 16),
+                       str(row['strikes']))
+
+
+class SqliteRepository(Repository):
+
+    def __init__(self, path):
+        Repository.__init__(self)
+        # Transactions are begun and committed explicitly, see _transaction
+        self._connection = sqlite3.connect(path,
+                                           timeout=30,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        # Durable at every checkpoint rather than at every commit, the
+        # recommended setting with WAL
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('PRAGMA foreign_keys=ON')
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def _query(self, sql, parameters=()):
+        """Returns every row of a query"""
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        """Runs the block in a write transaction, taking the write lock up
+        front so that reading the game ids cannot race another writer"""
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def add_user(self, user):
+        try:
+            with self._transaction():
+                self._connection.execute(
+                    'INSERT INTO users (name, email) VALUES (?, ?)',
+                    (user.name, user.email))
+        except sqlite3.IntegrityError:
+            raise NameTakenError(user.name)
+
+    def get_user(self, name):
+        rows = self._query('SELECT name, email FROM users WHERE name = ?',
+                           (name,))
+        return UserRecord(rows[0]['name'], rows[0]['email']) if rows else None
+
+    def get_users(self, names):
+        names = list(names)
+        if not names:
+            return {}
+        rows = self._query(
+            'SELECT name, email FROM users WHERE name IN ({})'.format(
+                ', '.join('?' * len(names))),
+            names)
+        return dict((row['name'], UserRecord(row['name'], row['email']))
+                    for row in rows)
+
+    def get_user_by_email(self, email):
+        rows = self._query('SELECT name, email FROM users WHERE email = ?',
+                           (email,))
+        return UserRecord(rows[0]['name'], rows[0]['email']) if rows else None
+
+    def get_game(self, game_id):
+        rows = self._query('SELECT * FROM games WHERE id = ?', (game_id,))
+        return _row_game(rows[0]) if rows else None
+
+    def get_boards(self, game):
+        rows = self._query('SELECT * FROM boards WHERE game_id = ?',
+                           (game.id,))
+        boards = dict((row['player'], _row_board(row)) for row in rows)
+        return dict((name, boards.get(name) or BoardRecord(name))
+                    for name in game.players)
+
+    def _insert_games(self, games):
+        """Inserts new games in the open transaction, giving each it's id"""
+        for game, _ in games:
+            game.version += 1
+            game.created = game.updated = now()
+        cursor = self._connection.cursor()
+        # executemany does not return the ids of the rows it inserts, so
+        # ids are taken from the end of the table, which no one else can
+        # write to until the transaction ends
+        first_id = cursor.execute(
+            'SELECT COALESCE(MAX(id), 0) + 1 FROM games').fetchone()[0]
+        for offset, (game, _) in enumerate(games):
+            game.id = first_id + offset
+        cursor.executemany(
+            'INSERT INTO games (id, {}) VALUES (?, {})'.format(
+                ', '.join(GAME_FIELDS), ', '.join('?' * len(GAME_FIELDS))),
+            [(game.id,) + _game_row(game) for game, _ in games])
+
+    def _write_children(self, games):
+        """Writes the boards and player index rows of games in the open
+        transaction"""
+        cursor = self._connection.cursor()
+        cursor.executemany(
+            'INSERT OR REPLACE INTO boards VALUES (?, ?, ?, ?, ?, ?)',
+            [_board_row(game.id, board)
+             for game, boards in games for board in boards])
+        cursor.executemany(
+            'INSERT OR REPLACE INTO game_players VALUES (?, ?, ?, ?)',
+            [(name, game.id, game.status, format_time(game.created))
+             for game, _ in games for name in game.players])
+
+    def _count_results(self, games):
+        """Counts the results of finished games in the open transaction"""
+        if not games:
+            return
+        results = {}
+        for game in games:
+            results.setdefault(game.winner, [0, 0])[0] += 1
+            results.setdefault(get_loser(game), [0, 0])[1] += 1
+        cursor = self._connection.cursor()
+        cursor.executemany(
+            'INSERT OR IGNORE INTO user_stats VALUES (?, 0, 0)',
+            [(name,) for name in results])
+        cursor.executemany(
+            'UPDATE user_stats SET won = won + ?, lost = lost + ? '
+            'WHERE name = ?',
+            [(won, lost, name) for name, (won, lost) in results.iteritems()])
+        cursor.execute(
+            'UPDATE game_totals SET finished = finished + ?, '
+            'total_moves = total_moves + ?',
+            (len(games), sum(game.move_count for game in games)))
+
+    def _check_version(self, game):
+        """Returns the stored game's row, read in the open transaction.
+        Raises:
+            VersionConflictError: If the stored version is not the game's"""
+        row = self._connection.execute(
+            'SELECT version, game_over FROM games WHERE id = ?',
+            (game.id,)).fetchone()
+        if row is None or row['version'] != game.version:
+            raise VersionConflictError(game.id)
+        return row
+
+    def put_game(self, game, boards=()):
+        with self._transaction():
+            if game.id is None:
+                self._insert_games([(game, boards)])
+                ended = game.game_over
+            else:
+                ended = game.game_over and not self._check_version(
+                    game)['game_over']
+                game.version += 1
+                game.updated = now()
+                self._connection.execute(
+                    'UPDATE games SET {} WHERE id = ?'.format(
+                        ', '.join(field + ' = ?' for field in GAME_FIELDS)),
+                    _game_row(game) + (game.id,))
+            self._write_children([(game, boards)])
+            self._count_results([game] if ended else [])
+
+    def put_games(self, games):
+        games = list(games)
+        if not games:
+            return
+        with self._transaction():
+            self._insert_games(games)
+            self._write_children(games)
+            self._count_results([game for game, _ in games
+                                 if game.game_over])
+
+    def delete_game(self, game):
+        with self._transaction():
+            self._check_version(game)
+            for table, column in (('boards', 'game_id'),
+                                  ('game_players', 'game_id'),
+                                  ('games', 'id')):
+                self._connection.execute(
+                    'DELETE FROM {} WHERE {} = ?'.format(table, column),
+                    (game.id,))
+
+    def get_user_games(self,
+                       name,
+                       status=None,
+                       order='newest',
+                       limit=None,
+                       cursor=None):
+        field, latest_first = LISTING_ORDERS[order]
+        # Creation times are indexed along with the status in game_players
+        column = ('game_players.created' if field == 'created'
+                  else 'games.updated')
+        conditions = ['game_players.player = ?']
+        parameters = [name]
+        if status:
+            conditions.append('game_players.status = ?')
+            parameters.append(status)
+        else:
+            conditions.append('game_players.status != ?')
+            parameters.append('finished')
+        if cursor:
+            value, game_id = decode_listing_cursor(cursor)
+            conditions.append('({0} {1} ? OR ({0} = ? AND games.id {1} ?))'
+                              .format(column, '<' if latest_first else '>'))
+            parameters += [format_time(value), format_time(value), game_id]
+        direction = 'DESC' if latest_first else 'ASC'
+        # One extra game tells whether there is a next page
+        rows = self._query(
+            '''SELECT games.* FROM game_players
+               JOIN games ON games.id = game_players.game_id
+               WHERE {0}
+               ORDER BY {1} {2}, games.id {2}
+               LIMIT ?'''.format(' AND '.join(conditions),
+                                 column,
+                                 direction),
+            parameters + [-1 if limit is None else limit + 1])
+        games = [_row_game(row) for row in rows]
+        next_cursor = None
+        if limit is not None and len(games) > limit:
+            games = games[:limit]
+            next_cursor = encode_listing_cursor(games[-1], order)
+        return games, next_cursor
+
+    def get_win_loss(self):
+        return dict((row['name'], {'won': row['won'], 'lost': row['lost']})
+                    for row in self._query('SELECT * FROM user_stats'))
+
+    def get_game_totals(self):
+        row = self._query('SELECT finished, total_moves FROM game_totals')[0]
+        return row['finished'], row['total_moves']
@@ -0,0 +1,10 @@
+"""Tests against the App Engine testbed stubs. Run them from the root of
+the repository, with the path of the App Engine SDK in the APPENGINE_SDK
+environment variable, as for the benchmarks:
+
+    export APPENGINE_SDK=~/google_appengine
+    python -m unittest discover -s tests -t ."""
+
+from benchmarks.run import setup_sdk
+
+setup_sdk(None)
@@ -0,0 +1,143 @@
+"""Games played through the endpoints of api.py on each storage backend,
+with the results counted as the games end."""
+
+import unittest
+
+import endpoints
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb, testbed
+from protorpc import message_types
+
+from api import BattleshipAPI
+from models.requests import (
+    UserRequest,
+    NewGameRequest,
+    GameStatus,
+    STRIKE_REQUEST,
+    GAME_REQUEST,
+    GAME_STATUS_REQUEST,
+    GAME_HISTORY_REQUEST,
+    USER_GAMES_REQUEST
+)
+from storage.memory import MemoryRepository
+from storage.ndb_storage import NdbRepository
+from storage.sqlite import SqliteRepository
+from utils.bitboard import get_codec
+
+
+def request(container, **fields):
+    return container.combined_message_class(**fields)
+
+
+class ApiTestMixin(object):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util
+            .PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+        self._repository = BattleshipAPI.repository
+        BattleshipAPI.repository = self.get_repository()
+        self.api = BattleshipAPI()
+        for name in ('alice', 'bob'):
+            self.api.create_user(UserRequest(user_name=name,
+                                             email=name + '@example.com'))
+
+    def tearDown(self):
+        BattleshipAPI.repository.close()
+        BattleshipAPI.repository = self._repository
+        self.testbed.deactivate()
+
+    def new_game(self):
+        return self.api.create_game(NewGameRequest(player_one_name='alice',
+                                                   player_two_name='bob',
+                                                   auto_place=True))
+
+    def get_status(self, game_key):
+        return self.api.get_game_status(
+            request(GAME_STATUS_REQUEST, url_safe_game_key=game_key))
+
+    def play(self, game_key):
+        """Strikes every cell in turn until the game is over.
+        Returns:
+            The number of strikes"""
+        grid = get_codec().grid
+        struck = {'alice': 0, 'bob': 0}
+        status = self.get_status(game_key)
+        while status.game_over != 'True':
+            target = ('bob' if status.player_turn == 'alice'
+                      else 'alice')
+            self.api.strike_coord(request(STRIKE_REQUEST,
+                                          url_safe_game_key=game_key,
+                                          target_player=target,
+                                          coordinate=grid[struck[target]]))
+            struck[target] += 1
+            status = self.get_status(game_key)
+        return sum(struck.itervalues())
+
+    def test_finished_game_is_counted(self):
+        game_key = self.new_game().game_key
+        moves = self.play(game_key)
+        status = self.get_status(game_key)
+
+        rankings = self.api.get_user_ranks(
+            message_types.VoidMessage()).rankings
+        self.assertEqual([ranking.username for ranking in rankings][0],
+                         status.winner)
+        average = self.api.get_average_moves(message_types.VoidMessage())
+        self.assertEqual(average.finished_games, 1)
+        self.assertEqual(average.average_moves, moves)
+        history = self.api.get_game_history(
+            request(GAME_HISTORY_REQUEST, url_safe_game_key=game_key))
+        self.assertEqual(len(history.moves), moves)
+        self.assertEqual(history.version, status.version)
+
+    def test_user_games_are_paged(self):
+        game_keys = [self.new_game().game_key for _ in xrange(3)]
+        page = self.api.get_user_games(
+            request(USER_GAMES_REQUEST, user_name='bob', limit=2))
+        next_page = self.api.get_user_games(
+            request(USER_GAMES_REQUEST,
+                    user_name='bob',
+                    limit=2,
+                    cursor=page.next_cursor))
+        self.assertEqual([form.game_key
+                          for form in page.games + next_page.games],
+                         game_keys[::-1])
+        self.assertIsNone(next_page.next_cursor)
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.get_user_games(request(USER_GAMES_REQUEST,
+                                            user_name='bob',
+                                            status=GameStatus.finished,
+                                            cursor=page.next_cursor))
+
+    def test_cancel_game(self):
+        game_key = self.new_game().game_key
+        self.api.cancel_game(request(GAME_REQUEST,
+                                     url_safe_game_key=game_key))
+        with self.assertRaises(endpoints.NotFoundException):
+            self.get_status(game_key)
+        games = self.api.get_user_games(
+            request(USER_GAMES_REQUEST, user_name='alice')).games
+        self.assertEqual(games, [])
+
+
+class NdbApiTest(ApiTestMixin, unittest.TestCase):
+
+    def get_repository(self):
+        return NdbRepository()
+
+
+class MemoryApiTest(ApiTestMixin, unittest.TestCase):
+
+    def get_repository(self):
+        return MemoryRepository()
+
+
+class SqliteApiTest(ApiTestMixin, unittest.TestCase):
+
+    def get_repository(self):
+        return SqliteRepository(':memory:')
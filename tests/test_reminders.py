@@ -0,0 +1,181 @@
+"""The reminder email fan-out of utils/reminders.py, run through the
+handlers of main.py against the datastore, taskqueue and mail stubs."""
+
+import json
+import os
+import unittest
+import urlparse
+
+import webapp2
+from google.appengine.api import taskqueue
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb, testbed
+
+import main
+from models.ndbModels import User, UserName, Game
+from utils import reminders
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUN_ID = '20160601'
+# Number of active games waiting for each user's move
+TURNS = [('user-0', 4), ('user-1', 1), ('user-2', 3)]
+
+
+class RemindersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util
+            .PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        self.mail_stub = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        ndb.get_context().set_cache_policy(False)
+        # Pages of two games, so that users' games span pages
+        self._count_turns_batch = main.count_turns_batch
+        main.count_turns_batch = (
+            lambda cursor, carry: reminders.count_turns_batch(
+                cursor, carry, batch_size=2))
+        self.user_keys = {}
+        opponent = self.add_user('opponent')
+        for name, turns in TURNS:
+            user_key = self.add_user(name)
+            for _ in xrange(turns):
+                Game(player_one=user_key,
+                     player_two=opponent,
+                     player_turn=user_key,
+                     game_started=True,
+                     uses_boards=True).put()
+        # A game waiting for it's second player is not active
+        Game(player_one=opponent, player_turn=opponent).put()
+
+    def tearDown(self):
+        main.count_turns_batch = self._count_turns_batch
+        self.testbed.deactivate()
+
+    def add_user(self, name):
+        user_key = User(name=name, email=name + '@example.com').put()
+        UserName(id=name, user=user_key).put()
+        self.user_keys[name] = user_key
+        return user_key
+
+    def get_tasks(self):
+        return self.taskqueue_stub.get_filtered_tasks()
+
+    def run_task(self, task):
+        """Posts a task to it's handler, then deletes it as the task queue
+        does, leaving it's name tombstoned"""
+        response = webapp2.Request.blank(
+            task.url, POST=task.payload).get_response(main.app)
+        self.assertEqual(response.status_int, 204)
+        taskqueue.Queue().delete_tasks_by_name(task.name)
+
+    def run_tasks(self):
+        """Runs queued tasks until there are none left.
+        Returns:
+            The tasks that were run"""
+        tasks = []
+        while self.get_tasks():
+            for task in self.get_tasks():
+                self.run_task(task)
+                tasks.append(task)
+        return tasks
+
+    def get_reminders(self, task):
+        """Returns the [url safe user key, count] of a mail task"""
+        return json.loads(urlparse.parse_qs(task.payload)['reminders'][0])
+
+    def start_run(self):
+        response = webapp2.Request.blank(
+            '/crons/send_reminder').get_response(main.app)
+        self.assertEqual(response.status_int, 200)
+
+    def get_mailed_counts(self):
+        """Returns a list of (email address, number of games) of every
+        reminder sent"""
+        counts = []
+        for message in self.mail_stub.get_sent_messages():
+            body = message.body.decode()
+            count = int(body.split('you currently have ')[1].split()[0])
+            counts.append((message.to, count))
+        return sorted(counts)
+
+    def test_counts_are_carried_across_pages(self):
+        counts = []
+        cursor, carry = None, None
+        pages = 0
+        while True:
+            page_counts, cursor, carry = reminders.count_turns_batch(
+                cursor, carry, batch_size=2)
+            counts += page_counts
+            pages += 1
+            if not cursor:
+                break
+        self.assertEqual(pages, 4)
+        self.assertEqual(sorted(counts),
+                         sorted((self.user_keys[name], turns)
+                                for name, turns in TURNS))
+
+    def test_each_user_is_mailed_their_count_once(self):
+        self.start_run()
+        tasks = self.run_tasks()
+        self.assertEqual(self.get_mailed_counts(),
+                         [(name + '@example.com', turns)
+                          for name, turns in TURNS])
+        # Each user is in one of the mail tasks, queued by the page that
+        # finished counting their games
+        mailed = [user_key
+                  for task in tasks if task.url == reminders.MAIL_URL
+                  for user_key, _ in self.get_reminders(task)]
+        self.assertEqual(sorted(mailed),
+                         sorted(self.user_keys[name].urlsafe()
+                                for name, _ in TURNS))
+
+    def test_reminders_are_mailed_in_batches(self):
+        user_keys = [ndb.Key(User, index)
+                     for index in xrange(reminders.MAIL_BATCH_SIZE * 2 + 1)]
+        reminders.queue_reminder_mail(
+            RUN_ID, [(user_key, 1) for user_key in user_keys])
+        batches = [self.get_reminders(task) for task in self.get_tasks()]
+        self.assertEqual(sorted(len(batch) for batch in batches),
+                         [1,
+                          reminders.MAIL_BATCH_SIZE,
+                          reminders.MAIL_BATCH_SIZE])
+        self.assertEqual(
+            sorted(user_key for batch in batches for user_key, _ in batch),
+            sorted(user_key.urlsafe() for user_key in user_keys))
+
+    def test_rerunning_a_day_sends_nothing_more(self):
+        self.start_run()
+        self.run_tasks()
+        sent = self.get_mailed_counts()
+        self.start_run()
+        self.assertEqual(self.get_tasks(), [])
+        self.assertEqual(self.get_mailed_counts(), sent)
+
+    def test_retried_batch_queues_nothing_more(self):
+        self.start_run()
+        first_batch = self.get_tasks()[0]
+        self.run_task(first_batch)
+        queued = sorted(task.name for task in self.get_tasks())
+        # Retried after it's tasks were queued, as after a failed response
+        response = webapp2.Request.blank(
+            first_batch.url,
+            POST=first_batch.payload).get_response(main.app)
+        self.assertEqual(response.status_int, 204)
+        self.assertEqual(sorted(task.name for task in self.get_tasks()),
+                         queued)
+        self.run_tasks()
+        self.assertEqual(self.get_mailed_counts(),
+                         [(name + '@example.com', turns)
+                          for name, turns in TURNS])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Bitboard representation of a player's board.
+
+Every coordinate of a board is assigned a single bit, so any set of
+coordinates (a ship, the hits on a board, the misses on a board) can be
+stored as one integer. Membership, intersection and "is every cell hit"
+checks are then single bit operations instead of list scans.
+
+Games may use square boards of any size from MIN_BOARD_SIZE to
+MAX_BOARD_SIZE. A BoardCodec translates between coordinates ('A1') and
+cells of a board of a given size in constant time. The default size is
+that of board.COLUMNS and board.ROWS, whose coordinates are board.GRID.
+Columns of larger boards continue after 'Z' with 'AA', 'AB' and so on."""
+
+from string import ascii_uppercase
+
+from board import COLUMNS, ROWS
+
+MIN_BOARD_SIZE = 6
+MAX_BOARD_SIZE = 50
+DEFAULT_BOARD_SIZE = len(COLUMNS)
+
+EMPTY = 'E'
+OCCUPIED = 'O'
+MISS = 'M'
+HIT = 'X'
+
+
+def _get_column_labels(size):
+    """Returns the labels of the first size columns: A - Z, then AA - AZ,
+    BA - BZ..."""
+    labels = list(ascii_uppercase[:size])
+    for first in ascii_uppercase:
+        for second in ascii_uppercase:
+            if len(labels) == size:
+                return labels
+            labels.append(first + second)
+    return labels
+
+
+class BoardCodec(object):
+    """Coordinates of a square board of size columns and size rows. Cells
+    are indexed column by column, as board.GRID"""
+
+    def __init__(self, size):
+        if size == DEFAULT_BOARD_SIZE:
+            self.columns = list(COLUMNS)
+            self.rows = list(ROWS)
+        else:
+            self.columns = _get_column_labels(size)
+            self.rows = [str(row) for row in xrange(1, size + 1)]
+        self.size = size
+        # (column, row) of every cell
+        self.labels = [(column, row)
+                       for column in self.columns for row in self.rows]
+        # Coordinate of every cell
+        self.grid = [column + row for column, row in self.labels]
+        self.num_cells = len(self.grid)
+        self.full_mask = (1 << self.num_cells) - 1
+        # Coordinate to cell index
+        self.cell_index = dict((coord, index)
+                               for index, coord in enumerate(self.grid))
+        self.column_index = dict((column, index)
+                                 for index, column in enumerate(self.columns))
+        self.row_index = dict((row, index)
+                              for index, row in enumerate(self.rows))
+
+    def coord_bit(self, coord):
+        """Returns the bit for a single coordinate"""
+        return 1 << self.cell_index[coord]
+
+    def coords_mask(self, coords):
+        """Returns a mask with the bit of every coordinate in coords set"""
+        cell_index = self.cell_index
+        mask = 0
+        for coord in coords:
+            mask |= 1 << cell_index[coord]
+        return mask
+
+    def mask_coords(self, mask):
+        """Returns the coordinates of every bit set in mask, in cell
+        order"""
+        coords = []
+        while mask:
+            bit = mask & -mask
+            coords.append(self.grid[bit.bit_length() - 1])
+            mask ^= bit
+        return coords
+
+    def render_board(self, occupied_mask, hit_mask, miss_mask):
+        """Returns the board as a string with one status character per
+        cell, in cell order"""
+        cells = []
+        append = cells.append
+        for _ in xrange(self.num_cells):
+            if hit_mask & 1:
+                append(HIT)
+            elif occupied_mask & 1:
+                append(OCCUPIED)
+            elif miss_mask & 1:
+                append(MISS)
+            else:
+                append(EMPTY)
+            occupied_mask >>= 1
+            hit_mask >>= 1
+            miss_mask >>= 1
+        return ''.join(cells)
+
+
+_CODECS = {}
+
+
+def get_codec(size=None):
+    """Returns the BoardCodec of a board size, DEFAULT_BOARD_SIZE if None.
+    Codecs are built once per size, and shared"""
+    size = size or DEFAULT_BOARD_SIZE
+    if size not in _CODECS:
+        _CODECS[size] = BoardCodec(size)
+    return _CODECS[size]
+
+
+def get_cells_codec(num_cells):
+    """Returns the BoardCodec of a board with num_cells cells"""
+    return get_codec(int(round(num_cells ** 0.5)))
+
+
+DEFAULT_CODEC = get_codec()
+
+
+def is_sunk(ship_mask, hit_mask):
+    """A ship is sunk when every one of it's cells has been hit"""
+    return ship_mask & ~hit_mask == 0
+
+
+def fleet_mask(fleet):
+    """Returns the mask of every cell occupied by a fleet, a mapping
+    of ship type to the mask of the ship"""
+    occupied_mask = 0
+    for ship_mask in fleet.itervalues():
+        occupied_mask |= ship_mask
+    return occupied_mask
+
+
+def get_ship_at(fleet, bit):
+    """Returns the type of the ship occupying the cell of bit, or None"""
+    for ship, ship_mask in fleet.iteritems():
+        if ship_mask & bit:
+            return ship
+    return None
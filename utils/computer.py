@@ -0,0 +1,32 @@
+"""The computer opponent.
+
+The computer is a regular user under a reserved name. It can only play as
+player two: it's fleet is placed at random when it enters a game, and it
+strikes back, with the strike suggested by utils/targeting.py, in the same
+write as each of it's opponent's strikes."""
+
+from storage.base import NameTakenError
+from storage.records import UserRecord
+
+COMPUTER_NAME = 'Computer'
+# Never mailed: the computer strikes back within it's opponent's request,
+# so it is never left with the turn
+COMPUTER_EMAIL = 'noreply@battleship.invalid'
+
+
+def is_computer(player_name):
+    """Returns True if the name is the computer's"""
+    return player_name == COMPUTER_NAME
+
+
+def get_computer_player(repository):
+    """Returns the computer's UserRecord, adding it the first time"""
+    user = repository.get_user(COMPUTER_NAME)
+    if user:
+        return user
+    try:
+        repository.add_user(UserRecord(COMPUTER_NAME, COMPUTER_EMAIL))
+    except NameTakenError:
+        # Added by a concurrent request
+        pass
+    return repository.get_user(COMPUTER_NAME)
@@ -0,0 +1,179 @@
+"""Rules of the game, free of the datastore and of endpoints.
+
+The rules work on any board object with fleet, hit_mask and miss_mask
+attributes, laid out as in utils/bitboard.py: the API passes the
+BoardRecords of storage/records.py, and simulations pass the lightweight
+BoardState below. Games are played through the same fields as GameState:
+simulations use GameState, and the API wraps it's GameRecords in
+GameRecordState. Broken rules
+raise RuleViolation, which the API turns into a ConflictException (see
+utils/validators.py)."""
+
+from board import PIECES
+from utils.bitboard import fleet_mask, get_ship_at, is_sunk
+
+MISS = 'Miss'
+HIT = 'Hit'
+SUNK = 'Hit - Sunk Ship'
+GAME_OVER = 'Hit - Sunk Ship: Game Over'
+# Every status a strike can have
+STATUSES = [MISS, HIT, SUNK, GAME_OVER]
+
+
+class RuleViolation(Exception):
+    pass
+
+
+class BoardState(object):
+    """A player's board, as Board but without the datastore"""
+    __slots__ = ('fleet', 'hit_mask', 'miss_mask')
+
+    def __init__(self, fleet=None):
+        self.fleet = fleet if fleet is not None else {}
+        self.hit_mask = 0
+        self.miss_mask = 0
+
+
+class GameState(object):
+    """A game in progress between two players, 0 and 1. Player 0 strikes
+    first"""
+    __slots__ = ('codec', 'boards', 'turn', 'game_over', 'winner',
+                 'move_count')
+
+    def __init__(self, codec, fleets):
+        self.codec = codec
+        self.boards = [BoardState(fleet) for fleet in fleets]
+        self.turn = 0
+        self.game_over = False
+        self.winner = None
+        self.move_count = 0
+
+
+class GameRecordState(object):
+    """A GameRecord and it's players' boards, as a GameState. Player one
+    is player 0, and the turn, winner, game_over and move_count are read
+    from and written to the GameRecord"""
+    __slots__ = ('game', 'players', 'boards')
+
+    def __init__(self, game, boards):
+        """
+        Args:
+            game: The GameRecord
+            boards: A dict of player name to BoardRecord of the game's
+              players"""
+        self.game = game
+        self.players = [game.player_one, game.player_two]
+        self.boards = [boards.get(name) for name in self.players]
+
+    @property
+    def turn(self):
+        return self.players.index(self.game.player_turn)
+
+    @turn.setter
+    def turn(self, turn):
+        self.game.player_turn = self.players[turn]
+
+    @property
+    def winner(self):
+        if self.game.winner is None:
+            return None
+        return self.players.index(self.game.winner)
+
+    @winner.setter
+    def winner(self, winner):
+        self.game.winner = self.players[winner]
+
+    @property
+    def game_over(self):
+        return self.game.game_over
+
+    @game_over.setter
+    def game_over(self, game_over):
+        self.game.game_over = game_over
+
+    @property
+    def move_count(self):
+        return self.game.move_count
+
+    @move_count.setter
+    def move_count(self, move_count):
+        self.game.move_count = move_count
+
+
+def get_game_status(game):
+    """Returns the status of a Game, or of any object with the same
+    fields: open, placing, active or finished"""
+    if game.game_over:
+        return 'finished'
+    if game.game_started:
+        return 'active'
+    if game.player_two:
+        return 'placing'
+    return 'open'
+
+
+def check_placement(board, piece_type, piece_mask, codec):
+    """Raise RuleViolation if the piece has already been placed on the
+    board, or intersects with another piece"""
+    if piece_type in board.fleet:
+        raise RuleViolation(
+            'This piece has already been placed for this player')
+    intersection = fleet_mask(board.fleet) & piece_mask
+    if intersection:
+        raise RuleViolation('Your piece intersects with {}'
+                            .format(codec.mask_coords(intersection)[0]))
+
+
+def place_piece(board, piece_type, piece_mask, codec):
+    """Places a piece on the board, if the placement is valid"""
+    check_placement(board, piece_type, piece_mask, codec)
+    board.fleet[piece_type] = piece_mask
+
+
+def is_fleet_placed(board):
+    """Returns True once every piece has been placed on the board"""
+    return len(board.fleet) == len(PIECES)
+
+
+def check_strike(board, target_bit):
+    """Raise RuleViolation if the cell has already been struck"""
+    if board.hit_mask & target_bit:
+        raise RuleViolation('This coordinate has already been hit')
+    if board.miss_mask & target_bit:
+        raise RuleViolation(
+            'This coordinate has already been struck and missed')
+
+
+def strike_board(board, target_bit):
+    """Strikes a cell of the board, if it has not been struck yet.
+    Returns:
+        The status of the strike, one of STATUSES, and the type of the ship
+        hit, or None"""
+    check_strike(board, target_bit)
+    ship = get_ship_at(board.fleet, target_bit)
+    if not ship:
+        board.miss_mask |= target_bit
+        return MISS, None
+    board.hit_mask |= target_bit
+    if not is_sunk(board.fleet[ship], board.hit_mask):
+        return HIT, ship
+    if is_sunk(fleet_mask(board.fleet), board.hit_mask):
+        return GAME_OVER, ship
+    return SUNK, ship
+
+
+def strike(game, target_bit):
+    """Makes the move of the player whose turn it is, against the other
+    player's board, and hands the turn over unless the game is won.
+    Returns:
+        The status of the strike, and the type of the ship hit, or None"""
+    if game.game_over:
+        raise RuleViolation('This game has already ended')
+    status, ship = strike_board(game.boards[1 - game.turn], target_bit)
+    game.move_count += 1
+    if status == GAME_OVER:
+        game.game_over = True
+        game.winner = game.turn
+    else:
+        game.turn = 1 - game.turn
+    return status, ship
@@ -1,72 +1,139 @@
 """File for retrieving enteties and properties from datastore."""
 
+import base64
+
 from google.appengine.ext import ndb
-import endpoints
 
-from models.ndbModels import Game, User, Piece, Miss
-from utils.validators import check_player_registered, check_piece_alignment
-from board import COLUMNS, ROWS
+from models.ndbModels import Game, User, Board, Piece, Miss
+from utils.validators import check_piece_alignment
+from utils.bitboard import fleet_mask, get_codec, DEFAULT_CODEC
 
 
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
-    Args:
-        urlsafe: A urlsafe key string
-        model: The expected entity kind
-    Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
-    Raises:
-        ValueError:"""
-    try:
-        key = ndb.Key(urlsafe=urlsafe)
-    except TypeError:
-        raise endpoints.BadRequestException('Invalid Key')
-    except Exception, e:
-        if e.__class__.__name__ == 'ProtocolBufferDecodeError':
-            raise endpoints.BadRequestException('Invalid Key')
-        else:
-            raise
-
-    entity = key.get()
-    if not entity:
-        return None
-    if not isinstance(entity, model):
-        raise ValueError('Incorrect Kind')
-    return entity
-
-
-def get_user(username):
-    """Takes in the name of a player/user,
-    and returns a user query object"""
-    user = User.query(User.name == username).get()
-    if not user:
-        raise endpoints.ConflictException(
-            '{} does not exist.'.format(username))
-    return user
-
-
-def get_registered_player(game, username):
-    player = get_user(username)
-    check_player_registered(game, player)
-    return player
-
-
-def get_players_pieces(game, player):
+def get_players_pieces_async(game, player_key):
+    """Legacy Piece entities of a player, for games not yet using Boards.
+    Returns a future"""
     return Piece.query(Piece.game == game.key).filter(
-        Piece.player == player.key).fetch()
+        Piece.player == player_key).fetch_async()
+
+
+def get_board_key(game_key, player_key):
+    return ndb.Key(Board, player_key.id(), parent=game_key)
+
+
+def get_new_board(game_key, player_key):
+    """Returns an empty Board for a player"""
+    return Board(key=get_board_key(game_key, player_key),
+                 player=player_key,
+                 fleet={},
+                 hit_mask=0,
+                 miss_mask=0)
+
+
+@ndb.tasklet
+def get_legacy_board_async(game, player_key):
+    """Builds a Board for a player from the legacy Piece and Miss kinds,
+    querying both concurrently"""
+    pieces, misses = yield (get_players_pieces_async(game, player_key),
+                            get_misses_on_player_async(game, player_key))
+    board = get_new_board(game.key, player_key)
+    for piece in pieces:
+        board.fleet[piece.ship] = DEFAULT_CODEC.coords_mask(
+            piece.coordinates)
+        board.hit_mask |= DEFAULT_CODEC.coords_mask(piece.hit_marks)
+    board.miss_mask = get_miss_mask(misses)
+    raise ndb.Return(board)
+
+
+def get_legacy_board(game, player_key):
+    return get_legacy_board_async(game, player_key).get_result()
+
+
+def get_game_players(game):
+    """Returns the keys of the game's registered players"""
+    return [key for key in (game.player_one, game.player_two) if key]
+
+
+def has_player_names(game):
+    """Returns True if the names of all of the game's players are stored on
+    the game"""
+    return bool(game.player_one_name and
+                (game.player_two is None or game.player_two_name))
+
 
+def _get_named_players(game):
+    """Returns unsaved Users holding only the key and the name of each of
+    the game's players, from the names stored on the game"""
+    names = {game.player_one: game.player_one_name,
+             game.player_two: game.player_two_name}
+    return [User(key=player_key, name=names[player_key])
+            for player_key in get_game_players(game)]
 
-def get_move_log(target_player,
-                 attacking_player,
+
+@ndb.tasklet
+def get_games_entities_async(games):
+    """Gets the players and Boards of every game with a single batched get,
+    however many games there are. The players of games storing their names
+    are not fetched, see _get_named_players; the Users of the other games'
+    players are, and only once if they are shared between games. Games
+    still on the legacy Piece and Miss kinds have their Boards built from
+    those instead, with all of their queries running concurrently with the
+    batched get.
+    Returns:
+        A dict of player key to User, and a dict of game key to a dict
+        of player key to Board"""
+    player_keys = list(set(player_key for game in games
+                           if not has_player_names(game)
+                           for player_key in get_game_players(game)))
+    board_keys = [(game, player_key) for game in games if game.uses_boards
+                  for player_key in get_game_players(game)]
+    legacy_board_keys = [(game, player_key) for game in games
+                         if not game.uses_boards
+                         for player_key in get_game_players(game)]
+
+    entities, legacy_boards = yield (
+        ndb.get_multi_async(
+            player_keys +
+            [get_board_key(game.key, player_key)
+             for game, player_key in board_keys]),
+        [get_legacy_board_async(game, player_key)
+         for game, player_key in legacy_board_keys])
+
+    players = dict(zip(player_keys, entities[:len(player_keys)]))
+    for game in games:
+        if has_player_names(game):
+            for player in _get_named_players(game):
+                players.setdefault(player.key, player)
+    boards = dict((game.key, {}) for game in games)
+    for (game, player_key), board in zip(board_keys,
+                                         entities[len(player_keys):]):
+        if board is None:
+            board = get_new_board(game.key, player_key)
+        boards[game.key][player_key] = board
+    for (game, player_key), board in zip(legacy_board_keys, legacy_boards):
+        boards[game.key][player_key] = board
+    raise ndb.Return(players, boards)
+
+
+def get_games_entities(games):
+    return get_games_entities_async(games).get_result()
+
+
+def get_game_entities(game):
+    """Gets the players and Boards of a game with a single batched get, see
+    get_games_entities_async.
+    Returns:
+        A dict of player key to User, and a dict of player key to Board"""
+    players, boards = get_games_entities([game])
+    return players, boards[game.key]
+
+
+def get_move_log(target_name,
+                 attacking_name,
                  target_coord,
                  status,
                  piece_name=None):
-    move_log = {'target_player': target_player.name,
-                'attacking_player': attacking_player.name,
+    move_log = {'target_player': target_name,
+                'attacking_player': attacking_name,
                 'target_coordinate': target_coord,
                 'status': status}
     if piece_name:
@@ -77,78 +144,109 @@ def get_move_log(target_player,
 def get_all_coords(piece_alignment,
                    num_spaces,
                    row_index,
-                   col_index):
+                   col_index,
+                   codec):
     """Get all coordinates of the piece based on it's starting coordinates
     and piece size"""
     check_piece_alignment(piece_alignment)
     if piece_alignment == 'vertical':
-        columns = [COLUMNS[col_index]]
-        rows = ROWS[row_index: row_index + num_spaces]
+        columns = [codec.columns[col_index]]
+        rows = codec.rows[row_index: row_index + num_spaces]
     elif piece_alignment == 'horizontal':
-        columns = COLUMNS[col_index: col_index + num_spaces]
-        rows = [ROWS[row_index]]
+        columns = codec.columns[col_index: col_index + num_spaces]
+        rows = [codec.rows[row_index]]
     return [(col + row) for col in columns for row in rows]
 
 
-def get_users_active_games(user):
-    """Gets all games that a user has joined,
-    either as player one or player two"""
-    user_games = Game.query(ndb.OR(Game.player_one == user.key,
-                                   Game.player_two == user.key))
-    active_games = user_games.filter(Game.game_over == False).fetch()
-    return active_games
-
-
-def get_all_unfinished_games():
-    """Gets all games, that have started
-    (both player's pieces placed), but yet not ended"""
-    return Game.query(ndb.AND(Game.game_started == True,
-                              Game.game_over == False)).fetch()
+def get_user_games_page(user_key, status, order, limit, cursor=None):
+    """Gets one page of the games a user has joined.
+    Args:
+        user_key: The User key
+        status: One of open, placing, active or finished, or None for
+          every game that is not finished
+        order: One of newest, oldest or recently_updated
+        limit: The page size, or None for every game
+        cursor: The ndb Cursor of the page, or None for the first page
+    Returns:
+        The games, and the Cursor of the next page, or None if there are
+        no more games"""
+    query = Game.query(Game.players == user_key)
+    if status:
+        query = query.filter(Game.status == status)
+    else:
+        query = query.filter(Game.game_over == False)
+    if order == 'oldest':
+        query = query.order(Game.created)
+    elif order == 'recently_updated':
+        query = query.order(-Game.updated)
+    else:
+        query = query.order(-Game.created)
+    if limit is None:
+        return query.fetch(start_cursor=cursor), None
+    games, next_cursor, more = query.fetch_page(limit, start_cursor=cursor)
+    return games, next_cursor if more else None
 
 
-def get_misses_on_player(game, player):
-    return Miss.query(Miss.game == game.key).filter(
-        Miss.target_player == player.key)
+def _get_games_listing(status, order):
+    """Returns the name of a user games listing's status and order"""
+    return '{}.{}'.format(status or 'unfinished', order)
 
 
-def get_stripped_coord(coord):
-    column = ''.join([i for i in coord if not i.isdigit()])
-    row = ''.join([i for i in coord if i.isdigit()])
-    return column, row
+def encode_games_cursor(cursor, status, order):
+    """Returns an opaque cursor for the next page of a user games listing,
+    holding the listing's status and order along with the cursor of the
+    storage backend"""
+    return base64.urlsafe_b64encode('games:{}:{}'.format(
+        _get_games_listing(status, order), cursor))
 
 
-def get_strike_status(game_over_status, piece_sunk_status):
-    if game_over_status is True:
-        return 'Hit - Sunk Ship: Game Over'
-    elif piece_sunk_status is True:
-        return 'Hit - Sunk Ship'
-    else:
-        return 'Hit'
+def decode_games_cursor(encoded, status, order):
+    """Returns the storage backend's cursor of a user games listing
+    cursor.
+    Raises:
+        ValueError: If the cursor is malformed, or is from a listing with a
+          different status or order"""
+    try:
+        prefix, listing, cursor = base64.urlsafe_b64decode(
+            str(encoded)).split(':', 2)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if prefix != 'games' or listing != _get_games_listing(status, order):
+        raise ValueError('Invalid cursor')
+    return cursor
+
+
+def get_games_players(games):
+    """Gets the Users of the players of every game that does not have the
+    player names yet, with a single batched get.
+    Returns:
+        A dict of player key to User"""
+    player_keys = list(set(player_key for game in games
+                           if not has_player_names(game)
+                           for player_key in get_game_players(game)))
+    return dict(zip(player_keys, ndb.get_multi(player_keys)))
 
 
-def get_board_state(game, player):
-    player_pieces = get_players_pieces(game, player)
+def get_misses_on_player_async(game, player_key):
+    """Legacy Miss entities of a player, for games not yet using Boards.
+    Returns a future"""
+    return Miss.query(Miss.game == game.key).filter(
+        Miss.target_player == player_key).fetch_async()
 
-    player_board = {}
-    for col in COLUMNS:
-        player_board[col] = ["E" for i in range(0, len(ROWS))]
 
-    misses_on_player = get_misses_on_player(game, player)
+def get_miss_mask(misses):
+    """Returns the bitboard mask of a list of Miss entities"""
+    return DEFAULT_CODEC.coords_mask([miss.coordinate for miss in misses])
 
-    for miss in misses_on_player:
-        miss_col, miss_row = get_stripped_coord(miss.coordinate)
-        player_board[miss_col][int(miss_row) - 1] = "M"
 
-    for p in player_pieces:
-        p_coords = p.coordinates
-        for p_coord in p_coords:
-            p_col, p_row = get_stripped_coord(p_coord)
-            player_board[p_col][int(p_row) - 1] = "O"
+def get_game_codec(game):
+    """Returns the BoardCodec of the game's board size"""
+    return get_codec(game.board_size)
 
-        p_hit_coords = p.hit_marks
-        for p_hit_coord in p_hit_coords:
-            p_hit_coord_col, p_hit_coord_row = get_stripped_coord(
-                p_hit_coord)
-            player_board[p_hit_coord_col][int(p_hit_coord_row) - 1] = "X"
 
-    return player_board
+def get_board_state(board, codec):
+    """Returns the player's board as a string with one status character
+    per cell, in cell order"""
+    return codec.render_board(fleet_mask(board.fleet),
+                              board.hit_mask,
+                              board.miss_mask)
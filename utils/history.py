@@ -0,0 +1,101 @@
+"""Packed move history.
+
+Each move is stored on the Board that was struck, as a fixed size record
+appended to Board.strikes: the move number, the cell index of the struck
+coordinate, and one byte combining the strike status and the ship that was
+hit. Player names are not stored; the target is the owner of the Board and
+the attacker is the other player of the game.
+
+A cell can only be struck once, so a Board never holds more than one record
+per cell, and writing a move costs the same however long the game has been
+going on. The records are only decoded when the history is read."""
+
+import base64
+import heapq
+import struct
+
+from board import PIECES
+from utils.bitboard import get_codec
+from utils.engine import STATUSES
+
+RECORD = struct.Struct('>HHB')
+STATUS_CODES = dict((status, code) for code, status in enumerate(STATUSES))
+SHIPS = sorted(PIECES)
+SHIP_CODES = dict((ship, code + 1) for code, ship in enumerate(SHIPS))
+
+
+def append_move(board, codec, move_number, coord, status, ship=None):
+    """Appends a strike against the board's owner to the board, given the
+    BoardCodec of the game"""
+    code = STATUS_CODES[status] | SHIP_CODES.get(ship, 0) << 2
+    board.strikes = (board.strikes or '') + RECORD.pack(
+        move_number, codec.cell_index[coord], code)
+
+
+def count_moves(board):
+    """Returns the number of strikes made against the board's owner"""
+    return len(board.strikes or '') // RECORD.size
+
+
+def get_move_count(boards):
+    """Returns the number of moves made in a game, given it's Boards"""
+    return sum(count_moves(board) for board in boards)
+
+
+def _iter_board_moves(board, grid, target_name, attacking_name, start):
+    strikes = board.strikes or ''
+    for offset in xrange(0, len(strikes), RECORD.size):
+        move_number, cell, code = RECORD.unpack_from(strikes, offset)
+        if move_number <= start:
+            continue
+        move_log = {'target_player': target_name,
+                    'attacking_player': attacking_name,
+                    'target_coordinate': grid[cell],
+                    'status': STATUSES[code & 3]}
+        if code >> 2:
+            move_log['ship_type'] = SHIPS[(code >> 2) - 1]
+        yield move_number, move_log
+
+
+def iter_moves(game, players, boards, start=0):
+    """Lazily decodes the history of a game, in the order the moves were
+    made.
+    Args:
+        game: The Game
+        players: A dict of player key to User for the game's players, only
+          needed if the game does not have the player names yet
+        boards: A dict of player key to Board for the game's players
+        start: The index of the first move to decode
+    Yields:
+        Tuples of the move's index and it's move log dict"""
+    if not game.player_two:
+        return
+    grid = get_codec(game.board_size).grid
+    one_name = game.player_one_name or players[game.player_one].name
+    two_name = game.player_two_name or players[game.player_two].name
+    # Each board's records are already in move order
+    merged = heapq.merge(
+        _iter_board_moves(boards[game.player_one],
+                          grid, one_name, two_name, start),
+        _iter_board_moves(boards[game.player_two],
+                          grid, two_name, one_name, start))
+    for move_number, move_log in merged:
+        yield move_number - 1, move_log
+
+
+def encode_cursor(move_index):
+    """Returns an opaque cursor for the history, starting at move_index"""
+    return base64.urlsafe_b64encode('move:{}'.format(move_index))
+
+
+def decode_cursor(cursor):
+    """Returns the move index a history cursor starts at.
+    Raises:
+        ValueError: If the cursor is malformed"""
+    try:
+        prefix, move_index = base64.urlsafe_b64decode(str(cursor)).split(':')
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if prefix != 'move' or not move_index.isdigit():
+        raise ValueError('Invalid cursor')
+    return int(move_index)
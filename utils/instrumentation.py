@@ -0,0 +1,228 @@
+"""Request scoped instrumentation.
+
+InstrumentationMiddleware wraps the API and the task handlers. For every
+request it counts the datastore, memcache and other API calls by kind,
+with a hook on the apiproxy every call goes through, and the time spent
+in each named phase of the request (see phase). When the request ends, it
+logs one structured line, adds the same stats to the response as the
+X-Request-Stats header if the request sent that header, and adds the
+request to the endpoint's counts in memcache. The counts are read back by
+get_request_stats, for the /admin/request_stats handler in main.py.
+
+Stats are kept per thread, as the app is threadsafe."""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from google.appengine.api import apiproxy_stub_map, memcache
+
+STATS_HEADER = 'X-Request-Stats'
+STATS_PREFIX = 'REQUEST_STATS:'
+SPI_PREFIX = '/_ah/spi/'
+# Upper bounds of the latency histogram buckets, in milliseconds. Slower
+# requests are counted in an extra bucket
+LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+PHASES = ['validation', 'load', 'mutate', 'serialize']
+# Datastore calls by the kind they are counted as. Query results past the
+# first batch are fetched with Next, which is counted apart from queries
+DATASTORE_KINDS = {
+    'Get': 'get',
+    'RunQuery': 'query',
+    'Next': 'next',
+    'Put': 'put',
+    'Delete': 'delete',
+    'AllocateIds': 'allocate_ids',
+    'BeginTransaction': 'transaction',
+    'Commit': 'commit',
+    'Rollback': 'rollback'
+}
+RPC_KINDS = (sorted(set(DATASTORE_KINDS.values())) +
+             ['memcache', 'taskqueue', 'mail'])
+
+_local = threading.local()
+
+
+def get_rpc_kind(service, call):
+    """Returns the kind an API call is counted as"""
+    if service == 'datastore_v3':
+        return DATASTORE_KINDS.get(call, 'datastore_' + call)
+    return service
+
+
+class RequestStats(object):
+    """The API calls and phase timings of one request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.status = None
+        self.rpcs = {}
+        self.phases = {}
+        # Open phases, innermost last, as [name, start] pairs
+        self._phase_stack = []
+
+    def count_rpc(self, kind):
+        self.rpcs[kind] = self.rpcs.get(kind, 0) + 1
+
+    def _add_phase_time(self, name, start, now):
+        self.phases[name] = (self.phases.get(name, 0.0) +
+                             (now - start) * 1000)
+
+    def enter_phase(self, name):
+        """Starts timing a phase. The time of a phase entered within
+        another is only counted for the inner phase"""
+        now = time.time()
+        if self._phase_stack:
+            outer = self._phase_stack[-1]
+            self._add_phase_time(outer[0], outer[1], now)
+        self._phase_stack.append([name, now])
+
+    def exit_phase(self):
+        now = time.time()
+        name, start = self._phase_stack.pop()
+        self._add_phase_time(name, start, now)
+        if self._phase_stack:
+            self._phase_stack[-1][1] = now
+
+    def elapsed_ms(self):
+        return (time.time() - self.start) * 1000
+
+    def as_dict(self):
+        return {'endpoint': self.name,
+                'status': self.status,
+                'latency_ms': round(self.elapsed_ms(), 1),
+                'rpcs': self.rpcs,
+                'phases_ms': dict((name, round(ms, 1))
+                                  for name, ms in self.phases.iteritems())}
+
+
+def get_current_stats():
+    """Returns the RequestStats of the current request, or None outside of
+    an instrumented request"""
+    return getattr(_local, 'stats', None)
+
+
+def _count_rpc(service, call, request, response):
+    stats = get_current_stats()
+    if stats is not None:
+        stats.count_rpc(get_rpc_kind(service, call))
+
+
+@contextmanager
+def phase(name):
+    """Times the block as a phase of the current request, one of PHASES.
+    Does nothing outside of an instrumented request"""
+    stats = get_current_stats()
+    if stats is None:
+        yield
+        return
+    stats.enter_phase(name)
+    try:
+        yield
+    finally:
+        stats.exit_phase()
+
+
+def get_bucket(latency_ms):
+    """Returns the index of the latency histogram bucket of a latency"""
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if latency_ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def _record_request(stats):
+    """Adds a finished request to it's endpoint's counts in memcache, with
+    a single call. Latencies are counted in whole milliseconds"""
+    prefix = stats.name + ':'
+    counts = {prefix + 'requests': 1,
+              prefix + 'latency_ms': int(stats.elapsed_ms()),
+              prefix + 'bucket:{}'.format(get_bucket(stats.elapsed_ms())): 1}
+    if stats.status is None or stats.status >= 500:
+        counts[prefix + 'errors'] = 1
+    for kind, count in stats.rpcs.iteritems():
+        counts[prefix + 'rpc:' + kind] = count
+    for name, ms in stats.phases.iteritems():
+        counts[prefix + 'phase:' + name] = int(ms)
+    memcache.offset_multi(counts, key_prefix=STATS_PREFIX, initial_value=0)
+
+
+def get_request_stats(name):
+    """Returns the counts of an endpoint's requests since memcache last
+    evicted them: the number of requests and of server errors, the mean
+    latency, the latency histogram, and the mean number of API calls of
+    each kind and time of each phase per request"""
+    prefix = name + ':'
+    keys = ([prefix + 'requests', prefix + 'errors', prefix + 'latency_ms'] +
+            [prefix + 'bucket:{}'.format(index)
+             for index in xrange(len(LATENCY_BUCKETS) + 1)] +
+            [prefix + 'rpc:' + kind for kind in RPC_KINDS] +
+            [prefix + 'phase:' + phase_name for phase_name in PHASES])
+    counts = memcache.get_multi(keys, key_prefix=STATS_PREFIX)
+    requests = counts.get(prefix + 'requests', 0)
+
+    def mean(key):
+        return float(counts.get(key, 0)) / requests if requests else 0.0
+
+    bounds = ['<={}'.format(bound) for bound in LATENCY_BUCKETS]
+    bounds.append('>{}'.format(LATENCY_BUCKETS[-1]))
+    histogram = [[bound, counts.get(prefix + 'bucket:{}'.format(index), 0)]
+                 for index, bound in enumerate(bounds)]
+    return {'requests': requests,
+            'errors': counts.get(prefix + 'errors', 0),
+            'mean_latency_ms': mean(prefix + 'latency_ms'),
+            'latency_ms': histogram,
+            'rpcs_per_request': dict(
+                (kind, mean(prefix + 'rpc:' + kind))
+                for kind in RPC_KINDS if counts.get(prefix + 'rpc:' + kind)),
+            'phases_ms': dict(
+                (phase_name, mean(prefix + 'phase:' + phase_name))
+                for phase_name in PHASES
+                if counts.get(prefix + 'phase:' + phase_name))}
+
+
+def get_endpoint_name(environ):
+    """Returns the name requests are counted under: the API method, as
+    BattleshipAPI.strike_coord, or the path of a handler"""
+    path = environ.get('PATH_INFO', '')
+    if path.startswith(SPI_PREFIX):
+        return path[len(SPI_PREFIX):]
+    return path
+
+
+class InstrumentationMiddleware(object):
+    """WSGI middleware recording the stats of every request to app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        # The hook is only added once per apiproxy
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'request_stats', _count_rpc)
+        stats = RequestStats(get_endpoint_name(environ))
+        send_header = STATS_HEADER.upper().replace('-', '_')
+        send_header = bool(environ.get('HTTP_' + send_header))
+
+        def instrumented_start_response(status, headers, exc_info=None):
+            stats.status = int(status.split(' ', 1)[0])
+            if send_header:
+                headers = list(headers) + [
+                    (STATS_HEADER, json.dumps(stats.as_dict(),
+                                              sort_keys=True))]
+            return start_response(status, headers, exc_info)
+
+        _local.stats = stats
+        try:
+            return self.app(environ, instrumented_start_response)
+        finally:
+            _local.stats = None
+            logging.info('request_stats %s',
+                         json.dumps(stats.as_dict(), sort_keys=True))
+            try:
+                _record_request(stats)
+            except Exception:
+                logging.exception('Could not record the request stats')
@@ -0,0 +1,167 @@
+"""Migrations of existing datastore entities to newer storage layouts."""
+
+from google.appengine.ext import ndb
+
+from models.ndbModels import User, UserName, Game, Piece, Miss, Migration
+from utils.getters import (
+    get_game_players,
+    get_legacy_board,
+    get_game_entities,
+    has_player_names
+)
+from utils.history import append_move, get_move_count
+from utils.transactions import put_game
+from utils.view_cache import set_cached_version
+from utils.bitboard import DEFAULT_CODEC
+
+# Recorded once migrate_games_batch has gone through every game
+GAMES_MIGRATION = 'migrate_games'
+
+
+def migrate_game_boards(game):
+    """Moves a game's legacy Piece and Miss entities into one Board per
+    player. Games already using Boards are left untouched.
+
+    The Boards are built from the legacy kinds outside of a transaction,
+    since those can not be queried inside one, then written with put_game
+    in a transaction that re-reads the game, so a game migrated or updated
+    in the meantime is never overwritten. As with the API's writes, the
+    game's new version is then recorded in memcache, and the legacy
+    entities are only deleted once the Boards have been committed.
+    Returns:
+        True if the game was migrated"""
+    while not game.uses_boards:
+        boards = [get_legacy_board(game, player_key)
+                  for player_key in get_game_players(game)]
+        version = game.version
+
+        def migrate():
+            current = game.key.get()
+            if (current is None or current.uses_boards or
+                    current.version != version):
+                return False, current
+            current.uses_boards = True
+            put_game(current, *boards)
+            return True, current
+
+        migrated, current = ndb.transaction(migrate, xg=True)
+        if current is None:
+            # Canceled in the meantime
+            return False
+        if migrated:
+            set_cached_version(current.key.urlsafe(), current.version)
+            legacy_keys = Piece.query(Piece.game == game.key).fetch(
+                keys_only=True)
+            legacy_keys += Miss.query(Miss.game == game.key).fetch(
+                keys_only=True)
+            ndb.delete_multi(legacy_keys)
+            return True
+        # Rebuilt from the game as it is now, if it was updated but is
+        # still on the legacy kinds
+        game = current
+    return False
+
+
+def migrate_game_history(game_key):
+    """Moves a game's legacy JSON history into packed records on it's
+    Boards, see utils/history.py. The game must already be using Boards.
+    Returns:
+        True if the game was migrated"""
+    def migrate():
+        game = game_key.get()
+        if not game.history:
+            return False
+        players, boards = get_game_entities(game)
+        player_keys = dict((player.name, player.key)
+                           for player in players.itervalues())
+        for index, move in enumerate(game.history):
+            # Legacy games all use the default board size
+            append_move(boards[player_keys[move['target_player']]],
+                        DEFAULT_CODEC,
+                        index + 1,
+                        move['target_coordinate'],
+                        move['status'],
+                        move.get('ship_type'))
+        game.history = []
+        ndb.put_multi(boards.values() + [game])
+        return True
+
+    return ndb.transaction(migrate, xg=True)
+
+
+def migrate_game_names(game_key):
+    """Copies the names of a game's players and it's number of moves onto
+    the game. The game must already be using Boards.
+    Returns:
+        True if the game was migrated"""
+    def migrate():
+        game = game_key.get()
+        if has_player_names(game):
+            return False
+        players, boards = get_game_entities(game)
+        game.player_one_name = players[game.player_one].name
+        if game.player_two:
+            game.player_two_name = players[game.player_two].name
+        game.move_count = (len(game.history) or
+                           get_move_count(boards.values()))
+        game.put()
+        return True
+
+    return ndb.transaction(migrate, xg=True)
+
+
+def migrate_game(game):
+    """Moves a game onto Boards and the packed history, and copies the
+    player names onto it, whichever it is not using yet.
+    Returns:
+        True if the game was migrated"""
+    migrated = migrate_game_boards(game)
+    if game.history:
+        migrated = migrate_game_history(game.key) or migrated
+    if not has_player_names(game):
+        migrated = migrate_game_names(game.key) or migrated
+    return migrated
+
+
+def migrate_games_batch(cursor=None, batch_size=50):
+    """Migrates one page of games. The migration is recorded as complete
+    after the last page, see is_migration_complete.
+    Returns:
+        The number of games migrated, and the cursor of the next page, or
+        None if there are no more games"""
+    games, next_cursor, more = Game.query().fetch_page(batch_size,
+                                                       start_cursor=cursor)
+    migrated = len([game for game in games if migrate_game(game)])
+    if not more:
+        Migration(id=GAMES_MIGRATION).put()
+    return migrated, next_cursor if more else None
+
+
+def is_migration_complete(name):
+    """Returns True once the named migration has gone through every entity
+    of it's kind. Entities written since then are already migrated"""
+    return Migration.get_by_id(name) is not None
+
+
+def index_games_batch(cursor=None, batch_size=100):
+    """Re-puts one page of games, so that games written before the players,
+    status, created and updated properties existed get them indexed. Each
+    game is re-read in it's own transaction so a concurrent move is never
+    overwritten.
+    Returns:
+        The cursor of the next page, or None if there are no more games"""
+    game_keys, next_cursor, more = Game.query().fetch_page(
+        batch_size, start_cursor=cursor, keys_only=True)
+    for game_key in game_keys:
+        ndb.transaction(lambda: game_key.get().put())
+    return next_cursor if more else None
+
+
+def index_user_names_batch(cursor=None, batch_size=100):
+    """Adds one page of users to the UserName index.
+    Returns:
+        The cursor of the next page, or None if there are no more users"""
+    users, next_cursor, more = User.query().fetch_page(batch_size,
+                                                       start_cursor=cursor)
+    ndb.put_multi([UserName(id=user.name, user=user.key) for user in users])
+    return next_cursor if more else None
@@ -0,0 +1,66 @@
+"""Random fleet placement.
+
+Every position each ship can take on a board is precomputed once per
+board size as a bitboard mask (see utils/bitboard.py). A fleet is drawn by
+picking one position per ship from these tables, and starting over whenever
+a ship overlaps one already picked. Starting over, rather than retrying only
+the overlapping ship, keeps every valid fleet equally likely."""
+
+import random
+
+from board import PIECES
+from utils.bitboard import DEFAULT_CODEC
+
+
+def _get_positions(codec, num_spaces):
+    """Returns the mask of every position a ship of num_spaces can take"""
+    size = codec.size
+    # Cells are indexed column by column, so a vertical ship's cells are
+    # consecutive bits and a horizontal ship's are size bits apart
+    vertical = (1 << num_spaces) - 1
+    horizontal = sum(1 << (index * size) for index in xrange(num_spaces))
+    positions = []
+    for col_index in xrange(size):
+        for row_index in xrange(size):
+            cell = col_index * size + row_index
+            if row_index + num_spaces <= size:
+                positions.append(vertical << cell)
+            if col_index + num_spaces <= size:
+                positions.append(horizontal << cell)
+    return positions
+
+
+_POSITIONS = {}
+
+
+def get_positions(codec):
+    """Returns a list of each ship type and the masks of all of it's
+    positions on the codec's board, largest ships first, as they are the
+    most likely to overlap and so restart the draw the earliest"""
+    if codec.size not in _POSITIONS:
+        _POSITIONS[codec.size] = [
+            (ship, _get_positions(codec, PIECES[ship]['spaces']))
+            for ship in sorted(PIECES,
+                               key=lambda ship: -PIECES[ship]['spaces'])]
+    return _POSITIONS[codec.size]
+
+
+def random_fleet(codec=DEFAULT_CODEC, rng=random):
+    """Returns a uniformly random fleet, as a dict of ship type to the mask
+    of the cells it occupies, like Board.fleet.
+    Args:
+        codec: The BoardCodec of the board
+        rng: The random.Random to draw from, the random module by default"""
+    choice = rng.choice
+    positions_by_ship = get_positions(codec)
+    while True:
+        fleet = {}
+        occupied = 0
+        for ship, positions in positions_by_ship:
+            ship_mask = choice(positions)
+            if ship_mask & occupied:
+                break
+            fleet[ship] = ship_mask
+            occupied |= ship_mask
+        else:
+            return fleet
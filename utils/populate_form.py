@@ -1,9 +1,20 @@
-from board import COLUMNS, ROWS
+from protorpc import messages
+
+from models.requests import BoardFormat
+from utils.bitboard import (
+    get_cells_codec,
+    EMPTY,
+    OCCUPIED,
+    MISS,
+    HIT
+)
 
 from models.responses import (
     UserForm,
     GameStatusMessage,
     PieceDetails,
+    PlacedPiece,
+    FleetDetails,
     Coordinate,
     MoveDetails,
     Ranking,
@@ -12,6 +23,14 @@ from models.responses import (
 )
 
 
+COORD_STATUSES = {
+    EMPTY: CoordStatus.empty,
+    OCCUPIED: CoordStatus.occupied,
+    MISS: CoordStatus.miss,
+    HIT: CoordStatus.hit
+}
+
+
 def copy_user_to_form(user_obj):
     user_form = UserForm()
     setattr(user_form, 'name', getattr(user_obj, 'name'))
@@ -19,55 +38,75 @@ def copy_user_to_form(user_obj):
     return user_form
 
 
-def copy_game_to_form(game_obj, board_state_forms):
+def copy_game_to_form(game_key, game_obj, board_state_forms):
+    """Takes in a game's key, it's GameRecord, and it's serialized board
+    states"""
     game_form = GameStatusMessage()
 
-    setattr(game_form, 'game_key', str(game_obj.key.urlsafe()))
+    setattr(game_form, 'game_key', str(game_key))
+    setattr(game_form, 'version', game_obj.version)
+    setattr(game_form, 'board_size', game_obj.board_size)
 
     for field in game_form.all_fields():
         if (field.name == 'player_one' or field.name == 'player_two' or
                 field.name == 'player_turn' or field.name == 'winner'):
 
-            player_key = getattr(game_obj, field.name)
-
-            if player_key:
-                player = player_key.get()
-                setattr(game_form, field.name, player.name)
-            else:
-                setattr(game_form, field.name, 'None')
+            name = getattr(game_obj, field.name)
+            setattr(game_form, field.name, name or 'None')
 
-        elif hasattr(game_obj, field.name):
+        elif (isinstance(field, messages.StringField) and
+                hasattr(game_obj, field.name)):
             setattr(game_form, field.name,
                     str(getattr(game_obj, field.name)))
 
-    setattr(game_form,
-            'player_one_board_state',
-            board_state_forms['player_one'])
-
-    if board_state_forms['player_two']:
-        setattr(game_form,
-                'player_two_board_state',
-                board_state_forms['player_two'])
+    set_board_state(game_form, 'player_one', board_state_forms['player_one'])
+    set_board_state(game_form, 'player_two', board_state_forms['player_two'])
 
     return game_form
 
 
-def copy_piece_details_to_form(game, user, piece, board_state_forms):
+def copy_piece_details_to_form(game_key,
+                               owner_name,
+                               piece_type,
+                               coordinates,
+                               board_state_forms):
     piece_form = PieceDetails()
-    setattr(piece_form, 'game_key', game.key.urlsafe())
-    setattr(piece_form, 'owner', user.name)
-    setattr(piece_form, 'ship_type', piece.ship)
+    setattr(piece_form, 'game_key', game_key)
+    setattr(piece_form, 'owner', owner_name)
+    setattr(piece_form, 'ship_type', piece_type)
     setattr(piece_form, 'coordinates',
-            [Coordinate(coordinate=coord) for coord in piece.coordinates])
-    setattr(piece_form,
-            'player_one_board_state',
-            board_state_forms['player_one'])
-    setattr(piece_form,
-            'player_two_board_state',
-            board_state_forms['player_two'])
+            [Coordinate(coordinate=coord) for coord in coordinates])
+    set_board_state(piece_form,
+                    'player_one',
+                    board_state_forms['player_one'])
+    set_board_state(piece_form,
+                    'player_two',
+                    board_state_forms['player_two'])
     return piece_form
 
 
+def copy_fleet_details_to_form(game_key,
+                               game,
+                               owner_name,
+                               pieces,
+                               board_state):
+    """Takes in a game's key and GameRecord, the name of the fleet's owner,
+    a list of each piece's type and coordinates, and the owner's
+    serialized board state"""
+    fleet_form = FleetDetails()
+    setattr(fleet_form, 'game_key', game_key)
+    setattr(fleet_form, 'owner', owner_name)
+    setattr(fleet_form, 'pieces',
+            [PlacedPiece(ship_type=piece_type,
+                         coordinates=[Coordinate(coordinate=coord)
+                                      for coord in coordinates])
+             for piece_type, coordinates in pieces])
+    setattr(fleet_form, 'game_started', game.game_started)
+    setattr(fleet_form, 'version', game.version)
+    set_board_state(fleet_form, 'player', board_state)
+    return fleet_form
+
+
 def copy_move_log_to_form(index,
                           move,
                           target_player_board_state=None,
@@ -83,12 +122,12 @@ def copy_move_log_to_form(index,
             move['status'])
     setattr(move_log_form, "move_number",
             index + 1)
-    if target_player_board_state:
-        setattr(move_log_form, "target_player_board_state",
-                target_player_board_state)
-    if attacking_player_board_state:
-        setattr(move_log_form, "attacking_player_board_state",
-                attacking_player_board_state)
+    set_board_state(move_log_form,
+                    'target_player',
+                    target_player_board_state)
+    set_board_state(move_log_form,
+                    'attacking_player',
+                    attacking_player_board_state)
     if 'ship_type' in move:
         setattr(move_log_form, "ship_type",
                 move['ship_type'])
@@ -105,19 +144,32 @@ def copy_ranking_to_form(index, user_scores):
     return ranking_form
 
 
-def copy_board_state_to_form(board_state):
-    board_state_form = []
-    for col in COLUMNS:
-        for row in ROWS:
-            coord_info_form = CoordInfo(column=col, row=row)
-            coord_status = board_state[col][int(row) - 1]
-            if coord_status == 'E':
-                setattr(coord_info_form, 'value', CoordStatus('empty'))
-            elif coord_status == 'O':
-                setattr(coord_info_form, 'value', CoordStatus('occupied'))
-            elif coord_status == 'M':
-                setattr(coord_info_form, 'value', CoordStatus('miss'))
-            elif coord_status == 'X':
-                setattr(coord_info_form, 'value', CoordStatus('hit'))
-            board_state_form.append(coord_info_form)
-    return board_state_form
+def copy_board_state_to_form(board_state, board_format=BoardFormat.verbose):
+    """Takes in a board state string, as rendered by
+    BoardCodec.render_board, and returns a list of CoordInfo forms,
+    or the string itself when the compact format is requested"""
+    if board_format == BoardFormat.compact:
+        return board_state
+    labels = get_cells_codec(len(board_state)).labels
+    return [CoordInfo(column=col, row=row, value=COORD_STATUSES[status])
+            for (col, row), status in zip(labels, board_state)]
+
+
+def copy_cells_to_form(coords, status, codec):
+    """Returns a CoordInfo form for each coordinate, all with the same
+    status character"""
+    labels = [codec.labels[codec.cell_index[coord]] for coord in coords]
+    return [CoordInfo(column=col, row=row, value=COORD_STATUSES[status])
+            for col, row in labels]
+
+
+def set_board_state(form, field_prefix, board_state):
+    """Sets a serialized board state on a response form, on the
+    <field_prefix>_board field if it is in the compact format, or on the
+    <field_prefix>_board_state field if it is in the verbose format"""
+    if not board_state:
+        return
+    if isinstance(board_state, basestring):
+        setattr(form, field_prefix + '_board', board_state)
+    else:
+        setattr(form, field_prefix + '_board_state', board_state)
@@ -0,0 +1,122 @@
+"""Daily reminder emails to users whose turn it is in active games.
+
+The cron only queues the first batch task. Each batch task counts one page
+of active games by the user whose turn it is, queues tasks that mail the
+users it finished counting, then queues the next batch task with it's
+cursor. Games are read in player_turn order, so each user's games are
+contiguous and only the count of the last user of a page is carried over
+to the next batch.
+
+Every task is named after the day's run and the page or the users it
+covers, so a batch task that is retried does not queue it's mail tasks or
+the next batch again, and users are mailed once a day at most."""
+
+import datetime
+import hashlib
+import json
+
+from google.appengine.api import app_identity, mail, taskqueue
+from google.appengine.ext import ndb
+
+from models.ndbModels import Game
+
+BATCH_URL = '/tasks/send_reminders'
+MAIL_URL = '/tasks/send_reminder_mail'
+BATCH_SIZE = 500
+MAIL_BATCH_SIZE = 100
+
+
+def count_turns_batch(cursor=None, carry=None, batch_size=BATCH_SIZE):
+    """Counts one page of active games by the user whose turn it is.
+    Args:
+        cursor: The ndb Cursor of the page, or None for the first page
+        carry: The (user key, count) of the last user of the previous page,
+          or None
+    Returns:
+        A list of (user key, count) of the users whose games have all been
+        counted, the Cursor of the next page, or None if it was the last
+        page, and the carry for the next page"""
+    query = Game.query(Game.status == 'active',
+                       projection=[Game.player_turn]).order(Game.player_turn)
+    games, next_cursor, more = query.fetch_page(batch_size,
+                                                start_cursor=cursor)
+    counts = [list(carry)] if carry else []
+    for game in games:
+        if counts and counts[-1][0] == game.player_turn:
+            counts[-1][1] += 1
+        else:
+            counts.append([game.player_turn, 1])
+    if more and counts:
+        return ([tuple(count) for count in counts[:-1]],
+                next_cursor,
+                tuple(counts[-1]))
+    return [tuple(count) for count in counts], None, None
+
+
+def get_run_id():
+    """Returns the id of today's reminder run"""
+    return datetime.datetime.utcnow().strftime('%Y%m%d')
+
+
+def _get_task_name(run_id, kind, value):
+    """Returns the name of a task of a run. Task names may only hold
+    letters, digits, - and _, so the value is hashed"""
+    return 'reminders-{}-{}-{}'.format(run_id,
+                                       kind,
+                                       hashlib.md5(value).hexdigest())
+
+
+def _add_task(name, url, params):
+    """Adds a named task, unless a task of that name was already added"""
+    try:
+        taskqueue.add(name=name, url=url, params=params)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def queue_reminder_batch(run_id, cursor=None, carry=None):
+    """Queues the batch task of a page, named after the page's cursor"""
+    params = {'run_id': run_id}
+    if cursor:
+        params['cursor'] = cursor.urlsafe()
+    if carry:
+        params['carry_user'] = carry[0].urlsafe()
+        params['carry_count'] = carry[1]
+    _add_task(_get_task_name(run_id, 'batch', params.get('cursor', '')),
+              BATCH_URL,
+              params)
+
+
+def queue_reminder_mail(run_id, counts):
+    """Queues the reminders of a list of (user key, count), in tasks of at
+    most MAIL_BATCH_SIZE emails. Each task is named after it's first user,
+    who is only ever counted in one page of a run"""
+    for start in xrange(0, len(counts), MAIL_BATCH_SIZE):
+        reminders = [(user_key.urlsafe(), count)
+                     for user_key, count in counts[start:start +
+                                                   MAIL_BATCH_SIZE]]
+        _add_task(_get_task_name(run_id, 'mail', reminders[0][0]),
+                  MAIL_URL,
+                  {'reminders': json.dumps(reminders)})
+
+
+def send_reminders(reminders):
+    """Mails each user the number of games waiting for their move.
+    Args:
+        reminders: A JSON list of [url safe user key, count], as queued by
+          queue_reminder_mail"""
+    counts = [(ndb.Key(urlsafe=user_key), count)
+              for user_key, count in json.loads(reminders)]
+    users = ndb.get_multi([user_key for user_key, _ in counts])
+    sender = 'noreply@{}.appspotmail.com'.format(
+        app_identity.get_application_id())
+    for user, (_, count) in zip(users, counts):
+        if user is None:
+            continue
+        subject = 'This is a reminder!'
+        body = '''Hello {}, you currently have {} Battle Ship
+            games in progress!'''.format(user.name, count)
+        # The arguments to send_mail are:
+        # from, to, subject, body
+        mail.send_mail(sender, user.email, subject, body)
@@ -0,0 +1,294 @@
+"""Bot versus bot simulations, played with the rules of utils/engine.py
+outside of App Engine.
+
+Games are split into batches, each played by a worker of a
+multiprocessing pool with it's own seeded random.Random, so a run is
+reproducible for a given seed, batch size and number of games. Each batch
+returns a histogram of the number of moves per game and the wins of each
+seat, which are merged into the report.
+
+With --store, every finished game is also written, with it's history, to
+a storage backend (see storage/__init__.py), one put_games call per batch,
+and the time spent storing is reported.
+
+    python -m utils.simulation --games 1000000 --bots random density
+    python -m utils.simulation --games 10000 --store sqlite:simulation.db
+
+Run it from the root of the repository."""
+
+import argparse
+import multiprocessing
+import random
+import time
+
+from utils.bitboard import (
+    get_codec,
+    DEFAULT_BOARD_SIZE,
+    MIN_BOARD_SIZE,
+    MAX_BOARD_SIZE
+)
+from utils.engine import GameState, strike
+from utils.history import append_move
+from utils.placement import random_fleet
+from utils.targeting import suggest_strike
+from storage import get_repository
+from storage.base import NameTakenError
+from storage.records import UserRecord, GameRecord, BoardRecord
+
+BATCH_SIZE = 1000
+PERCENTILES = [10, 25, 50, 75, 90, 99]
+
+
+class RandomBot(object):
+    """Strikes the cells of the target board in a random order"""
+    __slots__ = ('cells',)
+
+    def __init__(self, codec, rng):
+        self.cells = range(codec.num_cells)
+        rng.shuffle(self.cells)
+
+    def next_strike(self, board, codec):
+        return 1 << self.cells.pop()
+
+
+class DensityBot(object):
+    """Strikes the cell suggested by utils/targeting.py"""
+    __slots__ = ()
+
+    def __init__(self, codec, rng):
+        pass
+
+    def next_strike(self, board, codec):
+        return codec.coord_bit(suggest_strike(board, codec)[0])
+
+
+BOTS = {'random': RandomBot,
+        'density': DensityBot}
+
+
+def get_player_names(bot_names):
+    """Returns the user names the bots play as when games are stored"""
+    return ['{}-{}'.format(bot_name, seat + 1)
+            for seat, bot_name in enumerate(bot_names)]
+
+
+def play_game(codec, bot_types, rng, moves=None):
+    """Plays a game between two bots on random fleets.
+    Args:
+        moves: A list to append each move to, as a tuple of the target
+          seat, the target bit, the status and the ship, or None
+    Returns:
+        The finished GameState"""
+    game = GameState(codec,
+                     [random_fleet(codec, rng), random_fleet(codec, rng)])
+    bots = [bot_type(codec, rng) for bot_type in bot_types]
+    while not game.game_over:
+        target = 1 - game.turn
+        target_bit = bots[game.turn].next_strike(game.boards[target], codec)
+        status, ship = strike(game, target_bit)
+        if moves is not None:
+            moves.append((target, target_bit, status, ship))
+    return game
+
+
+def get_game_records(game, moves, player_names):
+    """Returns the GameRecord and BoardRecords of a finished game"""
+    codec = game.codec
+    record = GameRecord(player_names[0], player_names[1], codec.size)
+    record.player_one_pieces_loaded = True
+    record.player_two_pieces_loaded = True
+    record.game_started = True
+    record.game_over = True
+    record.winner = record.player_turn = player_names[game.winner]
+    record.move_count = game.move_count
+    boards = [BoardRecord(name, board.fleet, board.hit_mask, board.miss_mask)
+              for name, board in zip(player_names, game.boards)]
+    for move_number, (target, target_bit, status, ship) in enumerate(moves):
+        append_move(boards[target],
+                    codec,
+                    move_number + 1,
+                    codec.grid[target_bit.bit_length() - 1],
+                    status,
+                    ship)
+    return record, boards
+
+
+def play_batch(batch):
+    """Plays a batch of games in a worker.
+    Args:
+        batch: A tuple of the board size, the names of both bots, the seed,
+          the number of games and the storage url, or None
+    Returns:
+        A dict of the number of moves to the number of games that took
+        them, the number of wins of each seat, and the seconds spent
+        storing the games"""
+    size, bot_names, seed, num_games, store = batch
+    codec = get_codec(size)
+    bot_types = [BOTS[name] for name in bot_names]
+    player_names = get_player_names(bot_names)
+    rng = random.Random(seed)
+    moves = {}
+    wins = [0, 0]
+    records = []
+    for _ in xrange(num_games):
+        game_moves = [] if store else None
+        game = play_game(codec, bot_types, rng, game_moves)
+        moves[game.move_count] = moves.get(game.move_count, 0) + 1
+        wins[game.winner] += 1
+        if store:
+            records.append(get_game_records(game, game_moves, player_names))
+    store_time = 0.0
+    if store:
+        start = time.time()
+        repository = get_repository(store)
+        repository.put_games(records)
+        repository.close()
+        store_time = time.time() - start
+    return moves, wins, store_time
+
+
+def get_batches(games,
+                size,
+                bot_names,
+                seed,
+                batch_size=BATCH_SIZE,
+                store=None):
+    """Splits games into batches, each with a seed drawn from seed"""
+    rng = random.Random(seed)
+    batches = []
+    for start in xrange(0, games, batch_size):
+        batches.append((size,
+                        bot_names,
+                        rng.getrandbits(64),
+                        min(batch_size, games - start),
+                        store))
+    return batches
+
+
+def add_players(store, bot_names):
+    """Adds the users the bots play as to the storage, unless they are
+    there already"""
+    repository = get_repository(store)
+    for name in get_player_names(bot_names):
+        try:
+            repository.add_user(UserRecord(name, name + '@example.com'))
+        except NameTakenError:
+            pass
+    repository.close()
+
+
+def run(games,
+        size=DEFAULT_BOARD_SIZE,
+        bot_names=('random', 'random'),
+        processes=None,
+        seed=None,
+        batch_size=BATCH_SIZE,
+        store=None):
+    """Plays games over a pool of processes, one per CPU by default, or in
+    this process if processes is 1. Each process opens it's own connection
+    to the storage, so the memory storage only lasts for a batch.
+    Returns:
+        The merged moves histogram and wins, the elapsed seconds and the
+        seconds spent storing games, summed over every process"""
+    bot_names = tuple(bot_names)
+    batches = get_batches(games, size, bot_names, seed, batch_size, store)
+    if store:
+        add_players(store, bot_names)
+    moves = {}
+    wins = [0, 0]
+    store_time = 0.0
+    start = time.time()
+    if processes == 1:
+        results = (play_batch(batch) for batch in batches)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(play_batch, batches)
+    try:
+        for batch_moves, batch_wins, batch_store_time in results:
+            for move_count, count in batch_moves.iteritems():
+                moves[move_count] = moves.get(move_count, 0) + count
+            wins[0] += batch_wins[0]
+            wins[1] += batch_wins[1]
+            store_time += batch_store_time
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return moves, wins, time.time() - start, store_time
+
+
+def get_percentile(moves, total, percentile):
+    """Returns the smallest number of moves at or above percentile of the
+    games, from a histogram of moves"""
+    threshold = total * percentile / 100.0
+    seen = 0
+    for move_count in sorted(moves):
+        seen += moves[move_count]
+        if seen >= threshold:
+            return move_count
+
+
+def format_report(moves, wins, elapsed, bot_names, store_time=None):
+    """Returns the report of a run, as lines of text"""
+    total = sum(moves.itervalues())
+    mean = sum(move_count * count
+               for move_count, count in moves.iteritems()) / float(total)
+    lines = ['{} games in {:.2f}s: {:.0f} games/sec'.format(
+                 total, elapsed, total / elapsed if elapsed else 0),
+             'Moves per game: min {}, mean {:.2f}, max {}'.format(
+                 min(moves), mean, max(moves)),
+             'Percentiles: ' + ', '.join(
+                 'p{} {}'.format(percentile,
+                                 get_percentile(moves, total, percentile))
+                 for percentile in PERCENTILES)]
+    for seat, bot_name in enumerate(bot_names):
+        lines.append('Player {} ({}): {} wins, {:.1%}'.format(
+            seat + 1, bot_name, wins[seat], wins[seat] / float(total)))
+    if store_time is not None:
+        lines.append('Stored in {:.2f}s of worker time: {:.0f} games/sec'
+                     .format(store_time,
+                             total / store_time if store_time else 0))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Plays bot versus bot games and reports games/sec and '
+                    'the distribution of moves per game')
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=DEFAULT_BOARD_SIZE)
+    parser.add_argument('--bots', nargs=2, choices=sorted(BOTS),
+                        default=['random', 'random'],
+                        help='The bots of player one, who strikes first, '
+                             'and player two')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Worker processes, one per CPU by default')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--store', default=None,
+                        help='Stores every game, as memory or '
+                             'sqlite:<path>')
+    args = parser.parse_args()
+    if args.games < 1:
+        parser.error('--games must be at least 1')
+    if not MIN_BOARD_SIZE <= args.size <= MAX_BOARD_SIZE:
+        parser.error('--size must be between {} and {}'.format(
+            MIN_BOARD_SIZE, MAX_BOARD_SIZE))
+    moves, wins, elapsed, store_time = run(args.games,
+                                           args.size,
+                                           args.bots,
+                                           args.processes,
+                                           args.seed,
+                                           args.batch_size,
+                                           args.store)
+    for line in format_report(moves,
+                              wins,
+                              elapsed,
+                              args.bots,
+                              store_time if args.store else None):
+        print line
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""Per-user win and loss counts, and the totals of every finished game,
+kept up to date as games end.
+
+A user's counts are split across NUM_SHARDS UserStats entities, each of
+which is it's own entity group, so users that finish many games at once do
+not contend on a single entity. Each finished game increments one randomly
+chosen shard of the winner and one of the loser. The number of finished
+games and their total moves are sharded the same way, across
+GAME_STATS_SHARDS GameStats entities. Every game that ends writes one of
+those, so there are many more of them than of a user's shards. Games
+stored in bulk by the ndb storage backend are all counted in the first
+shards, as nothing else writes to them at the same time.
+
+The daily reconciliation of the game totals records the time it's recount
+started at on the first shard. Finished games are not updated again, so
+drift is found by counting only the games that have finished since
+then."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models.ndbModels import User, Game, UserStats, GameStats
+
+NUM_SHARDS = 5
+GAME_STATS_SHARDS = 50
+AVERAGE_MOVES_KEY = 'AVERAGE_MOVES'
+
+
+def get_stats_shard_key(user_key, shard):
+    return ndb.Key(UserStats, '{}-{}'.format(user_key.id(), shard))
+
+
+def get_game_stats_shard_key(shard):
+    return ndb.Key(GameStats, str(shard))
+
+
+def _pick_shard(shard, num_shards):
+    return random.randint(0, num_shards - 1) if shard is None else shard
+
+
+def get_results_stats(results, shard=None):
+    """Returns a shard of the stats of each player of the finished games,
+    and a shard of the finished game totals, with the games counted, read
+    with a single batched get. Meant to be called in the transaction that
+    ends a game, and the returned entities put along with it.
+    Args:
+        results: A list of a tuple of the winner, the loser and the number
+          of moves of each game, the players as tuples of their User key
+          and name
+        shard: The shard to count the games in, or None for one chosen at
+          random"""
+    counts = {}
+    for winner, loser, _ in results:
+        counts.setdefault(winner, [0, 0])[0] += 1
+        counts.setdefault(loser, [0, 0])[1] += 1
+    players = counts.keys()
+    keys = [get_stats_shard_key(user_key, _pick_shard(shard, NUM_SHARDS))
+            for user_key, _ in players]
+    totals_key = get_game_stats_shard_key(_pick_shard(shard,
+                                                      GAME_STATS_SHARDS))
+    entities = ndb.get_multi(keys + [totals_key])
+    user_stats = []
+    for (user_key, name), key, stats in zip(players, keys, entities):
+        stats = stats or UserStats(key=key, user=user_key, name=name)
+        won, lost = counts[(user_key, name)]
+        stats.won += won
+        stats.lost += lost
+        user_stats.append(stats)
+    totals = entities[-1] or GameStats(key=totals_key)
+    totals.finished += len(results)
+    totals.total_moves += sum(move_count for _, _, move_count in results)
+    return user_stats + [totals]
+
+
+def _get_game_stats_shards():
+    """Returns the GameStats shards, with a single batched get. Shards
+    that have not been written yet are None"""
+    return ndb.get_multi([get_game_stats_shard_key(shard)
+                          for shard in xrange(GAME_STATS_SHARDS)])
+
+
+def _sum_game_totals(shards):
+    shards = [stats for stats in shards if stats]
+    return (sum(stats.finished for stats in shards),
+            sum(stats.total_moves for stats in shards))
+
+
+def get_game_totals():
+    """Returns the number of finished games and their total moves, summed
+    from the GameStats shards"""
+    return _sum_game_totals(_get_game_stats_shards())
+
+
+def get_average_moves():
+    """Returns the number of finished games and their average number of
+    moves, cached in memcache until the next game ends"""
+    average_moves = memcache.get(AVERAGE_MOVES_KEY)
+    if average_moves is None:
+        finished, total_moves = get_game_totals()
+        average_moves = (finished,
+                         float(total_moves) / finished if finished else 0.0)
+        memcache.add(AVERAGE_MOVES_KEY, average_moves)
+    return average_moves
+
+
+def clear_average_moves():
+    """Called after a game ends"""
+    memcache.delete(AVERAGE_MOVES_KEY)
+
+
+def has_game_totals_drift():
+    """Returns True if the number of finished games counted in the
+    GameStats shards is not the number of games counted by the last
+    reconciliation, plus those that have finished since it's recount
+    started. Only those are counted, with a keys only query, so the check
+    costs as much as the games finished since the last reconciliation.
+    Before the first reconciliation there is nothing to compare the
+    totals with, so they are taken to have drifted"""
+    shards = _get_game_stats_shards()
+    first_shard = shards[0]
+    if first_shard is None or first_shard.reconciled is None:
+        return True
+    finished, _ = _sum_game_totals(shards)
+    finished_since = Game.query(
+        Game.game_over == True,
+        Game.updated >= first_shard.reconciled).count()
+    return first_shard.reconciled_finished + finished_since != finished
+
+
+def recount_moves_batch(snapshot, cursor=None, batch_size=500):
+    """Counts the moves of one page of the games that had finished by
+    snapshot, with a projection query on their move_count. Games that end
+    during the recount are left out, as they are counted in the GameStats
+    shards as they end. Finished games are not updated again, so their
+    updated time is when they ended. Games written before move_count and
+    updated existed are not in the query's index, so the recount must only
+    run once the /tasks/migrate_games task has gone through every game
+    (see utils/migration.py).
+    Args:
+        snapshot: The UTC datetime the recount started at
+    Returns:
+        The number of games and of moves counted, and the cursor of the
+        next page, or None if there are no more games"""
+    query = Game.query(Game.game_over == True,
+                       Game.updated < snapshot,
+                       projection=[Game.move_count])
+    games, next_cursor, more = query.fetch_page(batch_size,
+                                                start_cursor=cursor)
+    total_moves = sum(game.move_count for game in games)
+    return len(games), total_moves, next_cursor if more else None
+
+
+def correct_game_totals(snapshot, counted, finished, total_moves):
+    """Adds the given corrections to the first GameStats shard, and records
+    the recount on it, for has_game_totals_drift.
+    Args:
+        snapshot: The UTC datetime the recount started at
+        counted: The number of games that had finished by snapshot
+        finished: The correction to the number of finished games
+        total_moves: The correction to their total moves"""
+    def correct():
+        key = get_game_stats_shard_key(0)
+        stats = key.get() or GameStats(key=key)
+        stats.finished += finished
+        stats.total_moves += total_moves
+        stats.reconciled = snapshot
+        stats.reconciled_finished = counted
+        stats.put()
+
+    ndb.transaction(correct)
+    clear_average_moves()
+
+
+def get_win_loss():
+    """Returns a dict of wins and losses for each user that has finished
+    a game, summed from their stats shards"""
+    win_loss = {}
+    for stats in UserStats.query():
+        if stats.name in win_loss:
+            win_loss[stats.name]['won'] += stats.won
+            win_loss[stats.name]['lost'] += stats.lost
+        else:
+            win_loss[stats.name] = {'won': stats.won, 'lost': stats.lost}
+    return win_loss
+
+
+def _get_shard_counts(shards):
+    return [(stats.won, stats.lost) if stats else None for stats in shards]
+
+
+def backfill_user_stats(user):
+    """Recounts a user's finished games from the Game kind, and stores the
+    totals in the user's first shard, clearing the others. The totals are
+    written in a transaction that checks the shards are as they were
+    before the count, and the count is taken again if a game the user
+    played ended in the meantime, so it's result is never lost"""
+    keys = [get_stats_shard_key(user.key, shard)
+            for shard in xrange(NUM_SHARDS)]
+    while True:
+        counts = _get_shard_counts(ndb.get_multi(keys, use_cache=False))
+        won = Game.query(Game.winner == user.key).count()
+        finished = (Game.query(Game.player_one == user.key,
+                               Game.game_over == True).count() +
+                    Game.query(Game.player_two == user.key,
+                               Game.game_over == True).count())
+
+        def backfill():
+            if _get_shard_counts(ndb.get_multi(keys)) != counts:
+                return False
+            if not finished:
+                ndb.delete_multi(keys)
+                return True
+            shards = [UserStats(key=key, user=user.key, name=user.name)
+                      for key in keys]
+            shards[0].won = won
+            shards[0].lost = finished - won
+            ndb.put_multi(shards)
+            return True
+
+        if ndb.transaction(backfill, xg=True):
+            return
+
+
+def backfill_stats_batch(cursor=None, batch_size=50):
+    """Backfills the stats of one page of users.
+    Returns:
+        The cursor of the next page, or None if there are no more users"""
+    users, next_cursor, more = User.query().fetch_page(batch_size,
+                                                       start_cursor=cursor)
+    for user in users:
+        backfill_user_stats(user)
+    return next_cursor if more else None
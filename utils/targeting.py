@@ -0,0 +1,115 @@
+"""Probability density targeting, used to suggest strikes and to play the
+computer opponent.
+
+Every placement of every ship that does not sink yet is weighed against
+what the attacking player knows of the target board: the misses, the hits,
+and the cells of the ships already sunk. Each cell's score is the number of
+remaining placements covering it. In hunt mode, when no hit is left on a
+ship that is still afloat, every placement that avoids the misses and the
+sunk ships counts. In target mode, only placements through at least one of
+those hits count, weighted by how many of them they cover, so the strikes
+close in on the wounded ship.
+
+The cells of every placement of each ship length are precomputed once per
+board size as a NumPy index array, so scoring a board is a gather and a
+bincount per ship, without any Python loop over placements."""
+
+import binascii
+
+import numpy
+
+from board import PIECES
+from utils.bitboard import fleet_mask, is_sunk
+
+HUNT = 'hunt'
+TARGET = 'target'
+
+_PLACEMENTS = {}
+
+
+def _build_placements(size, num_spaces):
+    """Returns an array of the cell indices of every placement of a ship of
+    num_spaces on a board of size, one row per placement"""
+    indices = numpy.arange(size)
+    first = indices[:size - num_spaces + 1]
+    # Cells are indexed column by column: rows are consecutive cells and
+    # columns are size cells apart
+    vertical_starts = (indices[:, numpy.newaxis] * size + first).ravel()
+    horizontal_starts = (first[:, numpy.newaxis] * size + indices).ravel()
+    offsets = numpy.arange(num_spaces)
+    return numpy.concatenate([
+        vertical_starts[:, numpy.newaxis] + offsets,
+        horizontal_starts[:, numpy.newaxis] + offsets * size])
+
+
+def get_placements(size, num_spaces):
+    """Returns the cached placement array of a ship length and board size"""
+    key = (size, num_spaces)
+    if key not in _PLACEMENTS:
+        _PLACEMENTS[key] = _build_placements(size, num_spaces)
+    return _PLACEMENTS[key]
+
+
+def mask_array(mask, num_cells):
+    """Returns a boolean array of num_cells, True for every bit set in
+    mask"""
+    num_bytes = (num_cells + 7) // 8
+    packed = numpy.frombuffer(binascii.unhexlify('%0*x' % (num_bytes * 2,
+                                                           mask)),
+                              dtype=numpy.uint8)
+    return numpy.unpackbits(packed)[::-1][:num_cells].astype(bool)
+
+
+def get_heatmap(board, codec):
+    """Scores every cell of the target board by the number of placements of
+    the ships still afloat that cover it, using only what the attacker
+    knows of the board.
+    Args:
+        board: The target player's Board
+        codec: The BoardCodec of the game
+    Returns:
+        The array of scores, one per cell, 0 for cells already struck, and
+        the mode, HUNT or TARGET"""
+    num_cells = codec.num_cells
+    afloat = [ship for ship, ship_mask in board.fleet.iteritems()
+              if not is_sunk(ship_mask, board.hit_mask)]
+    sunk_mask = fleet_mask(board.fleet) & ~fleet_mask(
+        dict((ship, board.fleet[ship]) for ship in afloat))
+    open_hits = mask_array(board.hit_mask & ~sunk_mask, num_cells)
+    blocked = mask_array(board.miss_mask | sunk_mask, num_cells)
+    mode = TARGET if open_hits.any() else HUNT
+
+    heatmap = numpy.zeros(num_cells)
+    for ship in afloat:
+        placements = get_placements(codec.size, PIECES[ship]['spaces'])
+        valid = ~blocked[placements].any(axis=1)
+        if mode == TARGET:
+            weights = open_hits[placements].sum(axis=1) * valid
+            valid = weights > 0
+            weights = weights[valid]
+        else:
+            weights = None
+        cells = placements[valid]
+        if weights is not None:
+            weights = numpy.repeat(weights, cells.shape[1])
+        heatmap += numpy.bincount(cells.ravel(),
+                                  weights=weights,
+                                  minlength=num_cells)
+    heatmap[mask_array(board.hit_mask | board.miss_mask, num_cells)] = 0
+    return heatmap, mode
+
+
+def suggest_strike(board, codec):
+    """Returns the coordinate most likely to hit a ship on the target
+    board, the mode it was picked in, and the share of the heatmap on that
+    cell"""
+    heatmap, mode = get_heatmap(board, codec)
+    cell = int(heatmap.argmax())
+    total = heatmap.sum()
+    if not total:
+        # Only struck cells left to score, strike the first open cell
+        struck = mask_array(board.hit_mask | board.miss_mask,
+                            codec.num_cells)
+        cell = int(numpy.flatnonzero(~struck)[0])
+        return codec.grid[cell], mode, 0.0
+    return codec.grid[cell], mode, float(heatmap[cell] / total)
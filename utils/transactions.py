@@ -0,0 +1,99 @@
+"""Versioned read-modify-write updates of games.
+
+Every write to a game bumps it's version counter, and a game is only
+written while it's stored version is still the version it was read at
+(see Repository.put_game), so concurrent writes to the same game conflict
+instead of silently overwriting each other. The losing update is retried
+from a fresh read a bounded number of times before giving up with a
+retryable error. The datastore backend checks the version in a
+transaction, and writes the game with put_game below.
+"""
+
+import httplib
+import logging
+import random
+import time
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from storage.base import VersionConflictError
+from utils.validators import check_game_exists
+
+MAX_RETRIES = 3
+RETRY_DELAY = 0.05
+CONTENTION_PREFIX = 'CONTENTION:'
+
+
+class GameContentionException(endpoints.ServiceException):
+    """Raised when a game could not be updated because of concurrent
+    updates to the same game. The request may be retried as is"""
+    http_status = httplib.SERVICE_UNAVAILABLE
+
+
+def put_game(game, *entities):
+    """Bumps the Game entity's version and stores it along with any other
+    entities that were changed, in one batched put"""
+    game.version += 1
+    ndb.put_multi([game] + list(entities))
+
+
+def record_contention(name, attempts, conflicts, failed):
+    """Keeps running counts of attempts, conflicts and failures
+    per endpoint in memcache"""
+    memcache.offset_multi({name + ':attempts': attempts,
+                           name + ':conflicts': conflicts,
+                           name + ':failures': int(failed)},
+                          key_prefix=CONTENTION_PREFIX,
+                          initial_value=0)
+
+
+def get_contention_stats(name):
+    """Returns the attempt, conflict and failure counts of an endpoint,
+    and the share of attempts that conflicted"""
+    counts = memcache.get_multi([name + ':attempts',
+                                 name + ':conflicts',
+                                 name + ':failures'],
+                                key_prefix=CONTENTION_PREFIX)
+    attempts = counts.get(name + ':attempts', 0)
+    conflicts = counts.get(name + ':conflicts', 0)
+    return {'attempts': attempts,
+            'conflicts': conflicts,
+            'failures': counts.get(name + ':failures', 0),
+            'contention_rate': (float(conflicts) / attempts
+                                if attempts else 0.0)}
+
+
+def run_game_update(repository, name, game_id, update):
+    """Reads a game and calls update with it, retrying from a fresh read
+    if the game was changed before update wrote it
+    Args:
+        repository: The Repository the game is stored in
+        name: The name of the endpoint, used for the contention metrics
+        game_id: The id of the game
+        update: A function of the GameRecord that validates the game, and
+          writes it's changes to the repository
+    Returns:
+        The return value of update
+    Raises:
+        endpoints.NotFoundException: If the game does not exist
+        GameContentionException: If every attempt conflicted"""
+    conflicts = 0
+    for attempt in xrange(MAX_RETRIES + 1):
+        game = repository.get_game(game_id)
+        check_game_exists(game)
+        try:
+            result = update(game)
+        except VersionConflictError:
+            conflicts += 1
+            logging.warning('%s conflicted on attempt %d', name, attempt + 1)
+            if attempt < MAX_RETRIES:
+                time.sleep(RETRY_DELAY * (2 ** attempt) * random.random())
+            continue
+        repository.record_contention(name, attempt + 1, conflicts, False)
+        return result
+
+    repository.record_contention(name, MAX_RETRIES + 1, conflicts, True)
+    raise GameContentionException(
+        'This game is being updated by another request, please retry')
@@ -1,8 +1,9 @@
 import endpoints
 from re import match
 
-from models.ndbModels import User, Miss
-from board import COLUMNS, ROWS, GRID
+from board import PIECES
+from utils.bitboard import MIN_BOARD_SIZE, MAX_BOARD_SIZE
+from utils.engine import RuleViolation, check_placement, check_strike
 
 
 def check_email(email):
@@ -19,22 +20,49 @@ def check_username_len(username):
             'Username must be at least 3 characters')
 
 
-def check_user_exists(username):
-    if User.query(User.name == username).get():
+def check_username_not_reserved(username, reserved_names):
+    """Raise error if the name is one of reserved_names, ignoring case"""
+    if username.lower() in [name.lower() for name in reserved_names]:
         raise endpoints.ConflictException(
-            'A User with that name already exists')
+            'That name is reserved')
 
 
-def check_email_exists(email):
-    if User.query(User.email == email).get():
+def check_history_page(since_move, limit):
+    if since_move is not None and since_move < 0:
+        raise endpoints.BadRequestException(
+            'since_move must not be negative')
+    if limit is not None and limit < 1:
+        raise endpoints.BadRequestException('limit must be at least 1')
+
+
+def check_games_page_limit(limit, max_limit):
+    if not 1 <= limit <= max_limit:
+        raise endpoints.BadRequestException(
+            'limit must be between 1 and {}'.format(max_limit))
+
+
+def check_user_found(user, username):
+    if user is None:
+        raise endpoints.ConflictException(
+            '{} does not exist.'.format(username))
+
+
+def check_email_unused(email_user):
+    """Raise error if a user, found by their e-mail, already has it"""
+    if email_user is not None:
         raise endpoints.ConflictException(
             'A User with that E-Mail already exists')
 
 
-def check_player_registered(game, player):
-    if game.player_one != player.key and game.player_two != player.key:
+def check_game_exists(game):
+    if game is None:
+        raise endpoints.NotFoundException('Game not found')
+
+
+def check_player_registered(game, player_name):
+    if player_name not in game.players:
         raise endpoints.ConflictException(
-            '{} is not registered for this game'.format(player.name))
+            '{} is not registered for this game'.format(player_name))
 
 
 def check_players_unique(player_one_name, player_two_name):
@@ -43,33 +71,53 @@ def check_players_unique(player_one_name, player_two_name):
             'Player one cannot be the same as player two.')
 
 
+def check_computer_opponent(player_two_name):
+    if player_two_name:
+        raise endpoints.BadRequestException(
+            'A game against the computer cannot have a player two')
+
+
 def check_game_open(game):
     if game.player_two:
         raise endpoints.ConflictException('This game is already full!')
 
 
-def check_coords_validity(row_coord, col_coord):
-    """Raise errors if the row or column coordinates are not valid"""
-    if row_coord not in ROWS:
+def check_board_size(board_size):
+    if not MIN_BOARD_SIZE <= board_size <= MAX_BOARD_SIZE:
+        raise endpoints.BadRequestException(
+            'Board size must be between {} - {}'.format(MIN_BOARD_SIZE,
+                                                        MAX_BOARD_SIZE))
+
+
+def check_coords_validity(row_coord, col_coord, codec):
+    """Raise errors if the row or column coordinates are not valid on the
+    game's board, described by it's BoardCodec"""
+    if row_coord not in codec.row_index:
         raise endpoints.ConflictException(
-            'Row coordinate must be between 1 - 10')
+            'Row coordinate must be between {} - {}'.format(codec.rows[0],
+                                                            codec.rows[-1]))
 
-    if col_coord not in COLUMNS:
+    if col_coord not in codec.column_index:
         raise endpoints.ConflictException(
-            'Column coordinate must be between A - J')
+            'Column coordinate must be between {} - {}'.format(
+                codec.columns[0], codec.columns[-1]))
 
 
-def check_board_boundaries(piece_alignment, num_spaces, row_index, col_index):
+def check_board_boundaries(piece_alignment,
+                           num_spaces,
+                           row_index,
+                           col_index,
+                           codec):
     """Raise errors if the peice is being placed outside of the bounds of
     the board"""
     if (piece_alignment == 'vertical' and
-            row_index + num_spaces > len(ROWS)):
+            row_index + num_spaces > codec.size):
 
         raise endpoints.ConflictException(
             'Your piece has gone past the boundaries of the board')
 
     if (piece_alignment == 'horizontal' and
-            col_index + num_spaces > len(COLUMNS)):
+            col_index + num_spaces > codec.size):
 
         raise endpoints.ConflictException(
             'Your piece has gone past the boundaries of the board')
@@ -89,25 +137,22 @@ def check_piece_alignment(piece_alignment):
             '{} is not a valid piece alignment'.format(piece_alignment))
 
 
-def check_placement_validity(game,
-                             player_pieces,
-                             piece_type,
-                             piece_coords):
+def check_placement_validity(board, piece_type, piece_mask, codec):
     """Raise errors if piece placement is invalid:
     if the piece has already been placed,
     or if the piece being placed intersects with another piece"""
-    for placed_piece in player_pieces:
-        # Raise error if the piece has already been placed on the
-        # player's board
-        if placed_piece.ship == piece_type:
-            raise endpoints.ConflictException(
-                'This piece has already been placed for this player')
-        # Raise error if piece intersects with any other piece
-        for placed_coordinate in placed_piece.coordinates:
-            if placed_coordinate in piece_coords:
-                raise endpoints.ConflictException(
-                    'Your piece intersects with {}'
-                    .format(placed_coordinate))
+    try:
+        check_placement(board, piece_type, piece_mask, codec)
+    except RuleViolation as e:
+        raise endpoints.ConflictException(str(e))
+
+
+def check_fleet_complete(piece_types):
+    """Raise error unless there is exactly one of each piece"""
+    if sorted(piece_types) != sorted(PIECES):
+        raise endpoints.ConflictException(
+            'A fleet must have exactly one of each piece: {}'
+            .format(', '.join(sorted(PIECES))))
 
 
 def check_game_not_over(game):
@@ -125,38 +170,26 @@ def check_game_started(game):
             all the pieces must first be loaded by both players''')
 
 
-def check_not_self_strike(game, target_player):
+def check_not_self_strike(game, target_name):
     """"Ensure the player who's turn it is to strike is
     not the one being struck"""
-    if game.player_turn == target_player.key:
+    if game.player_turn == target_name:
         raise endpoints.ConflictException(
-            'It is {}\'s turn to strike'.format(target_player.name))
+            'It is {}\'s turn to strike'.format(target_name))
 
 
-def check_coord_validity(coord):
+def check_coord_validity(coord, codec):
     """Ensure passed in coordinate is a valid coordinate
     for the Game Board"""
-    if coord not in GRID:
+    if coord not in codec.cell_index:
         raise endpoints.ConflictException(
             '{} is not a valid coordinate'.format(coord))
 
 
-def check_not_double_hit(pieces, target_coord):
-    """Check for ensuring a coordinate that has
-    already been hit is not being hit again"""
-    pieces_hit_coords = [piece.hit_marks for piece in pieces]
-    for hit_coords in pieces_hit_coords:
-        if target_coord in hit_coords:
-            raise endpoints.ConflictException(
-                'This coordinate has already been hit')
-
-
-def check_not_double_miss(game, target_player, target_coord):
-    """Ensure that the coordinate being struck has not previsouly
-    been attempted and missed against target player for given game"""
-    misses = Miss.query(Miss.game == game.key).filter(
-        Miss.target_player == target_player.key).fetch()
-    miss_coords = [missCoord.coordinate for missCoord in misses]
-    if target_coord in miss_coords:
-        raise endpoints.ConflictException(
-            'This coordinate has already been struck and missed')
+def check_strike_validity(board, target_bit):
+    """Ensure that the coordinate being struck has not previously been hit,
+    or attempted and missed, against the board's player"""
+    try:
+        check_strike(board, target_bit)
+    except RuleViolation as e:
+        raise endpoints.ConflictException(str(e))
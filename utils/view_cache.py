@@ -0,0 +1,110 @@
+"""Read-through memcache cache of fully built GameStatusMessage forms.
+
+Views are cached under the game's key, version and board format. Every
+write to a game bumps it's version (see utils/transactions.py) and records
+the new version in memcache, unless a newer one is already recorded, so
+readers can find the current view of a game without touching the
+datastore, and views of older versions are never served again; they are
+simply left to expire."""
+
+import logging
+
+from google.appengine.api import memcache
+from protorpc import protobuf
+
+from models.responses import GameStatusMessage
+
+VERSION_PREFIX = 'GAME_VERSION:'
+VIEW_PREFIX = 'GAME_VIEW:'
+STATS_PREFIX = 'GAME_VIEW_CACHE:'
+# Bounds how long a version missed by a failed memcache write is served
+VERSION_TTL = 600
+VIEW_TTL = 3600
+# Attempts at setting a version before giving up and deleting it
+CAS_RETRIES = 3
+
+
+def _get_view_key(urlsafe, version, board_format):
+    return '{}:{}:{}'.format(urlsafe, version, board_format.name)
+
+
+def get_cached_version(urlsafe):
+    """Returns the current version of the game, or None if not cached"""
+    return memcache.get(VERSION_PREFIX + urlsafe)
+
+
+def set_cached_version(urlsafe, version):
+    """Records a game's new version. Called after every write to a game.
+    Writes that commit one after the other may get here in either order,
+    so the version is compared and set with gets and cas, and a newer
+    version is never replaced by an older one. If it can not be set, the
+    version is deleted, and read from the datastore by the next reader"""
+    key = VERSION_PREFIX + urlsafe
+    client = memcache.Client()
+    for _ in xrange(CAS_RETRIES):
+        cached = client.gets(key)
+        if cached is None:
+            if client.add(key, version, time=VERSION_TTL):
+                return
+        elif cached >= version:
+            return
+        elif client.cas(key, version, time=VERSION_TTL):
+            return
+    memcache.delete(key)
+
+
+def add_cached_version(urlsafe, version):
+    """Records a game's version as read from the datastore. Unlike
+    set_cached_version, never overwrites a version recorded by a write
+    that committed after the read"""
+    memcache.add(VERSION_PREFIX + urlsafe, version, time=VERSION_TTL)
+
+
+def delete_cached_version(urlsafe):
+    memcache.delete(VERSION_PREFIX + urlsafe)
+
+
+def _record_stats(hits, misses):
+    memcache.offset_multi({'hits': hits, 'misses': misses},
+                          key_prefix=STATS_PREFIX,
+                          initial_value=0)
+    logging.debug('Game view cache: %d hits, %d misses', hits, misses)
+
+
+def get_view_cache_stats():
+    """Returns the number of cache hits and misses, and the hit rate"""
+    stats = memcache.get_multi(['hits', 'misses'], key_prefix=STATS_PREFIX)
+    hits = stats.get('hits', 0)
+    misses = stats.get('misses', 0)
+    total = hits + misses
+    return {'hits': hits,
+            'misses': misses,
+            'hit_rate': float(hits) / total if total else 0.0}
+
+
+def get_cached_views(versions, board_format):
+    """Gets cached views with a single memcache call.
+    Args:
+        versions: A dict of urlsafe game key to game version
+        board_format: The BoardFormat of the views
+    Returns:
+        A dict of urlsafe game key to GameStatusMessage, for the games
+        that had a view cached"""
+    view_keys = dict((_get_view_key(urlsafe, version, board_format), urlsafe)
+                     for urlsafe, version in versions.iteritems())
+    cached = memcache.get_multi(view_keys.keys(), key_prefix=VIEW_PREFIX)
+    _record_stats(len(cached), len(view_keys) - len(cached))
+    return dict((view_keys[view_key],
+                 protobuf.decode_message(GameStatusMessage, encoded))
+                for view_key, encoded in cached.iteritems())
+
+
+def cache_views(game_forms, board_format):
+    """Caches a list of GameStatusMessage views, each under the version
+    it was built from"""
+    memcache.set_multi(
+        dict((_get_view_key(form.game_key, form.version, board_format),
+              protobuf.encode_message(form))
+             for form in game_forms),
+        key_prefix=VIEW_PREFIX,
+        time=VIEW_TTL)